@@ -12,6 +12,10 @@ from .db import (
     select_db,
     isbound,
     state,
+    metrics,
+    prometheus,
+    slowlog,
+    transaction,
     FetchResult,
     ExecResult,
     Binder,
@@ -1,8 +1,29 @@
 from __future__ import annotations
 
-from typing import Any, Optional, Union, List, Tuple, Dict
-
-from . import util
+import hashlib
+import re
+from typing import Any, Optional, Union, List, Tuple, Dict, Hashable
+
+from . import util, _cache
+
+# Scanned left to right, so that the quotes in the comments and the
+# comment marks in the strings or the names are left alone
+_TOKEN = re.compile(
+    r"(`(?:[^`]|``)*`|/\*\+.*?\*/)"
+    r"|('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\")"
+    r"|/\*.*?\*/|(?:--\s|#)[^\n]*",
+    re.S,
+)
+_NUMBER = re.compile(
+    r"(?<![\w`.])(?:0x[0-9a-fA-F]+|-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)\b"
+)
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+# A sequence param of IN is expanded to a list by the driver
+_IN = re.compile(r"\bIN\s*(?:\?|\(\.\.\.\))", re.I)
+_ROWS = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+_SPACE = re.compile(r"\s+")
+# sql -> (digest, normalized sql)
+_DIGESTS = _cache.LRU(1024)
 
 
 class Context:
@@ -61,6 +82,23 @@ class Context:
     def parse(self, node: Node) -> Context:
         return self.sql(node)
 
+    def key(self, obj: Any) -> Hashable:
+        if isinstance(obj, Node):
+            return obj.__key__(self)
+        if isinstance(obj, Context):
+            raise Uncacheable(obj)
+
+        self.values(obj)
+        return None
+
+    def keys(self, nodes: List[Any]) -> Tuple[Hashable, ...]:
+        """The key of ``CommaNodeList(nodes)``"""
+
+        with self(parens=False):
+            return tuple(
+                self.key(n) if isinstance(n, Node) else n for n in nodes
+            )
+
     def table_alias(self, source: str) -> str:
         if source not in self._sources:
             self._sources.append(source)
@@ -88,15 +126,19 @@ class Context:
         self._values.append(value)
         return self
 
+    @property
+    def params(self) -> Tuple[Any, ...]:
+        return tuple(self._values)
+
     def query_of(self) -> Query:
         if self._sql[-1] != self._SEMI:
             self.literal(self._SEMI)
-        return Query(''.join(self._sql), params=tuple(self._values))
+        return Query(''.join(self._sql), params=self.params)
 
 
 class Query:
 
-    __slots__ = ('_sql', '_params', '_fread')
+    __slots__ = ('_sql', '_params', '_fread', '_digest')
 
     _QKS = ("SELECT", "SHOW")
 
@@ -110,6 +152,7 @@ class Query:
         self._sql = sql
         self._params = params or []
         self._fread = fread
+        self._digest = None  # type: Optional[str]
 
     def __repr__(self) -> str:
         return f"Query({self.sql} % {self.params})"
@@ -137,6 +180,23 @@ class Query:
             raise TypeError("invalid query params")
         return tuple(self._params)
 
+    @property
+    def digest(self) -> str:
+        """The fingerprint of the shape of the query, queries that
+        differ only by the values of the params or the literals, the
+        length of the lists of them, and the whitespace share it.
+        see ``normalize``
+        """
+        if self._digest is None:
+            self._digest = fingerprint(self.sql)
+        return self._digest
+
+    @property
+    def normalized(self) -> str:
+        """The normalized text the digest is the hash of"""
+
+        return normalize(self.sql)
+
     @property
     def r(self) -> bool:
         if self._fread is not None:
@@ -154,6 +214,47 @@ class Query:
         self._fread = isr
 
 
+def normalize(sql: str) -> str:
+    """Returns the text of the statement with the comments removed,
+    optimizer hints excepted, the literals and the placeholders
+    replaced by '?', the lists of them, the params of IN and the
+    rows of VALUES collapsed to '(...)' and the whitespace squeezed.
+
+    >>> normalize("SELECT * FROM `t` WHERE `id` IN (1, 2) LIMIT %s;")
+    'SELECT * FROM `t` WHERE `id` IN (...) LIMIT ?;'
+    """
+    return _digest(sql)[1]
+
+
+def fingerprint(sql: str) -> str:
+    """Returns the digest of the statement, the hex of the hash of
+    its ``normalize`` text, stable across processes"""
+
+    return _digest(sql)[0]
+
+
+def _digest(sql: str) -> Tuple[str, str]:
+    item = _DIGESTS.get(sql)
+    if item is None:
+        text = _TOKEN.sub(_token, sql.replace('%s', '?'))
+        text = _NUMBER.sub('?', text)
+        text = _LIST.sub('(...)', text)
+        text = _IN.sub('IN (...)', text)
+        text = _ROWS.sub('(...)', text)
+        text = _SPACE.sub(' ', text).strip()
+        digest = hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+        item = (digest, text)
+        _DIGESTS.put(sql, item)
+    return item
+
+
+def _token(match: Any) -> str:
+    name_or_hint, string = match.groups()
+    if name_or_hint is not None:
+        return name_or_hint
+    return '?' if string is not None else ' '
+
+
 class Node:
 
     __slots__ = ()
@@ -161,6 +262,19 @@ class Node:
     def __sql__(self, ctx: Context) -> Context:
         raise NotImplementedError
 
+    def __key__(self, ctx: Context) -> Hashable:
+        """Returns the structural key of the node, nodes with the same
+        key are rendered to the same SQL. It walks the node like
+        ``__sql__`` does to collect the params into ``ctx``, raises
+        ``Uncacheable`` if the node can not be cached, which is the
+        default.
+        """
+        raise Uncacheable(self)
+
+
+class Uncacheable(NotImplementedError):
+    """The node has no structural key, see ``Node.__key__``"""
+
 
 class NodeList(Node):
 
@@ -196,6 +310,13 @@ class NodeList(Node):
 
         return ctx
 
+    def __key__(self, ctx: Context) -> Hashable:
+        with ctx(parens=self.parens):
+            return (NodeList, self.glue, self.parens, tuple(
+                ctx.key(n) if isinstance(n, Node) else n
+                for n in self.nodes
+            ))
+
     def append(self, node: Union[Node, List[Node]]) -> NodeList:
         if isinstance(node, list):
             self.nodes.extend(node)
@@ -241,6 +362,11 @@ class SQL(Node):
             ctx.values(self.params)
         return ctx
 
+    def __key__(self, ctx: Context) -> Hashable:
+        if self.params is not None:
+            ctx.values(self.params)
+        return (SQL, self.sql, self.params is not None)
+
 
 class Value(Node):
 
@@ -253,6 +379,10 @@ class Value(Node):
         ctx.literal('%s').values(self.v)
         return ctx
 
+    def __key__(self, ctx: Context) -> Hashable:
+        ctx.values(self.v)
+        return (Value,)
+
     @property
     def v(self) -> Any:
         return self._v
@@ -260,3 +390,81 @@ class Value(Node):
 
 def parse(node: Node) -> Query:
     return Context().parse(node).query_of()
+
+
+class Templates:
+    """The rendered SQL of queries keyed by their structure, e.g. the
+    tables, columns, operators and clauses, so that queries which
+    differ only in their params skip the rendering and only collect
+    the params on a hit.
+
+    :param int maxsize: Maximum number of templates, 0 to disable
+    """
+
+    __slots__ = ('_lru',)
+
+    def __init__(self, maxsize: int = 512) -> None:
+        self._lru = None  # type: Optional[_cache.LRU]
+        self.resize(maxsize)
+
+    def resize(self, maxsize: int) -> None:
+        if maxsize < 0:
+            raise ValueError(f"invalid templates maxsize: {maxsize}")
+        if not maxsize:
+            self._lru = None
+        elif self._lru is None:
+            self._lru = _cache.LRU(maxsize)
+        else:
+            self._lru.resize(maxsize)
+
+    def clear(self) -> None:
+        if self._lru is not None:
+            self._lru.clear()
+
+    def query_of(self, node: Node) -> Tuple[Query, Dict[str, Any]]:
+        """Returns the query of the node and the column aliases of it"""
+
+        if self._lru is None:
+            ctx = Context.from_node(node)
+            return ctx.query_of(), ctx.aliases
+
+        kctx = Context()
+        try:
+            key = kctx.key(node)
+        except NotImplementedError:
+            key = None
+        if key is not None:
+            template = self._lru.get(key)
+            if template is not None:
+                sql, aliases = template
+                return Query(sql, params=kctx.params), aliases
+
+        ctx = Context.from_node(node)
+        query = ctx.query_of()
+        if key is not None:
+            try:
+                matched = query.params == kctx.params
+            except Exception:  # pylint: disable=broad-except
+                matched = False
+            if matched:
+                self._lru.put(key, (query.sql, ctx.aliases))
+        return query, ctx.aliases
+
+    def stats(self) -> util.adict:
+        if self._lru is None:
+            return util.adict(
+                size=0, maxsize=0, hits=0, misses=0, evictions=0
+            )
+        return self._lru.stats()
+
+
+TEMPLATES = Templates()
+
+
+def templates(maxsize: Optional[int] = None) -> util.adict:
+    """Returns the stats of the query templates cache,
+    resizes it first if "maxsize" is given, 0 to disable.
+    """
+    if maxsize is not None:
+        TEMPLATES.resize(maxsize)
+    return TEMPLATES.stats()
@@ -0,0 +1,300 @@
+"""
+    helo._cache
+    ~~~~~~~~~~~
+
+    Implements the in-process caches used by helo.
+"""
+from __future__ import annotations
+
+import sys
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from . import util
+
+_MISSING = object()
+
+
+class LRU:
+    """A bounded mapping that discards the least recently used entries.
+
+    :param int maxsize: Maximum number of entries to keep
+    """
+
+    __slots__ = ('_data', 'maxsize', 'hits', 'misses', 'evictions')
+
+    def __init__(self, maxsize: int = 128) -> None:
+        if maxsize <= 0:
+            raise ValueError(f"invalid cache maxsize: {maxsize}")
+        self._data = OrderedDict()  # type: OrderedDict
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __repr__(self) -> str:
+        return f"<LRU[{len(self._data)}/{self.maxsize}]>"
+
+    __str__ = __repr__
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._data.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> List[Tuple[Hashable, Any]]:
+        """Store the value and return the entries evicted for it"""
+
+        self._data[key] = value
+        self._data.move_to_end(key)
+        return self._trim()
+
+    def resize(self, maxsize: int) -> List[Tuple[Hashable, Any]]:
+        """Change the maximum size and return the entries evicted for it"""
+
+        if maxsize <= 0:
+            raise ValueError(f"invalid cache maxsize: {maxsize}")
+        self.maxsize = maxsize
+        return self._trim()
+
+    def _trim(self) -> List[Tuple[Hashable, Any]]:
+        evicted = []
+        while len(self._data) > self.maxsize:
+            evicted.append(self._data.popitem(last=False))
+            self.evictions += 1
+        return evicted
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> util.adict:
+        return util.adict(
+            size=len(self._data),
+            maxsize=self.maxsize,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+        )
+
+
+class TTL(LRU):
+    """A ``LRU`` whose entries expire after ``ttl`` seconds.
+
+    :param int maxsize: Maximum number of entries to keep
+    :param float ttl: Seconds an entry lives, None for never expire
+    """
+
+    __slots__ = ('ttl', 'expirations')
+
+    def __init__(
+        self, maxsize: int = 128, ttl: Optional[float] = None
+    ) -> None:
+        if ttl is not None and ttl <= 0:
+            raise ValueError(f"invalid cache ttl: {ttl}")
+        super().__init__(maxsize)
+        self.ttl = ttl
+        self.expirations = 0
+
+    def __repr__(self) -> str:
+        return f"<TTL[{len(self._data)}/{self.maxsize}] {self.ttl}s>"
+
+    __str__ = __repr__
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._lookup(key) is not _MISSING
+
+    def _lookup(self, key: Hashable) -> Any:
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            return item
+        expires, value = item
+        if expires is not None and expires <= monotonic():
+            del self._data[key]
+            self.expirations += 1
+            return _MISSING
+        return value
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._lookup(key)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> List[Tuple[Hashable, Any]]:
+        expires = None if self.ttl is None else monotonic() + self.ttl
+        return super().put(key, (expires, value))
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, _MISSING)
+        return default if item is _MISSING else item[1]
+
+    def stats(self) -> util.adict:
+        stats = super().stats()
+        stats.ttl = self.ttl
+        stats.expirations = self.expirations
+        return stats
+
+
+class QueryCache:
+    """The results of queries bounded by their approximate size in
+    bytes, each entry expires after its own ttl and is indexed by the
+    names of the tables it reads, so that a write to one of them
+    discards it.
+
+    :param int maxbytes: Maximum bytes of the results to keep
+    """
+
+    __slots__ = (
+        '_data', '_tables', '_generations', 'maxbytes', 'nbytes',
+        'hits', 'misses', 'evictions', 'expirations', 'invalidations',
+    )
+
+    def __init__(self, maxbytes: int = 32 * 1024 * 1024) -> None:
+        if maxbytes <= 0:
+            raise ValueError(f"invalid cache maxbytes: {maxbytes}")
+        # key -> (expires, value, nbytes, tables)
+        self._data = OrderedDict()  # type: OrderedDict
+        self._tables = {}           # type: Dict[str, Set[Hashable]]
+        self._generations = {}      # type: Dict[str, int]
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __repr__(self) -> str:
+        return f"<QueryCache[{self.nbytes}/{self.maxbytes} bytes]>"
+
+    __str__ = __repr__
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key, _MISSING)
+        if item is not _MISSING and item[0] <= monotonic():
+            self._remove(key)
+            self.expirations += 1
+            item = _MISSING
+        if item is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return item[1]
+
+    def generation(self, tables: Iterable[str]) -> Tuple[int, ...]:
+        """Returns the generation of the tables, a result read at
+        one generation is stale once any of the tables is written.
+        """
+        return tuple(self._generations.get(t, 0) for t in tables)
+
+    def put(
+        self,
+        key: Hashable,
+        value: Any,
+        tables: Tuple[str, ...],
+        ttl: float,
+        generation: Tuple[int, ...],
+    ) -> bool:
+        """Store the value read at the generation of the tables,
+        returns False if it is stale or larger than the cache.
+        """
+        if self.generation(tables) != generation:
+            return False
+        nbytes = sizeof(key) + sizeof(value)
+        if nbytes > self.maxbytes:
+            return False
+
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (monotonic() + ttl, value, nbytes, tables)
+        self.nbytes += nbytes
+        for table in tables:
+            self._tables.setdefault(table, set()).add(key)
+        self._trim()
+        return True
+
+    def invalidate(self, table: str) -> None:
+        """Discard the results reading the table"""
+
+        self._generations[table] = self._generations.get(table, 0) + 1
+        for key in self._tables.pop(table, ()):
+            if key in self._data:
+                self._remove(key)
+                self.invalidations += 1
+
+    def resize(self, maxbytes: int) -> None:
+        if maxbytes <= 0:
+            raise ValueError(f"invalid cache maxbytes: {maxbytes}")
+        self.maxbytes = maxbytes
+        self._trim()
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._tables.clear()
+        self.nbytes = 0
+
+    def stats(self) -> util.adict:
+        return util.adict(
+            size=len(self._data),
+            nbytes=self.nbytes,
+            maxbytes=self.maxbytes,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            expirations=self.expirations,
+            invalidations=self.invalidations,
+        )
+
+    def _trim(self) -> None:
+        while self.nbytes > self.maxbytes:
+            self._remove(next(iter(self._data)))
+            self.evictions += 1
+
+    def _remove(self, key: Hashable) -> None:
+        _, _, nbytes, tables = self._data.pop(key)
+        self.nbytes -= nbytes
+        for table in tables:
+            keys = self._tables.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tables[table]
+
+
+def sizeof(obj: Any) -> int:
+    """Approximate bytes of the object and the containers,
+    mappings and instance dicts it holds.
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        return size + sum(
+            sizeof(k) + sizeof(v) for k, v in obj.items()
+        )
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(sizeof(item) for item in obj)
+    if hasattr(obj, '__dict__'):
+        return size + sizeof(obj.__dict__)
+    return size
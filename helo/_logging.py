@@ -1,23 +1,181 @@
+import atexit
+import json
 import logging
+import queue
+import random
 import sys
-from typing import Optional
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from time import monotonic
+from typing import Any, Optional, Tuple
+
+from . import _cache
 
 BLACK, RED, GREEN, YELLOW, BLUE, MAGENTA, CYAN, WHITE = range(8)
 
+# The records are written to stderr by a background thread,
+# so that logging never blocks the event loop on the stream
+_QUEUE = queue.SimpleQueue()  # type: queue.SimpleQueue
+
 
 def create_logger() -> logging.Logger:
     logger = logging.getLogger("helo")
 
     console_handler = logging.StreamHandler(sys.stderr)
     console_handler.setFormatter(ColoredFormatter())
+    _WRITER.listener = QueueListener(_QUEUE, console_handler)
 
     if logger.level == logging.NOTSET:
         logger.setLevel(logging.INFO)
 
-    logger.addHandler(console_handler)
+    logger.addHandler(_Handler(_QUEUE))
     return logger
 
 
+def configure(
+    sample: float = 1.0,
+    rate: Optional[float] = None,
+    format: str = 'text',  # pylint: disable=redefined-builtin
+) -> None:
+    """Set the sampling and the rate limit of the query log,
+    and the format of the records, 'text' or 'json'.
+    """
+    if format not in _FORMATTERS:
+        raise ValueError(f"invalid log format: {format!r}")
+    QUERIES.reset(sample, rate)
+    for handler in _WRITER.listener.handlers:  # type: ignore
+        handler.setFormatter(_FORMATTERS[format]())
+
+
+def flush() -> None:
+    """Wait until the records logged so far are written"""
+
+    _WRITER.stop()
+
+
+class _Writer:
+    """Holds the listener writing the records on its thread, which is
+    started by the first record and stopped by ``flush``, to be
+    started again by the next one.
+    """
+
+    __slots__ = ('listener', 'running', '_lock')
+
+    def __init__(self) -> None:
+        self.listener = None  # type: Optional[QueueListener]
+        self.running = False
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self.listener is not None and not self.running:
+                self.listener.start()
+                self.running = True
+
+    def stop(self) -> None:
+        with self._lock:
+            if self.listener is not None and self.running:
+                self.listener.stop()
+                self.running = False
+
+
+_WRITER = _Writer()
+atexit.register(flush)
+
+
+class _Handler(QueueHandler):
+    """Enqueue the records as they are, formatting them is left to the
+    thread of the listener, which is started with the first record.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if not _WRITER.running:
+            _WRITER.start()
+        self.queue.put_nowait(record)
+
+
+class QueryLog:
+    """Logs the executed queries, a fraction of ``sample`` of them
+    and at most ``rate`` per second of each digest (in bursts of up
+    to ``max(rate, 1)``), the rest are counted and the count of a
+    digest is reported by its next record as "suppressed".
+    """
+
+    __slots__ = ('logger', 'sample', 'rate', '_buckets')
+
+    def __init__(
+        self,
+        logger: logging.Logger,
+        sample: float = 1.0,
+        rate: Optional[float] = None,
+    ) -> None:
+        self.logger = logger
+        self.reset(sample, rate)
+
+    def __repr__(self) -> str:
+        return f"<QueryLog sample={self.sample} rate={self.rate}>"
+
+    __str__ = __repr__
+
+    def reset(self, sample: float = 1.0, rate: Optional[float] = None) -> None:
+        if not 0 < sample <= 1:
+            raise ValueError(f"invalid log sample: {sample}")
+        if rate is not None and rate <= 0:
+            raise ValueError(f"invalid log rate: {rate}")
+        self.sample = sample
+        self.rate = rate
+        # digest -> [tokens, updated, suppressed]
+        self._buckets = _cache.LRU(1024)
+
+    def log(self, query: Any) -> bool:
+        """Log the query unless it is sampled out or over the rate
+        of its ``Query.digest``, returns True if logged."""
+
+        if not self.logger.isEnabledFor(logging.INFO):
+            return False
+        if self.sample < 1 and random.random() >= self.sample:
+            return False
+
+        digest = query.digest
+        suppressed = 0
+        if self.rate is not None:
+            now = monotonic()
+            bucket = self._buckets.get(digest)
+            # A rate below one still lets a record through now and then
+            burst = max(self.rate, 1)
+            if bucket is None:
+                bucket = [burst, now, 0]
+                self._buckets.put(digest, bucket)
+            else:
+                bucket[0] = min(
+                    burst, bucket[0] + (now - bucket[1]) * self.rate
+                )
+                bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+
+        # The query is formatted into the message by the listener
+        if suppressed:
+            msg, args = "%s (suppressed %d)", (query, suppressed)
+        else:
+            msg, args = query, None
+        record = logging.LogRecord(
+            self.logger.name, logging.INFO, __file__, 0, msg, args, None
+        )
+        record.digest = digest
+        record.sql = query.sql
+        record.params = query.params
+        record.suppressed = suppressed
+        self.logger.handle(record)
+        return True
+
+
 class ColoredFormatter(logging.Formatter):
     LOG_FORMAT = "[$TCS%(asctime)s$TCN] [%(levelname)s] %(message)s"
     DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
@@ -58,3 +216,29 @@ class ColoredFormatter(logging.Formatter):
         if levelname in self.COLORS:
             record.levelname = self._to(self.COLORS[levelname], levelname)
         return logging.Formatter.format(self, record)
+
+
+class JSONFormatter(logging.Formatter):
+    """Format a record as one line of JSON, the query records carry
+    the digest, the sql and the params as fields of their own"""
+
+    FIELDS = ('digest', 'sql', 'params', 'suppressed')  # type: Tuple[str, ...]
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name in self.FIELDS:
+            if hasattr(record, name):
+                data[name] = getattr(record, name)
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+_FORMATTERS = {'text': ColoredFormatter, 'json': JSONFormatter}
+
+QUERIES = QueryLog(logging.getLogger("helo.query"))
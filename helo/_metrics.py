@@ -0,0 +1,246 @@
+"""
+    helo._metrics
+    ~~~~~~~~~~~~~
+
+    Implements the in-process instrumentation of the pool and the
+    statements, kept as fixed-bucket histograms and counters.
+"""
+from __future__ import annotations
+
+import bisect
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import util, _builder
+
+# Upper bounds in seconds of the latency buckets, the last one is +Inf
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf,
+)
+# Statements of more digests than this are aggregated under ``OTHER``
+MAXDIGESTS = 1000
+OTHER = '<other>'
+
+
+class Histogram:
+    """Counts of observations in the fixed ``BUCKETS``"""
+
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def __repr__(self) -> str:
+        return f"<Histogram count={self.count} sum={self.sum:.6f}>"
+
+    __str__ = __repr__
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> util.adict:
+        """The cumulative count of each bucket, like Prometheus"""
+
+        buckets, total = [], 0
+        for bound, count in zip(BUCKETS, self.counts):
+            total += count
+            buckets.append((bound, total))
+        return util.adict(count=self.count, sum=self.sum, buckets=buckets)
+
+
+class Statement:
+    """Latency, rows and errors of the statements of one digest"""
+
+    __slots__ = ('text', 'latency', 'rows', 'errors')
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.latency = Histogram()
+        self.rows = 0
+        self.errors = 0
+
+    def snapshot(self) -> util.adict:
+        return util.adict(
+            text=self.text,
+            count=self.latency.count,
+            rows=self.rows,
+            errors=self.errors,
+            latency=self.latency.snapshot(),
+        )
+
+
+class Metrics:
+    """The instrumentation of the pool and the statements.
+
+    ``acquire`` is the time waiting for a connection of the pool and
+    ``hold`` the time it is kept until released, a long wait with
+    short statements is starvation of the pool rather than slow
+    queries. ``cancelled`` counts the connections of the cancelled
+    tasks by what was done with them, "closed" or "rolledback".
+    """
+
+    __slots__ = ('acquire', 'hold', 'statements', 'errors', 'cancelled')
+
+    def __init__(self) -> None:
+        self.acquire = Histogram()
+        self.hold = Histogram()
+        self.statements = {}  # type: Dict[str, Statement]
+        self.errors = {}      # type: Dict[str, int]
+        self.cancelled = {}   # type: Dict[str, int]
+
+    def __repr__(self) -> str:
+        return f"<Metrics statements={len(self.statements)}>"
+
+    __str__ = __repr__
+
+    def statement(
+        self,
+        sql: str,
+        seconds: float,
+        rows: int = 0,
+        error: bool = False,
+        digest: Optional[str] = None,
+    ) -> None:
+        key = digest or _builder.fingerprint(sql)
+        stmt = self.statements.get(key)
+        if stmt is None:
+            text = _builder.normalize(sql)
+            if len(self.statements) >= MAXDIGESTS:
+                key = text = OTHER
+                stmt = self.statements.get(key)
+            if stmt is None:
+                stmt = self.statements[key] = Statement(text)
+        stmt.latency.observe(seconds)
+        stmt.rows += rows
+        if error:
+            stmt.errors += 1
+
+    def error(self, name: str) -> None:
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def cancel(self, action: str) -> None:
+        self.cancelled[action] = self.cancelled.get(action, 0) + 1
+
+    def reset(self) -> None:
+        self.acquire = Histogram()
+        self.hold = Histogram()
+        self.statements.clear()
+        self.errors.clear()
+        self.cancelled.clear()
+
+    def snapshot(self) -> util.adict:
+        return util.adict(
+            acquire=self.acquire.snapshot(),
+            hold=self.hold.snapshot(),
+            statements={
+                k: s.snapshot() for k, s in self.statements.items()
+            },
+            errors=dict(self.errors),
+            cancelled=dict(self.cancelled),
+        )
+
+
+METRICS = Metrics()
+
+
+def render(snapshot: util.adict) -> str:
+    """Render a snapshot of ``Metrics`` in the Prometheus text format"""
+
+    lines = []  # type: List[str]
+
+    def head(name: str, kind: str, text: str) -> None:
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    def histogram(
+        name: str, hist: util.adict, labels: Tuple[Tuple[str, str], ...] = ()
+    ) -> None:
+        for bound, count in hist.buckets:
+            le = '+Inf' if bound == math.inf else repr(bound)
+            lines.append(
+                f"{name}_bucket{_labels(labels + (('le', le),))} {count}"
+            )
+        lines.append(f"{name}_sum{_labels(labels)} {hist.sum!r}")
+        lines.append(f"{name}_count{_labels(labels)} {hist.count}")
+
+    pool = snapshot.get('pool')
+    if pool:
+        for key, text in (
+            ('size', "Connections opened by the pool"),
+            ('freesize', "Connections idle in the pool"),
+            ('maxsize', "Maximum connections of the pool"),
+        ):
+            name = f"helo_pool_{key}"
+            head(name, 'gauge', text)
+            lines.append(f"{name} {pool[key]}")
+
+    head(
+        'helo_pool_acquire_seconds', 'histogram',
+        "Time waiting to acquire a connection of the pool"
+    )
+    histogram('helo_pool_acquire_seconds', snapshot.acquire)
+    head(
+        'helo_connection_hold_seconds', 'histogram',
+        "Time a connection is held until released to the pool"
+    )
+    histogram('helo_connection_hold_seconds', snapshot.hold)
+
+    statements = sorted(snapshot.statements.items())
+    head(
+        'helo_statement_info', 'gauge',
+        "The normalized text of the statements by digest"
+    )
+    for key, stmt in statements:
+        labels = (('digest', key), ('statement', stmt.text))
+        lines.append(f"helo_statement_info{_labels(labels)} 1")
+    head(
+        'helo_statement_seconds', 'histogram',
+        "Execution time of the statements by digest"
+    )
+    for key, stmt in statements:
+        histogram('helo_statement_seconds', stmt.latency, (('digest', key),))
+    for name, attr, text in (
+        ('helo_statement_rows_total', 'rows',
+         "Rows returned or affected by the statements by digest"),
+        ('helo_statement_errors_total', 'errors',
+         "Failed statements by digest"),
+    ):
+        head(name, 'counter', text)
+        for key, stmt in statements:
+            lines.append(f"{name}{_labels((('digest', key),))} {stmt[attr]}")
+
+    head('helo_errors_total', 'counter', "Errors raised by error class")
+    for name, count in sorted(snapshot.errors.items()):
+        lines.append(f"helo_errors_total{_labels((('error', name),))} {count}")
+
+    head(
+        'helo_cancelled_connections_total', 'counter',
+        "Connections of cancelled tasks by the action taken"
+    )
+    for action, count in sorted(snapshot.get('cancelled', {}).items()):
+        lines.append(
+            f"helo_cancelled_connections_total"
+            f"{_labels((('action', action),))} {count}"
+        )
+
+    return '\n'.join(lines) + '\n'
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+def _escape(value: Any) -> str:
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
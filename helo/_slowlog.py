@@ -0,0 +1,159 @@
+"""
+    helo._slowlog
+    ~~~~~~~~~~~~~
+
+    Implements the recorder of the slow queries.
+"""
+from __future__ import annotations
+
+import collections
+import json
+import random
+import time
+from typing import Any, List, Optional, Tuple
+
+from . import util, _builder
+
+
+class SlowLog:
+    """A bounded ring buffer of the statements slower than the
+    threshold, the oldest records are discarded first.
+
+    :param float threshold: Seconds from which a statement is slow
+    :param float sample: Fraction of the slow statements recorded
+    :param int maxsize: Maximum number of records to keep
+    :param bool redact: If true, the params are recorded as the
+        names of their types and the text as its normalized one,
+        instead of the values
+    :param bool explain: If true, the plan of a slow read is captured
+        by ``EXPLAIN FORMAT=JSON`` on another connection in the
+        background
+    """
+
+    __slots__ = (
+        '_records', 'threshold', 'sample', 'redact', 'explain', 'dropped',
+    )
+
+    def __init__(
+        self,
+        threshold: float = 1.0,
+        sample: float = 1.0,
+        maxsize: int = 1000,
+        redact: bool = False,
+        explain: bool = False,
+    ) -> None:
+        if threshold < 0:
+            raise ValueError(f"invalid slowlog threshold: {threshold}")
+        if not 0 < sample <= 1:
+            raise ValueError(f"invalid slowlog sample: {sample}")
+        if maxsize <= 0:
+            raise ValueError(f"invalid slowlog maxsize: {maxsize}")
+        self._records = collections.deque(
+            maxlen=maxsize
+        )  # type: collections.deque
+        self.threshold = threshold
+        self.sample = sample
+        self.redact = redact
+        self.explain = explain
+        self.dropped = 0
+
+    def __repr__(self) -> str:
+        return (
+            f"<SlowLog[{len(self._records)}/{self._records.maxlen}] "
+            f">= {self.threshold}s>"
+        )
+
+    __str__ = __repr__
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self) -> Any:
+        return iter(list(self._records))
+
+    def record(
+        self,
+        sql: str,
+        params: Optional[Tuple[Any, ...]],
+        seconds: float,
+        rows: int = 0,
+        wait: float = 0.0,
+        error: Optional[str] = None,
+        digest: Optional[str] = None,
+    ) -> Optional[util.adict]:
+        """Record the statement if it is slow and sampled, returns
+        the record or None, see ``Query.digest`` for the digest"""
+
+        if seconds < self.threshold:
+            return None
+        if self.sample < 1 and random.random() >= self.sample:
+            return None
+
+        if digest is None:
+            digest = _builder.fingerprint(sql)
+        params = tuple(params or ())
+        if self.redact:
+            # The literals of the text are values as well
+            sql = _builder.normalize(sql)
+            params = tuple(f'<{type(p).__name__}>' for p in params)
+        if len(self._records) == self._records.maxlen:
+            self.dropped += 1
+        record = util.adict(
+            time=time.time(),
+            digest=digest,
+            sql=sql,
+            params=params,
+            seconds=seconds,
+            rows=rows,
+            wait=wait,
+            error=error,
+            explain=None,
+        )
+        self._records.append(record)
+        return record
+
+    def records(
+        self,
+        digest: Optional[str] = None,
+        seconds: Optional[float] = None,
+        since: Optional[float] = None,
+        limit: Optional[int] = None,
+    ) -> List[util.adict]:
+        """Returns the records of the digest, taking at least the
+        seconds, recorded after the ``time.time()`` since, the
+        slowest first.
+        """
+
+        result = [
+            r for r in self._records
+            if (digest is None or r.digest == digest)
+            and (seconds is None or r.seconds >= seconds)
+            and (since is None or r.time >= since)
+        ]
+        result.sort(key=lambda r: r.seconds, reverse=True)
+        return result if limit is None else result[:limit]
+
+    def dump(self, path: str, clear: bool = False) -> int:
+        """Append the records to the file as JSON lines, returns the
+        number written"""
+
+        records = list(self._records)
+        with open(path, 'a', encoding='utf-8') as fp:
+            for record in records:
+                fp.write(json.dumps(record, default=str) + '\n')
+        if clear:
+            self.clear()
+        return len(records)
+
+    def clear(self) -> None:
+        self._records.clear()
+        self.dropped = 0
+
+    def stats(self) -> util.adict:
+        return util.adict(
+            size=len(self._records),
+            maxsize=self._records.maxlen,
+            threshold=self.threshold,
+            sample=self.sample,
+            dropped=self.dropped,
+        )
@@ -7,33 +7,71 @@
 from __future__ import annotations
 
 import asyncio
+import contextvars
+import itertools
+import json
 import os
+import re
 import sys
 import threading
+import time
+import weakref
 import urllib.parse as urlparse
+from contextlib import AsyncExitStack, asynccontextmanager
 from functools import wraps
 from inspect import iscoroutinefunction
-from typing import Optional, Any, Union, Callable, Dict, Tuple, Type
+from typing import (
+    Optional, Any, Union, Callable, Dict, List, Set, Tuple, Type,
+    AsyncIterator, Iterator,
+)
 
 import aiomysql
 import pymysql
 
-from . import util, err, _builder, _logging
+from . import util, err, _builder, _cache, _logging, _metrics, _slowlog
 
 __all__ = (
     'binding',
     'unbinding',
     'execute',
+    'stream',
     'select_db',
     'isbound',
     'state',
+    'metrics',
+    'prometheus',
+    'slowlog',
+    'transaction',
+    'current_transaction',
     'FetchResult',
     'ExecResult',
+    'Row',
     'Binder',
     'EnvKey',
 )
 
 _SUPPORTED_SCHEMES = ('mysql',)
+_BALANCES = ('roundrobin', 'leastbusy')
+# Replica pools take the pool options of the primary but connect
+# to the address given by their own url
+_ADDRESS_KWARGS = ('host', 'port', 'unix_socket', 'user', 'password', 'db')
+_EXPLAINABLE = re.compile(r'\s*\(*\s*SELECT\b', re.I)
+# The captures of the plans of slow reads run at most one per digest,
+# this many at once, each within this many seconds
+_EXPLAIN_LIMIT = 4
+_EXPLAIN_TIMEOUT = 5.0
+# ER_QUERY_TIMEOUT, the statement ran past its MAX_EXECUTION_TIME
+_ER_QUERY_TIMEOUT = 3024
+# Seconds at most spent killing the statement of an expired deadline
+_KILL_TIMEOUT = 1.0
+# The errors of PREPARE the statement would raise again, ER_PARSE_ERROR,
+# ER_WRONG_ARGUMENTS, ER_NOT_SUPPORTED_YET and ER_UNSUPPORTED_PS, the
+# others (e.g. a lock wait or max_prepared_stmt_count) are transient
+_ER_UNPREPARABLE = frozenset((1064, 1210, 1235, 1295))
+
+_transaction = contextvars.ContextVar(
+    'helo_transaction', default=None
+)  # type: contextvars.ContextVar[Optional[Transaction]]
 
 logger = _logging.create_logger()
 
@@ -80,16 +118,65 @@ async def binding(
     The pool is a singleton, repeated create will cause errors.
     Returns true after successful create
 
+    :param replicas: Urls of the read replicas, read queries are
+        balanced across their pools and writes go to the primary
+    :param balance: How to pick a replica, 'roundrobin' (default)
+        or 'leastbusy' (fewest connections in use)
+    :param singleflight: If true, identical read queries issued while
+        one is in flight wait for its result instead of running again,
+        a query can override it by the ``singleflight`` option
+    :param debug: Log the executed queries if true, or a dict of the
+        options of the query log, "sample" the fraction of the queries
+        logged, "rate" the maximum per second of each digest and
+        "format" 'text' or 'json'. The records are written to stderr
+        by a background thread.
+    :param slowlog: Record the statements slower than a threshold,
+        the threshold in seconds or a dict of the options of
+        ``SlowLog``, see ``slowlog()``
+    :param timeout: Default seconds a statement may take, a query can
+        override it by the ``timeout`` option, see ``Executer.do``
+
     more parameters, see ``Pool` and ``Pool.from_url``
     """
 
     debug = kwargs.pop('debug', False)
+    replica_urls = kwargs.pop('replicas', None) or []
+    balance = kwargs.pop('balance', _BALANCES[0])
+    singleflight = kwargs.pop('singleflight', False)
+    recorder = kwargs.pop('slowlog', None)
+    timeout = kwargs.pop('timeout', None)
+    if balance not in _BALANCES:
+        raise ValueError(f"invalid balance: {balance!r}")
+    if timeout is not None and timeout <= 0:
+        raise ValueError(f"invalid timeout: {timeout}")
+    if debug:
+        _logging.configure(**(debug if isinstance(debug, dict) else {}))
+    if isinstance(recorder, dict):
+        recorder = _slowlog.SlowLog(**recorder)
+    elif recorder is not None and not isinstance(recorder, _slowlog.SlowLog):
+        recorder = _slowlog.SlowLog(threshold=recorder)
+
     if url is not None:
         pool = await Pool.from_url(url, **kwargs)
     else:
         pool = await Pool(**kwargs)  # type: ignore
 
-    Executer.activate(pool, debug)
+    replica_kwargs = {
+        k: v for k, v in kwargs.items() if k not in _ADDRESS_KWARGS
+    }
+    replicas = []
+    try:
+        for replica_url in replica_urls:
+            replicas.append(await Pool.from_url(replica_url, **replica_kwargs))
+    except Exception:
+        for p in [pool] + replicas:
+            await p.close()
+        raise
+
+    Executer.activate(
+        pool, bool(debug), replicas=replicas, balance=balance,
+        singleflight=singleflight, recorder=recorder, timeout=timeout,
+    )
 
 
 @__ensure__(True)
@@ -109,13 +196,30 @@ async def execute(
     return await Executer.do(query, **kwargs)
 
 
+@__ensure__(True)
+def stream(
+    query: _builder.Query, **kwargs: Any
+) -> AsyncIterator[FetchResult]:
+    """Execute a read query on an unbuffered server-side cursor and
+    return an async generator of row batches, see ``Executer.stream``
+    """
+
+    if not isinstance(query, _builder.Query):
+        raise TypeError("invalid query type")
+
+    if not query:
+        raise ValueError("no query to execute")
+
+    return Executer.stream(query, **kwargs)
+
+
 @__ensure__(True)
 async def select_db(db: str) -> None:
     """A coroutine to set current db"""
 
     async with Executer.pool.acquire() as conn:  # type: ignore
         conn._db = db  # pylint: disable=protected-access
-        await conn.select_db(db)
+        await Executer.select_db(Executer.pool, conn, db)  # type: ignore
 
 
 @__ensure__(True)
@@ -171,6 +275,230 @@ def state() -> Optional[util.adict]:
     return Executer.poolstate()
 
 
+def metrics(reset: bool = False) -> util.adict:
+    """Return a snapshot of the instrumentation of the pool and
+    the statements, the state of the pool is under "pool".
+
+    - "acquire": histogram of the seconds waiting for a connection
+    - "hold": histogram of the seconds a connection is held
+    - "statements": normalized text, count, rows, errors and latency
+      histogram of the statements by their digest, see ``Query.digest``
+    - "errors": count of the errors raised by error class
+    - "cancelled": count of the connections of cancelled tasks that
+      were "closed" or "rolledback", see ``Executer.abandon``
+
+    The histograms have the cumulative count of each bucket like
+    Prometheus, the counters are restarted if "reset" is true.
+    """
+
+    snapshot = _metrics.METRICS.snapshot()
+    snapshot.pool = Executer.poolstate()
+    if reset:
+        _metrics.METRICS.reset()
+    return snapshot
+
+
+def prometheus(snapshot: Optional[util.adict] = None) -> str:
+    """Render the snapshot of ``metrics()`` in the Prometheus
+    text exposition format, a new snapshot if not given"""
+
+    return _metrics.render(snapshot or metrics())
+
+
+def slowlog() -> Optional[_slowlog.SlowLog]:
+    """Return the recorder of the slow statements given to
+    ``binding``, None if not enabled.
+
+    >>> for record in helo.slowlog().records(limit=10):
+    ...     print(record.seconds, record.digest, record.explain)
+    >>> helo.slowlog().dump('slow.jsonl')
+    """
+
+    return Executer.slowlog
+
+
+@__ensure__(True)
+def transaction() -> Transaction:
+    """Return a transaction context, see ``Transaction``"""
+
+    return Transaction()
+
+
+class Transaction:
+    """A transaction that pins one connection of the primary pool
+    to the current task until the block exits.
+
+    Every query executed inside the block runs on that connection,
+    and the block commits once on success or rolls back on error.
+    Nested blocks are savepoints of the outermost one, named uniquely
+    within it since the tasks spawned inside a block may nest blocks
+    concurrently. The savepoints of a connection are still a stack,
+    rolling back to one undoes the statements of the blocks entered
+    after it as well.
+
+    >>> async with helo.transaction():
+    ...     uid = await User.add(nickname='at7h')
+    ...     await User.set(uid, password='777')
+    """
+
+    __slots__ = (
+        'pool', 'connection', 'lock', 'savepoint', 'streams',
+        '_parent', '_token', '_active', '_acquired', '_savepoints',
+        '_callbacks',
+    )
+
+    _SAVEPOINT = 'helo_sp_{}'
+
+    def __init__(self) -> None:
+        self.pool = None        # type: Optional[Pool]
+        self.connection = None  # type: Optional[aiomysql.Connection]
+        self.lock = None        # type: Optional[asyncio.Lock]
+        self.savepoint = None   # type: Optional[str]
+        # The tasks reading the rows of a stream on the connection
+        self.streams = set()    # type: Set[asyncio.Task]
+        self._parent = None     # type: Optional[Transaction]
+        self._token = None      # type: Optional[contextvars.Token]
+        self._active = False
+        self._acquired = 0.0
+        self._savepoints = None  # type: Optional[Iterator[int]]
+        self._callbacks = []     # type: List[Callable[[], Any]]
+
+    def __repr__(self) -> str:
+        if self.savepoint:
+            return f"<Transaction savepoint {self.savepoint}>"
+        return f"<Transaction on {self.pool!r}>"
+
+    __str__ = __repr__
+
+    @property
+    def active(self) -> bool:
+        """Whether the transaction is still open, a task
+        spawned inside the block may outlive it"""
+
+        if self._parent is not None:
+            return self._active and self._parent.active
+        return self._active
+
+    @property
+    def depth(self) -> int:
+        return 0 if self._parent is None else self._parent.depth + 1
+
+    def on_end(self, callback: Callable[[], Any]) -> None:
+        """Call "callback" once the outermost transaction ends,
+        either committed or rolled back"""
+
+        self._callbacks.append(callback)
+
+    def ensure_free(self) -> None:
+        """Raise instead of waiting for the connection while a stream
+        of the current task holds it, it would never be released"""
+
+        if asyncio.current_task() in self.streams:
+            raise err.NotAllowedError(
+                "cannot run a query in the transaction while a stream of "
+                "the task reads its connection, read all the rows or "
+                "close the stream (`aclose()`) first"
+            )
+
+    async def __aenter__(self) -> Transaction:
+        parent = current_transaction()
+        if parent is None:
+            self.pool = Executer.pool
+            started = time.perf_counter()
+            self.connection = await self.pool.acquire()  # type: ignore
+            self._acquired = time.perf_counter()
+            _metrics.METRICS.acquire.observe(self._acquired - started)
+            self.lock = asyncio.Lock()
+            self._savepoints = itertools.count(1)
+            try:
+                await self.connection.begin()
+            except asyncio.CancelledError:
+                Executer.abandon(self.connection)  # type: ignore
+                await self.pool.release(self.connection)  # type: ignore
+                raise
+            except Exception:
+                await self.pool.release(self.connection)  # type: ignore
+                raise _ExcAdapter.err()
+        else:
+            self._parent = parent
+            self.pool = parent.pool
+            self.connection = parent.connection
+            self.lock = parent.lock
+            self.streams = parent.streams
+            self._savepoints = parent._savepoints
+            self._callbacks = parent._callbacks
+            self.savepoint = self._SAVEPOINT.format(
+                next(self._savepoints)  # type: ignore
+            )
+            await self._query(f"SAVEPOINT `{self.savepoint}`")
+
+        self._active = True
+        self._token = _transaction.set(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        _transaction.reset(self._token)  # type: ignore
+        self._active = False
+
+        # A connection closed by a timeout is rolled back by the
+        # server, its error is the one to raise
+        aborted = exc_type is not None and self.connection.closed  # type: ignore
+        if self.savepoint is not None:
+            if aborted:
+                return
+            if exc_type is None:
+                await self._query(f"RELEASE SAVEPOINT `{self.savepoint}`")
+            else:
+                await self._query(f"ROLLBACK TO SAVEPOINT `{self.savepoint}`")
+            return
+
+        # Cancelled between its statements, the connection is clean and
+        # kept by the pool once rolled back
+        cancelled = exc_type is not None \
+            and issubclass(exc_type, asyncio.CancelledError)
+        try:
+            async with self.lock:  # type: ignore
+                if exc_type is None:
+                    await self.connection.commit()  # type: ignore
+                elif not aborted:
+                    await self.connection.rollback()  # type: ignore
+                    if cancelled:
+                        _metrics.METRICS.cancel('rolledback')
+        except asyncio.CancelledError:
+            Executer.abandon(self.connection)  # type: ignore
+            raise
+        except Exception:
+            raise _ExcAdapter.err()
+        finally:
+            await self.pool.release(self.connection)  # type: ignore
+            _metrics.METRICS.hold.observe(
+                time.perf_counter() - self._acquired
+            )
+            for callback in self._callbacks:
+                callback()
+
+    async def _query(self, sql: str) -> None:
+        self.ensure_free()
+        async with self.lock:  # type: ignore
+            try:
+                async with self.connection.cursor() as cur:  # type: ignore
+                    await cur.execute(sql)
+            except asyncio.CancelledError:
+                Executer.abandon(self.connection)  # type: ignore
+                raise
+            except Exception:
+                raise _ExcAdapter.err()
+
+
+def current_transaction() -> Optional[Transaction]:
+    """Return the transaction of the current context if it is still open"""
+
+    tx = _transaction.get()
+    if tx is not None and tx.active:
+        return tx
+    return None
+
+
 @util.asyncinit
 class Pool:
     """Create a MySQL connection pool based on `aiomysql.create_pool`.
@@ -182,6 +510,8 @@ class Pool:
         be careful not to exceed MySQL default time of 8 hours
     :param loop: Is an optional event loop instance,
         asyncio.get_event_loop() is used if loop is not specified.
+    :param int stmt_cache_size: Size of the per-connection LRU of
+        server-side prepared statements, default 0 means disabled
     :param conn_kwargs: See `_CONN_KWARGS`.
     """
     _CONN_KWARGS = util.adict(
@@ -203,9 +533,9 @@ class Pool:
         program_name='',         # Program name string to provide
         server_public_key=None,  # SHA256 authentication plugin public key value
     )
-    _POOL_KWARGS = ('minsize', 'maxsize', 'pool_recycle', 'loop')
+    _POOL_KWARGS = ('minsize', 'maxsize', 'pool_recycle', 'loop', 'stmt_cache_size')
 
-    __slots__ = ('_pool', '_connmeta', '_closed')
+    __slots__ = ('_pool', '_connmeta', '_closed', '_statements')
 
     async def __init__(  # type: ignore
             self,
@@ -213,6 +543,7 @@ class Pool:
             maxsize: int = 15,
             pool_recycle: int = -1,
             loop: Optional[asyncio.AbstractEventLoop] = None,
+            stmt_cache_size: int = 0,
             **conn_kwargs: Any
     ) -> None:
 
@@ -226,6 +557,8 @@ class Pool:
             raise _ExcAdapter.err()
         self._closed = False
         self._connmeta = conn_kwargs
+        self._statements = StatementCache(
+            stmt_cache_size) if stmt_cache_size else None
 
     @classmethod
     async def from_url(cls, url: str, **kwargs: Any) -> Pool:
@@ -296,6 +629,12 @@ class Pool:
 
         return util.formatadict(self._connmeta)  # type: ignore
 
+    @property
+    def statements(self) -> Optional[StatementCache]:
+        """Prepared statement cache, None if disabled"""
+
+        return self._statements
+
     def acquire(self) -> aiomysql.Connection:
         """Acquice a connectionion from the pool"""
 
@@ -343,24 +682,270 @@ class ADictCursor(aiomysql.DictCursor):
     dict_type = util.adict
 
 
+class ADictSSCursor(aiomysql.SSDictCursor):
+
+    dict_type = util.adict
+
+
+class Row(tuple):
+    """A compact row that keeps the values in a tuple, the rows of a
+    result share one class holding the index of the column names.
+    Supports ``row.col``, ``row['col']`` and ``dict(row)``.
+
+    The methods of the row (``count`` and ``index`` of tuple, ``keys``,
+    ``values``, ``items`` and ``get``) take precedence over the columns
+    of the same names as attributes, read those by ``row['col']``.
+
+    >>> row = Row.of(('id', 'name'))((1, 'at7h'))
+    >>> row.name, row['id'], dict(row)
+    ('at7h', 1, {'id': 1, 'name': 'at7h'})
+    """
+
+    __slots__ = ()
+
+    _index = {}  # type: Dict[str, int]
+    _CLASSES = _cache.LRU(256)
+
+    @classmethod
+    def of(cls, columns: Tuple[str, ...]) -> Type[Row]:
+        """Returns the row class of the columns"""
+
+        rowclass = cls._CLASSES.get(columns)
+        if rowclass is None:
+            rowclass = type('Row', (Row,), {
+                '__slots__': (),
+                '_index': {c: i for i, c in enumerate(columns)},
+            })
+            cls._CLASSES.put(columns, rowclass)
+        return rowclass
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return tuple.__getitem__(self, self._index[name])
+        except KeyError:
+            raise AttributeError(f"Row object has not attribute {name}.")
+
+    def __getitem__(self, key: Any) -> Any:
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self._index[key])
+        return tuple.__getitem__(self, key)
+
+    def __contains__(self, name: Any) -> bool:
+        return name in self._index
+
+    def __repr__(self) -> str:
+        values = ", ".join(f"{c}={v!r}" for c, v in zip(self._index, self))
+        return f"Row({values})"
+
+    __str__ = __repr__
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return _row, (tuple(self._index), tuple(self))
+
+    def keys(self) -> Any:
+        return self._index.keys()
+
+    def values(self) -> Tuple[Any, ...]:
+        return tuple(self)
+
+    def items(self) -> Any:
+        return zip(self._index, self)
+
+    def get(self, name: str, default: Any = None) -> Any:
+        i = self._index.get(name)
+        return default if i is None else tuple.__getitem__(self, i)
+
+
+def _row(columns: Tuple[str, ...], values: Tuple[Any, ...]) -> Row:
+    return Row.of(columns)(values)
+
+
+class StatementCache:
+    """Keeps a bounded LRU of server-side prepared statements
+    for each connection of a pool, keyed by the SQL text.
+
+    aiomysql only speaks the text protocol, so the statements are
+    managed with ``PREPARE``, ``EXECUTE`` and ``DEALLOCATE PREPARE``,
+    the SQL interface of ``COM_STMT_PREPARE/EXECUTE/CLOSE``.
+    """
+
+    __slots__ = (
+        'maxsize', 'hits', 'misses', 'evictions',
+        '_caches', '_dbs', '_seq',
+    )
+
+    _PREPARABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+    _PLACEHOLDER = re.compile(r'%([s%])')
+    _SEMI = ';'
+
+    def __init__(self, maxsize: int) -> None:
+        if maxsize <= 0:
+            raise ValueError(f"invalid stmt_cache_size: {maxsize}")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._caches = weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary
+        self._dbs = weakref.WeakKeyDictionary()     # type: weakref.WeakKeyDictionary
+        self._seq = itertools.count(1)
+
+    def __repr__(self) -> str:
+        return f"<StatementCache[{self.maxsize}] for {len(self._caches)} connections>"
+
+    __str__ = __repr__
+
+    def preparable(self, sql: str, params: Tuple[Any, ...]) -> bool:
+        """Sequence params are expanded by the client (e.g. ``IN %s``),
+        and ``?`` would be taken as a placeholder by the server,
+        so such statements are always sent as text.
+        """
+
+        if '?' in sql or self._SEMI in sql.rstrip().rstrip(self._SEMI):
+            return False
+        for p in params:
+            if isinstance(p, (tuple, list, set, frozenset, dict)):
+                return False
+        return sql.lstrip()[:7].upper().startswith(self._PREPARABLE)
+
+    def switch(self, connection: aiomysql.Connection, db: str) -> None:
+        """The server resolves a prepared statement against the
+        default database in effect when it was prepared"""
+
+        self._dbs[connection] = db
+
+    async def execute(
+        self, cursor: aiomysql.Cursor, sql: str, params: Tuple[Any, ...]
+    ) -> None:
+        connection = cursor.connection
+        stmts = self._caches.get(connection)
+        if stmts is None:
+            stmts = self._caches[connection] = _cache.LRU(self.maxsize)
+
+        key = (self._dbs.get(connection), sql)
+        name = stmts.get(key)
+        if name is None:
+            self.misses += 1
+            name = await self._prepare(cursor, sql)
+            if name is not None:
+                for _key, evicted in stmts.put(key, name):
+                    self.evictions += 1
+                    if evicted:
+                        await cursor.execute(
+                            f"DEALLOCATE PREPARE `{evicted}`"
+                        )
+        else:
+            self.hits += 1
+
+        # An empty name marks the statements the server refused to
+        # prepare, None the ones to prepare again next time
+        if not name:
+            await cursor.execute(sql, params)
+            return
+
+        if not params:
+            await cursor.execute(f"EXECUTE `{name}`")
+            return
+
+        # The variables are reset by the same round trip, so that the
+        # pooled connection does not keep the values of the params
+        variables = [f"@helo_p{i}" for i in range(len(params))]
+        assign = ", ".join(f"{v} = %s" for v in variables)
+        reset = "SET " + ", ".join(f"{v} = NULL" for v in variables)
+        await cursor.execute(
+            f"SET {assign}; EXECUTE `{name}` USING {', '.join(variables)}; "
+            f"{reset}",
+            params
+        )
+        try:
+            await cursor.nextset()
+        except pymysql.err.MySQLError:
+            # The statements after a failed one are not run
+            try:
+                await cursor.execute(reset)
+            except pymysql.err.MySQLError:
+                pass
+            raise
+        # Read past the reset, leaving the result of EXECUTE to the cursor
+        await cursor.connection.next_result()
+
+    async def _prepare(
+        self, cursor: aiomysql.Cursor, sql: str
+    ) -> Optional[str]:
+        name = f"helo_stmt_{next(self._seq)}"
+        text = self._PLACEHOLDER.sub(
+            lambda m: '?' if m.group(1) == 's' else '%',
+            sql.rstrip().rstrip(self._SEMI)
+        )
+        try:
+            await cursor.execute(f"PREPARE `{name}` FROM %s", (text,))
+        except pymysql.err.MySQLError as e:
+            if e.args and e.args[0] in _ER_UNPREPARABLE:
+                return ''
+            return None
+        return name
+
+    def stats(self) -> util.adict:
+        return util.adict(
+            maxsize=self.maxsize,
+            connections=len(self._caches),
+            size=sum(len(c) for c in self._caches.values()),
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+        )
+
+
 class Executer:
     """Executor of MySQL Query."""
 
     __slots__ = ()
 
     pool = None  # type: Optional[Pool]
+    replicas = []  # type: List[Pool]
+    balance = _BALANCES[0]
     record = False
+    singleflight = False
+    slowlog = None  # type: Optional[_slowlog.SlowLog]
+    timeout = None  # type: Optional[float]
+
+    _robin = itertools.count()
+    # The read queries in flight, see ``_flight``
+    _flights = {}  # type: Dict[Any, asyncio.Future]
+    # The running captures of the plans of slow reads by their digests,
+    # see ``_explain``
+    _explains = {}  # type: Dict[str, asyncio.Task]
 
     @classmethod
-    def activate(cls, connpool: Pool, record: bool = False) -> None:
+    def activate(
+        cls,
+        connpool: Pool,
+        record: bool = False,
+        replicas: Optional[List[Pool]] = None,
+        balance: str = _BALANCES[0],
+        singleflight: bool = False,
+        recorder: Optional[_slowlog.SlowLog] = None,
+        timeout: Optional[float] = None,
+    ) -> None:
         cls.pool = connpool
         cls.record = record
+        cls.replicas = list(replicas or [])
+        cls.balance = balance
+        cls.singleflight = singleflight
+        cls.slowlog = recorder
+        cls.timeout = timeout
+        cls._robin = itertools.count()
+        cls._flights = {}
 
     @classmethod
     async def death(cls) -> bool:
         if not cls.active():
             return False
 
+        for task in list(cls._explains.values()):
+            task.cancel()
+        for replica in cls.replicas:
+            await replica.close()
+        cls.replicas = []
         await cls.pool.close()  # type: ignore
         cls.pool = None
         return True
@@ -373,28 +958,368 @@ class Executer:
     async def do(
         cls, query: _builder.Query, **kwargs: Any
     ) -> Union[None, util.adict, Tuple[Any, ...], FetchResult, ExecResult]:
+        """Run the query and return its results.
+
+        The ``timeout`` option (the one of the binding by default) is
+        the seconds the query may take, including the wait for a
+        connection. A SELECT is given the ``MAX_EXECUTION_TIME`` hint
+        of the same time, and when the deadline passes the statement
+        is killed on the server and its connection is discarded
+        instead of returned to the pool. Both raise ``QueryTimeout``.
+        """
 
         if cls.record:
-            logger.info(query)
-
+            _logging.QUERIES.log(query)
+
+        use_primary = kwargs.pop('use_primary', False)
+        singleflight = kwargs.pop('singleflight', None)
+        timeout = kwargs.pop('timeout', None)
+        if timeout is None:
+            timeout = cls.timeout
+        elif timeout <= 0:
+            raise ValueError(f"invalid timeout: {timeout}")
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        pool = cls.route(query, use_primary)
         if query.r:
+            if singleflight is None:
+                singleflight = cls.singleflight
+            if singleflight and current_transaction() is None:
+                return await cls._flight(query, pool, use_primary, kwargs)
             return await cls._fetch(
-                query.sql, params=query.params, **kwargs,
+                query.sql, params=query.params, pool=pool,
+                digest=query.digest, **kwargs,
             )
         return await cls._execute(
-            query.sql, params=query.params, **kwargs
+            query.sql, params=query.params, pool=pool,
+            digest=query.digest, **kwargs
         )
 
+    @classmethod
+    async def _flight(
+        cls,
+        query: _builder.Query,
+        pool: Pool,
+        use_primary: bool,
+        kwargs: Dict[str, Any],
+    ) -> Union[None, util.adict, Tuple[Any, ...], FetchResult]:
+        """Run the read query once for all the identical ones that
+        arrive while it is in flight, each caller gets its own copy
+        of the result.
+        """
+
+        key = (query.sql, query.params, use_primary, tuple(sorted(kwargs.items())))
+        try:
+            flight = cls._flights.get(key)
+        except TypeError:  # unhashable params
+            return await cls._fetch(
+                query.sql, params=query.params, pool=pool,
+                digest=query.digest, **kwargs,
+            )
+
+        loop = asyncio.get_event_loop()
+        if flight is None or flight.get_loop() is not loop:
+            flight = loop.create_task(cls._fetch(
+                query.sql, params=query.params, pool=pool,
+                digest=query.digest, **kwargs,
+            ))
+            cls._flights[key] = flight
+
+            def landed(f: asyncio.Future) -> None:
+                if cls._flights.get(key) is f:
+                    del cls._flights[key]
+                # Mark the error retrieved even if every caller is gone
+                if not f.cancelled():
+                    f.exception()
+
+            flight.add_done_callback(landed)
+
+        # A cancelled caller must not cancel the flight of the others
+        result = await asyncio.shield(flight)
+        if isinstance(result, FetchResult):
+            return result.clone()
+        if isinstance(result, dict):
+            return util.adict(result)
+        return result
+
+    @classmethod
+    async def stream(
+        cls,
+        query: _builder.Query,
+        batch_size: int = 1000,
+        adicts: bool = True,
+        use_primary: bool = False,
+    ) -> AsyncIterator[FetchResult]:
+        """Run the query once and yield its rows in batches of at most
+        ``batch_size``, only one batch is held in memory at a time.
+        The ``columns`` of a batch are the names of the columns, a result
+        without rows yields one empty batch to carry them.
+
+        Unread rows cannot be skipped on the wire, so a connection left
+        mid-result by a break, an error or a cancellation is closed
+        instead of being returned to the pool. A connection pinned by
+        a transaction is drained instead, unless it was cancelled in the
+        middle of a batch, see ``Executer.abandon``. Until then no other
+        query of the task can run in that transaction, it raises
+        ``NotAllowedError`` rather than waiting forever.
+        """
+
+        if batch_size <= 0:
+            raise ValueError(f"invalid batch size: {batch_size}")
+
+        if cls.record:
+            _logging.QUERIES.log(query)
+
+        pool = cls.route(query, use_primary)
+        cursorclass = ADictSSCursor if adicts is True else aiomysql.SSCursor
+        tx = current_transaction()
+        task = asyncio.current_task()
+        # Closed explicitly, the generator may be closed at any yield
+        stack = AsyncExitStack()
+        pool, connection = await stack.enter_async_context(cls.connect(pool))
+        try:
+            if tx is not None:
+                tx.streams.add(task)
+            cur = await connection.cursor(cursorclass)
+            exhausted = False
+            try:
+                try:
+                    await cur.execute(query.sql, query.params)
+                except Exception:
+                    raise _ExcAdapter.err()
+
+                columns = None
+                if cur.description:
+                    columns = tuple(d[0] for d in cur.description)
+                yielded = False
+                while not exhausted:
+                    try:
+                        rows = await cur.fetchmany(batch_size)
+                    except Exception:
+                        raise _ExcAdapter.err()
+                    exhausted = not rows
+                    if rows or not yielded:
+                        batch = FetchResult(rows)
+                        batch.columns = columns
+                        yielded = True
+                        yield batch
+            except asyncio.CancelledError:
+                cls.abandon(connection)
+                raise
+            finally:
+                if tx is not None:
+                    tx.streams.discard(task)
+                if connection.closed:
+                    pass
+                elif exhausted or tx is not None:
+                    await cur.close()
+                else:
+                    connection.close()
+        finally:
+            await stack.aclose()
+
+    @classmethod
+    def route(cls, query: _builder.Query, use_primary: bool = False) -> Pool:
+        """Reads are balanced across the replicas if any,
+        everything else runs on the primary"""
+
+        if use_primary or not cls.replicas or not query.r:
+            return cls.pool  # type: ignore
+
+        if cls.balance == 'leastbusy':
+            return min(cls.replicas, key=lambda p: p.size - p.freesize)
+        return cls.replicas[next(cls._robin) % len(cls.replicas)]
+
     @classmethod
     def poolstate(cls) -> Optional[util.adict]:
         if cls.pool is None:
             return None
-        return util.adict(
-            minsize=cls.pool.minsize,
-            maxsize=cls.pool.maxsize,
-            size=cls.pool.size,
-            freesize=cls.pool.freesize,
+        primary = cls._state(cls.pool)
+        if cls.replicas:
+            primary.balance = cls.balance
+            primary.replicas = [cls._state(r) for r in cls.replicas]
+        return primary
+
+    @staticmethod
+    def _state(pool: Pool) -> util.adict:
+        poolstate = util.adict(
+            minsize=pool.minsize,
+            maxsize=pool.maxsize,
+            size=pool.size,
+            freesize=pool.freesize,
         )
+        if pool.statements is not None:
+            poolstate.statements = pool.statements.stats()
+        return poolstate
+
+    @classmethod
+    @asynccontextmanager
+    async def connect(cls, pool: Optional[Pool] = None) -> Any:
+        """Yield the pool and the connection to run on, the connection
+        pinned by the current transaction takes precedence.
+
+        A task cancelled inside the block was cancelled in the middle
+        of a statement, see ``abandon``.
+        """
+
+        tx = current_transaction()
+        if tx is not None:
+            tx.ensure_free()
+            async with tx.lock:  # type: ignore
+                try:
+                    yield tx.pool, tx.connection
+                except asyncio.CancelledError:
+                    cls.abandon(tx.connection)
+                    raise
+            return
+
+        pool = pool or cls.pool
+        started = time.perf_counter()
+        async with pool.acquire() as connection:  # type: ignore
+            acquired = time.perf_counter()
+            _metrics.METRICS.acquire.observe(acquired - started)
+            try:
+                yield pool, connection
+            except asyncio.CancelledError:
+                cls.abandon(connection)
+                raise
+            finally:
+                _metrics.METRICS.hold.observe(time.perf_counter() - acquired)
+
+    @staticmethod
+    def abandon(connection: aiomysql.Connection) -> None:
+        """Close the connection of a statement cancelled midway.
+
+        The cancellation may leave a packet half read, unread results
+        on the wire or a transaction open, none of which can be told
+        from the state of the connection, so it is closed for the pool
+        to discard it and the server to roll it back, rather than to be
+        handed over to the next task.
+        """
+
+        if not connection.closed:
+            connection.close()
+            _metrics.METRICS.cancel('closed')
+
+    @classmethod
+    @asynccontextmanager
+    async def deadline(cls, timeout: Optional[float] = None) -> Any:
+        """Cancel the block once "timeout" seconds pass and raise
+        ``QueryTimeout`` instead, see ``Deadline``"""
+
+        deadline = Deadline(timeout)
+        try:
+            yield deadline
+        except asyncio.CancelledError:
+            if not deadline.expired:
+                raise
+            deadline.uncancel()
+            await deadline.kill(min(timeout, _KILL_TIMEOUT))  # type: ignore
+            _metrics.METRICS.error(err.QueryTimeout.__name__)
+            raise err.QueryTimeout(
+                f"Query execution exceeded the timeout of {timeout}s"
+            ) from None
+        finally:
+            deadline.cancel()
+
+    @classmethod
+    async def select_db(
+        cls, pool: Pool, connection: aiomysql.Connection, db: str
+    ) -> None:
+        await connection.select_db(db)
+        if pool.statements is not None:
+            pool.statements.switch(connection, db)
+
+    @classmethod
+    async def _run(
+        cls,
+        pool: Pool,
+        cursor: aiomysql.Cursor,
+        sql: str,
+        params: Tuple[Any, ...]
+    ) -> None:
+        statements = pool.statements
+        if statements is not None and statements.preparable(sql, params):
+            await statements.execute(cursor, sql, params)
+        else:
+            await cursor.execute(sql, params)
+
+    @classmethod
+    def _observe(
+        cls,
+        pool: Pool,
+        sql: str,
+        params: Optional[Union[tuple, list]],
+        db: Optional[str],
+        digest: Optional[str],
+        started: float,
+        wait: float,
+        rows: int = 0,
+        error: Optional[str] = None,
+    ) -> None:
+        """Account the statement started at the ``time.perf_counter()``
+        in the metrics and the slow log by its digest, the one of
+        ``_builder.fingerprint`` if not given"""
+
+        if digest is None:
+            digest = _builder.fingerprint(sql)
+        seconds = time.perf_counter() - started
+        _metrics.METRICS.statement(
+            sql, seconds, rows, error is not None, digest
+        )
+        if cls.slowlog is None:
+            return
+        record = cls.slowlog.record(
+            sql, params, seconds, rows, wait, error, digest
+        )
+        if record is not None and cls.slowlog.explain \
+                and _EXPLAINABLE.match(sql) \
+                and digest not in cls._explains \
+                and len(cls._explains) < _EXPLAIN_LIMIT:
+            task = asyncio.get_event_loop().create_task(
+                cls._explain(pool, record, sql, tuple(params or ()), db)
+            )
+            cls._explains[digest] = task
+            task.add_done_callback(
+                lambda _: cls._explains.pop(digest, None)
+            )
+
+    @classmethod
+    async def _explain(
+        cls,
+        pool: Pool,
+        record: util.adict,
+        sql: str,
+        params: Tuple[Any, ...],
+        db: Optional[str],
+    ) -> None:
+        """Capture the plan of the slow read into its record on a
+        connection of its own, not pinned by any transaction, giving
+        up after ``_EXPLAIN_TIMEOUT`` seconds"""
+
+        async def capture() -> Any:
+            async with pool.acquire() as connection:  # type: ignore
+                try:
+                    if db:
+                        await cls.select_db(pool, connection, db)
+                    async with connection.cursor() as cur:
+                        await cur.execute(
+                            f"EXPLAIN FORMAT=JSON {sql}", params
+                        )
+                        return await cur.fetchone()
+                except asyncio.CancelledError:
+                    cls.abandon(connection)
+                    raise
+
+        try:
+            plan = await asyncio.wait_for(capture(), _EXPLAIN_TIMEOUT)
+            record.explain = json.loads(plan[0])
+        except asyncio.TimeoutError:
+            record.explain = util.adict(
+                error=f"EXPLAIN exceeded the timeout of {_EXPLAIN_TIMEOUT}s"
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            record.explain = util.adict(error=str(e))
 
     @classmethod
     async def _fetch(
@@ -402,17 +1327,34 @@ class Executer:
             params: Optional[Union[tuple, list]] = None,
             rows: Optional[int] = None,
             db: Optional[str] = None,
-            adicts: bool = True
-    ) -> Union[None, util.adict, Tuple[Any, ...], FetchResult]:
+            adicts: bool = True,
+            compact: bool = False,
+            pool: Optional[Pool] = None,
+            digest: Optional[str] = None,
+            timeout: Optional[float] = None,
+    ) -> Union[None, util.adict, Tuple[Any, ...], Row, FetchResult]:
+
+        if timeout and _EXPLAINABLE.match(sql) \
+                and 'MAX_EXECUTION_TIME' not in sql:
+            sql = _EXPLAINABLE.sub(
+                lambda m: f"{m.group(0)} /*+ MAX_EXECUTION_TIME("
+                          f"{max(int(timeout * 1000), 1)}) */",
+                sql, count=1,
+            )
 
-        async with cls.pool.acquire() as connection:  # type: ignore
+        entered = time.perf_counter()
+        async with cls.deadline(timeout) as deadline, \
+                cls.connect(pool) as (pool, connection):
+            deadline.watch(pool, connection)
+            wait = time.perf_counter() - entered
             if db:
-                await connection.select_db(db)
+                await cls.select_db(pool, connection, db)
 
-            cursorclasses = [ADictCursor] if adicts is True else []
+            cursorclasses = [ADictCursor] if adicts and not compact else []
             async with connection.cursor(*cursorclasses) as cur:
+                started = time.perf_counter()
                 try:
-                    await cur.execute(sql, params or ())
+                    await cls._run(pool, cur, sql, tuple(params or ()))
                     if not rows:
                         result = await cur.fetchall()
                     elif rows and rows == 1:
@@ -422,50 +1364,182 @@ class Executer:
 
                     if rows != 1 and not isinstance(result, list):
                         result = list(result)
+                # A CancelledError is an Exception on Python 3.7
+                except asyncio.CancelledError:  # pylint: disable=try-except-raise
+                    raise
                 except Exception:
-                    raise _ExcAdapter.err()
-
-        return FetchResult(result) if isinstance(result, list) else result
+                    exc = _ExcAdapter.err()
+                    cls._observe(
+                        pool, sql, params, db, digest, started, wait,
+                        error=type(exc).__name__,
+                    )
+                    raise exc
+                cls._observe(
+                    pool, sql, params, db, digest, started, wait,
+                    len(result) if rows != 1 else int(result is not None),
+                )
+
+                columns = None
+                if cur.description:
+                    columns = tuple(d[0] for d in cur.description)
+                if compact and columns:
+                    rowclass = Row.of(columns)
+                    if isinstance(result, list):
+                        result = list(map(rowclass, result))
+                    elif result is not None:
+                        result = rowclass(result)
+                if isinstance(result, list):
+                    result = FetchResult(result)
+                    result.columns = columns
+        return result
 
     @classmethod
     async def _execute(
             cls, sql: str,
             params: Optional[Union[tuple, list]] = None,
             many: bool = False,
-            db: Optional[str] = None
+            db: Optional[str] = None,
+            pool: Optional[Pool] = None,
+            digest: Optional[str] = None,
+            timeout: Optional[float] = None,
     ) -> ExecResult:
 
-        async with cls.pool.acquire() as connection:  # type: ignore
-
+        entered = time.perf_counter()
+        async with cls.deadline(timeout) as deadline, \
+                cls.connect(pool) as (pool, connection):
+            deadline.watch(pool, connection)
+            wait = time.perf_counter() - entered
             if db:
-                await connection.select_db(db)
+                await cls.select_db(pool, connection, db)
 
-            autocommit = connection.get_autocommit()
-            if not autocommit:
-                await connection.begin()
+            # Within a transaction block the block commits once at the
+            # end, otherwise the statement opens an implicit transaction
+            # when autocommit is off and is committed right away.
+            standalone = not (
+                connection.get_autocommit() or current_transaction()
+            )
+            started = time.perf_counter()
             try:
                 async with connection.cursor() as cur:
                     if many is True:
                         await cur.executemany(sql, params or ())
                     else:
-                        await cur.execute(sql, params or ())
+                        await cls._run(pool, cur, sql, tuple(params or ()))
                     affected, last_id = cur.rowcount, cur.lastrowid
-                if not autocommit:
+                if standalone:
                     await connection.commit()
+            # A CancelledError is an Exception on Python 3.7, it is not
+            # rolled back either, the connection is mid-statement
+            except asyncio.CancelledError:  # pylint: disable=try-except-raise
+                raise
             except Exception:
-                if not autocommit:
+                exc = _ExcAdapter.err()
+                cls._observe(
+                    pool, sql, None if many else params, db, digest,
+                    started, wait, error=type(exc).__name__,
+                )
+                if standalone:
                     await connection.rollback()
-                raise _ExcAdapter.err()
+                raise exc
+            cls._observe(
+                pool, sql, None if many else params, db, digest,
+                started, wait, max(affected, 0),
+            )
 
         return ExecResult(affected, last_id)
 
 
+class Deadline:
+    """Cancels the current task after "timeout" seconds.
+
+    The connection watched when it expires is closed at once, so that
+    the pool discards it, and ``kill`` stops its statement on the
+    server by ``KILL QUERY`` on a connection of its own, since the
+    pool may have no other to spare.
+    """
+
+    __slots__ = (
+        'expired', '_task', '_handle', '_pool', '_connection', '_thread',
+    )
+
+    def __init__(self, timeout: Optional[float] = None) -> None:
+        self.expired = False
+        self._task = None  # type: Optional[asyncio.Task]
+        self._handle = None  # type: Optional[asyncio.TimerHandle]
+        self._pool = None  # type: Optional[Pool]
+        self._connection = None  # type: Optional[aiomysql.Connection]
+        self._thread = None  # type: Optional[int]
+        if timeout:
+            self._task = asyncio.current_task()
+            self._handle = asyncio.get_event_loop().call_later(
+                timeout, self._expire
+            )
+
+    def watch(self, pool: Pool, connection: aiomysql.Connection) -> None:
+        if self._handle is not None:
+            self._pool, self._connection = pool, connection
+
+    def cancel(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+
+    def uncancel(self) -> None:
+        """Withdraw the cancellation of the expiry, so that it does
+        not count as a cancellation of the task (Python 3.11+)"""
+
+        uncancel = getattr(self._task, 'uncancel', None)
+        if uncancel is not None:
+            uncancel()
+
+    def _expire(self) -> None:
+        self.expired = True
+        connection = self._connection
+        if connection is not None and not connection.closed:
+            self._thread = connection.thread_id()
+            connection.close()
+        self._task.cancel()  # type: ignore
+
+    async def kill(self, timeout: float) -> None:
+        """Kill the statement of the expired connection, giving up
+        after "timeout" seconds"""
+
+        if self._thread is None:
+            return
+        try:
+            await asyncio.wait_for(self._kill(), timeout)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning(
+                "failed to kill the query of thread %s: %r", self._thread, e
+            )
+
+    async def _kill(self) -> None:
+        # pylint: disable=protected-access
+        side = await aiomysql.connect(**self._pool._connmeta)  # type: ignore
+        try:
+            async with side.cursor() as cur:
+                await cur.execute("KILL QUERY %s", (self._thread,))
+        finally:
+            side.close()
+
+
 class FetchResult(list):
 
+    # The column names of the rows, set for the fetched results
+    columns = None  # type: Optional[Tuple[str, ...]]
+
     @property
     def count(self):
         return len(self)
 
+    def clone(self) -> FetchResult:
+        """Returns a copy of which the dict rows are copied as well"""
+
+        result = FetchResult(
+            util.adict(r) if isinstance(r, dict) else r for r in self
+        )
+        result.columns = self.columns
+        return result
+
 
 class ExecResult:
 
@@ -605,5 +1679,9 @@ class _ExcAdapter:
         exc_type, exc_value, _traceback = sys.exc_info()
         if exc_type is not None:
             exc_cls = cls._exc_map.get(exc_type, exc_type)
+            if exc_cls is err.OperationalError and exc_value.args \
+                    and exc_value.args[0] == _ER_QUERY_TIMEOUT:
+                exc_cls = err.QueryTimeout
+            _metrics.METRICS.error(exc_cls.__name__)
             return exc_cls(exc_value)
         return err.ProgrammingError("No Exception info")
@@ -99,3 +99,10 @@ class NotSupportedError(MySQLError):  # for pymysql
     which is not supported by the database, e.g. requesting a
     .rollback() on a connection that does not support transaction or
     has transactions turned off."""
+
+
+class QueryTimeout(OperationalError):
+    """Exception raised when a query runs past its timeout, the query
+    is stopped on the server and its connection is discarded."""
+
+    description = 'Query execution exceeded the timeout'
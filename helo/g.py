@@ -7,7 +7,7 @@ import warnings
 from types import ModuleType
 from typing import Any, Optional, Type, Union, List, Tuple
 
-from . import db, model, util, _builder
+from . import db, model, util, _builder, _slowlog
 
 
 @util.singleton
@@ -19,8 +19,11 @@ class G:
     >>> db = helo.G()
 
     :param app: Web application like Quart app
-    :param debug: Record the executed SQL statement if true
+    :param debug: Record the executed SQL statement if true, or a dict
+        of the options of the query log, see ``db.binding``
     :param env_key: Environment variable key name of helo database url
+    :param slowlog: Record the statements slower than a threshold,
+        see the ``slowlog`` of ``db.binding``
     """
 
     def __init__(
@@ -28,9 +31,11 @@ class G:
         app: Optional[Any] = None,
         debug: bool = False,
         env_key: Optional[str] = None,
+        slowlog: Any = None,
     ) -> None:
         self.init_app(app)
         self.debug = debug
+        self._slowlog = slowlog
         self.set_env_key(env_key)
 
     def __repr__(self):
@@ -46,6 +51,20 @@ class G:
     def state(self) -> Optional[util.adict]:
         return db.state()
 
+    def metrics(self, reset: bool = False) -> util.adict:
+        """Snapshot of the instrumentation, see ``db.metrics``"""
+
+        return db.metrics(reset)
+
+    def prometheus(self) -> str:
+        """The instrumentation in the Prometheus text format"""
+
+        return db.prometheus()
+
+    @property
+    def slowlog(self) -> Optional[_slowlog.SlowLog]:
+        return db.slowlog()
+
     def init_app(self, app) -> None:
         if not app:
             return None
@@ -69,10 +88,12 @@ class G:
         """A coroutine that binding a database.
 
         :param url: Database url
-        :param kwargs: see ``db.Pool``
+        :param kwargs: see ``db.binding`` and ``db.Pool``,
+            e.g. ``replicas`` to split reads across read replicas
         """
 
         url = url or db.EnvKey.get()
+        kwargs.setdefault('slowlog', self._slowlog)
         return await db.binding(url, debug=self.debug, **kwargs)
 
     async def unbind(self) -> bool:
@@ -80,6 +101,29 @@ class G:
 
         return await db.unbinding()
 
+    def transaction(self) -> db.Transaction:
+        """A transaction context pinned to the current task
+
+        >>> async with db.transaction():
+        ...     await User.add(nickname='at7h')
+        """
+
+        return db.transaction()
+
+    def templates(self, maxsize: Optional[int] = None) -> util.adict:
+        """Stats of the cache of rendered query templates,
+        resize it with "maxsize" first if given, 0 to disable it.
+        """
+
+        return _builder.templates(maxsize)
+
+    def querycache(self, maxbytes: Optional[int] = None) -> util.adict:
+        """Stats of the cache of ``Select.cached`` results,
+        resize it with "maxbytes" first if given.
+        """
+
+        return model.querycache(maxbytes)
+
     def binder(self, url: Optional[str] = None, **kwargs: Any) -> db.Binder:
         """Handling of bound context"""
 
@@ -138,9 +182,16 @@ class G:
     ) -> Union[
         None, util.adict, Tuple[Any, ...], db.FetchResult, db.ExecResult
     ]:
-        """A coroutine that used to directly execute SQL query statements"""
+        """A coroutine that used to directly execute SQL query statements,
+        rowtype='compact' returns the rows as ``db.Row``.
+        """
 
         query = sql
         if not isinstance(query, _builder.Query):
             query = _builder.Query(query, kwargs.pop('params', None))
+        rowtype = kwargs.pop('rowtype', None)
+        if rowtype is not None:
+            if rowtype != model.ROWTYPE.COMPACT:
+                raise ValueError(f"invalid rowtype {rowtype!r}")
+            kwargs['compact'] = True
         return await db.execute(query, **kwargs)
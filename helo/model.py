@@ -6,12 +6,26 @@
 """
 from __future__ import annotations
 
+import array
+import asyncio
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import time
 import warnings
+import weakref
 import re
-from copy import deepcopy
-from typing import Any, Dict, Optional, List, Union, Tuple, Type
+from copy import copy, deepcopy
+from typing import (
+    Any, Dict, Optional, List, Union, Tuple, Type,
+    AsyncIterable, AsyncIterator, Awaitable, Hashable, Iterable,
+)
 
-from . import db, util, err, types, _builder, _helper
+from . import db, util, err, types, _builder, _cache, _helper
 
 __all__ = (
     'Model',
@@ -23,6 +37,7 @@ __all__ = (
 ROWTYPE = util.adict(
     MODEL=1,
     ADICT=2,
+    COMPACT='compact',
 )
 JOINTYPE = util.adict(
     INNER='INNER',
@@ -31,6 +46,41 @@ JOINTYPE = util.adict(
 )
 _TABLENAME_REGEX = re.compile(r'([a-z]|\d)([A-Z])')
 _BUILTIN_MODEL_NAMES = ("ModelBase", "Model")
+# The field delimiters of the files ``Model.load_file`` reads
+_LOAD_FORMATS = {'csv': ',', 'tsv': '\t'}
+_EXPORT_FORMATS = ('csv', 'jsonl')
+_EXPORT_BUFFER = 1024 * 1024
+_JSON_TYPES = (str, int, float, bool)
+# The ``array`` typecodes of the numeric fields, upper for unsigned
+_ARRAY_TYPECODES = {
+    types.Tinyint: 'b',
+    types.Smallint: 'h',
+    types.Int: 'i',
+    types.Bigint: 'q',
+    types.BigAuto: 'q',
+    types.Float: 'd',
+}
+# The escapes of the default format of ``LOAD DATA``
+_INFILE_ESCAPES = str.maketrans({
+    '\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': '\\0',
+})
+# The raw SQL of the selects helo builds itself, read no table
+_PLAIN_SQL = frozenset(('*', '1'))
+# The values of a model object changed in place rather than by
+# assignment, copied deeply into its ``__origin__``
+_MUTABLE_TYPES = (dict, list, set, bytearray)
+_MISSING = object()
+
+QUERIES = _cache.QueryCache()
+
+
+def querycache(maxbytes: Optional[int] = None) -> util.adict:
+    """Returns the stats of the cache of ``Select.cached`` results,
+    resizes it first if "maxbytes" is given.
+    """
+    if maxbytes is not None:
+        QUERIES.resize(maxbytes)
+    return QUERIES.stats()
 
 
 class ModelType(type):
@@ -102,9 +152,25 @@ class ModelType(type):
                 comment=getattr(metaclass, "comment", None),
             )
 
+            cache_size = getattr(metaclass, "cache_size", None)
+            if cache_size:
+                attrs["__rowcache__"] = RowCache(
+                    attrs["__table__"],
+                    RowCache.MAXSIZE if cache_size is True else cache_size,
+                    getattr(metaclass, "cache_ttl", RowCache.TTL),
+                )
+
+            batch_get = getattr(metaclass, "batch_get", None)
+            if batch_get:
+                attrs["__batcher__"] = GetBatcher(
+                    GetBatcher.MAXSIZE if batch_get is True else batch_get
+                )
+
             return attrs
 
         attrs['__table__'] = None
+        attrs['__batcher__'] = None
+        attrs['__rowcache__'] = None
         if name not in _BUILTIN_MODEL_NAMES:
             attrs = __prepare__()
 
@@ -141,11 +207,16 @@ class ModelType(type):
     def __aiter__(cls) -> Select:
         return ApiProxy.select(cls)  # type: ignore
 
-    def __getitem__(cls, _id: types.ID) -> Model:
-        raise NotImplementedError
+    def __getitem__(cls, _id: types.ID) -> Awaitable[Optional[Model]]:
+        return ApiProxy.get(cls, _id)
 
-    def __contains__(cls, _id: types.ID) -> bool:
-        raise NotImplementedError
+    def __contains__(cls, _id: Any) -> bool:
+        """Whether the row of the id (or of the model object) is held
+        by the row cache, always False without one, see ``iscached``"""
+
+        if isinstance(_id, ModelBase):
+            _id = getattr(_id, cls.__table__.primary.attr, None)
+        return cls.iscached(_id)
 
 
 def get_table(m: Union[Type[Model], Model]) -> types.Table:
@@ -164,6 +235,10 @@ def get_attrs(m: Union[Type[Model], Model]) -> Dict[str, Any]:
 
 class ModelBase:
 
+    # "__origin__" holds the values loaded from or last saved to the
+    # database, ``save`` compares with it to write only the changes.
+    __slots__ = ('__dict__', '__weakref__', '__origin__')
+
     def __init__(self, **kwargs: Any) -> None:
         for attr in kwargs:
             setattr(self, attr, kwargs[attr])
@@ -265,6 +340,11 @@ class Model(_helper.with_metaclass(ModelType, ModelBase)):  # type: ignore
         <User objetc> at 1
         >>> user.nickname
         'at7h'
+
+        With ``batch_get = <max batch size>`` in the model Meta,
+        the concurrent gets by primary key are sent as one query.
+        With ``cache_size = <max rows>`` in the model Meta, the rows
+        got by primary key are cached for ``cache_ttl`` seconds.
         """
 
         if not by:
@@ -288,6 +368,35 @@ class Model(_helper.with_metaclass(ModelType, ModelBase)):  # type: ignore
             raise ValueError("no condition to mget")
         return await ApiProxy.get_many(cls, by, columns=columns)
 
+    @classmethod
+    def cachestats(cls) -> Optional[util.adict]:
+        """Return the statistics of the row cache,
+        None if the cache is not enabled
+
+        >>> User.cachestats()
+        {'size': 2, 'maxsize': 1024, 'hits': 10, 'misses': 2, ...}
+        """
+
+        if cls.__rowcache__ is None:
+            return None
+        return cls.__rowcache__.stats()
+
+    @classmethod
+    def iscached(cls, _id: types.ID) -> bool:
+        """Whether the row of the id is held by the row cache,
+        the database is not queried, False if the model has none
+
+        >>> await User[1]
+        >>> User.iscached(1)
+        True
+        >>> 1 in User
+        True
+        """
+
+        if cls.__rowcache__ is None:
+            return False
+        return _id in cls.__rowcache__
+
     @classmethod
     async def add(
         cls,
@@ -334,6 +443,69 @@ class Model(_helper.with_metaclass(ModelType, ModelBase)):  # type: ignore
             raise ValueError("no data to madd")
         return await ApiProxy.add_many(cls, rows)
 
+    @classmethod
+    async def bulk_insert(
+        cls,
+        rows: Union[Iterable[Union[Dict[str, Any], Model]],
+                    AsyncIterable[Union[Dict[str, Any], Model]]],
+        chunk_rows: int = 1000,
+        max_bytes: int = 1000000,
+        concurrency: int = 4,
+    ) -> util.adict:
+        """Inserting a large number of rows from an iterable or an
+        async iterable, split into multi-row inserts of at most
+        "chunk_rows" rows and about "max_bytes" bytes of values,
+        which run on up to "concurrency" connections at once.
+
+        Every chunk commits on its own, the chunks done before an
+        error stay inserted unless it runs in a transaction.
+
+        >>> await User.bulk_insert(
+        ...     ({'nickname': f'user{i}'} for i in range(100000)))
+        {'rows': 100000, 'affected': 100000, 'seconds': 2.1,
+         'chunks': [{'rows': 1000, 'bytes': 31780, 'seconds': 0.08}, ...]}
+        """
+
+        if chunk_rows <= 0 or max_bytes <= 0 or concurrency <= 0:
+            raise ValueError(
+                "chunk_rows, max_bytes and concurrency must be positive"
+            )
+        return await ApiProxy.bulk_insert(
+            cls, rows, chunk_rows, max_bytes, concurrency
+        )
+
+    @classmethod
+    async def load_file(
+        cls,
+        source: Union[str, os.PathLike, Iterable[Any], AsyncIterable[Any]],
+        columns: Optional[List[Union[str, types.FieldBase]]] = None,
+        format: str = 'csv',  # pylint: disable=redefined-builtin
+    ) -> int:
+        """Loading rows with ``LOAD DATA LOCAL INFILE``, much faster
+        than ``madd`` for large imports, the binding must be created
+        with ``local_infile=True``.
+
+        "source" is the path of a csv or tsv ("format") file, the
+        first line of which is the column names if "columns" is not
+        given, and an empty value of it is loaded as NULL. It can be an
+        iterable or async iterable of dicts, models or tuples
+        (which need "columns") as well.
+
+        The values are converted by the fields into a temporary file
+        that is sent to MySQL. Returns the number of rows loaded.
+
+        >>> await User.load_file('users.csv')
+        100000
+        >>> await User.load_file(
+        ...     ((f'user{i}', i % 2) for i in range(100000)),
+        ...     columns=[User.nickname, User.gender])
+        100000
+        """
+
+        if format not in _LOAD_FORMATS:
+            raise ValueError(f"invalid load file format: {format!r}")
+        return await ApiProxy.load_file(cls, source, columns, format)
+
     @classmethod
     async def set(cls, _id: types.ID, **values: Any) -> int:
         """Setting the value of a row with the primary key
@@ -476,14 +648,71 @@ class Model(_helper.with_metaclass(ModelType, ModelBase)):  # type: ignore
             raise ValueError("no data to mreplace")
         return ApiProxy.replace_many(cls, rows, columns=columns)
 
+    @classmethod
+    async def upsert(
+        cls,
+        __row: Optional[Dict[str, Any]] = None,
+        update: Union[None, List[Any], Dict[str, Any]] = None,
+        **values: Any
+    ) -> util.adict:
+        """MySQL INSERT ... ON DUPLICATE KEY UPDATE, inserting a row or
+        updating the existing row which has the same unique key.
+
+        "update" is the list of attributes (or fields) set to the
+        inserted values, all inserted except the primary key by default,
+        or a dict of the values or expressions to set.
+
+        >>> await User.upsert(nickname='at7h', password='777')
+        {'inserted': 1, 'updated': 0}
+        >>> await User.upsert(
+        ...     nickname='at7h', logins=1,
+        ...     update={'logins': User.logins + F.VALUES(User.logins)})
+        {'inserted': 0, 'updated': 1}
+
+        The counts are derived from the affected rows, in which MySQL
+        counts 1 for an inserted row and 2 for an updated row, a row
+        updated to its current values counts 0 and skews them.
+        """
+
+        row = __row or values
+        if not row:
+            raise ValueError("no data to upsert")
+        return await ApiProxy.upsert(cls, [row], update=update)
+
+    @classmethod
+    async def mupsert(
+        cls,
+        rows: List[Union[Dict[str, Any], Tuple[Any, ...]]],
+        update: Union[None, List[Any], Dict[str, Any]] = None,
+        columns: Optional[List[types.FieldBase]] = None
+    ) -> util.adict:
+        """MySQL INSERT ... ON DUPLICATE KEY UPDATE, similar to ``upsert``
+        with the rows like ``minsert``, the expressions of "update" can
+        not take params, use ``F.VALUES`` to refer to the inserted values.
+
+        >>> await User.mupsert(users, update=['password'])
+        {'inserted': 2, 'updated': 1}
+        """
+
+        if not rows:
+            raise ValueError("no data to mupsert")
+        return await ApiProxy.upsert(
+            cls, rows, update=update, columns=columns, many=True
+        )
+
     # instance
 
     async def save(self) -> types.ID:
-        """Write objects in memory to database
+        """Write objects in memory to database, a new object is
+        inserted, a loaded or saved one only updates the changed
+        columns and does nothing if none changed.
 
         >>> user = User(nickname='at7h',password='777')
         >>> await user.save()
         1
+        >>> user.password = '888'
+        >>> await user.save()  # UPDATE ... SET `password` = '888'
+        1
         """
         return await ApiProxy.save(self)
 
@@ -536,10 +765,28 @@ class ApiProxy:
     ) -> Union[None, Model]:
 
         where = by
-        if not isinstance(where, types.Expression):
-            where = get_table(m).primary.field == where
-        return (await Select([_builder.SQL("*")], [m]).where(where)  # type: ignore
-                .get())
+        if isinstance(where, types.Expression):
+            return (await Select([_builder.SQL("*")], [m]).where(where)  # type: ignore
+                    .get())
+
+        # Inside a transaction always read through its connection
+        intx = db.current_transaction() is not None
+        cache = None if intx else m.__rowcache__
+        if cache is not None:
+            mo = cache.get(by)
+            if mo is not None:
+                return mo
+            generation = cache.generation
+
+        if m.__batcher__ is not None and not intx:
+            mo = await m.__batcher__.get(m, by)
+        else:
+            mo = await Select([_builder.SQL("*")], [m]).where(  # type: ignore
+                get_table(m).primary.field == by
+            ).get()
+        if cache is not None:
+            cache.put(mo, generation)
+        return mo
 
     @classmethod
     @util.argschecker(by=(types.SEQUENCE, types.Expression))
@@ -552,11 +799,42 @@ class ApiProxy:
 
         where = by
         if isinstance(where, types.SEQUENCE):
+            cache = m.__rowcache__
+            if (cache is not None and columns is None
+                    and db.current_transaction() is None):
+                return await cls._get_many_cached(m, cache, by)
             where = get_table(m).primary.field.in_(by)
         return await (
             Select(columns or [_builder.SQL("*")], [m]).where(where).all()  # type: ignore
         )
 
+    @classmethod
+    async def _get_many_cached(
+        cls, m: Type[Model], cache: RowCache, ids: List[types.ID],
+    ) -> db.FetchResult:
+        """Get the rows missed by the row cache and return
+        all of them in the order of ids.
+        """
+
+        found, missing = {}, []
+        for _id in ids:
+            key = cache.key(_id)
+            if key in found:
+                continue
+            found[key] = cache.get(_id)
+            if found[key] is None:
+                missing.append(_id)
+
+        if missing:
+            generation = cache.generation
+            rows = await Select([_builder.SQL("*")], [m]).where(  # type: ignore
+                get_table(m).primary.field.in_(missing)
+            ).all()
+            for row in rows:
+                found[cache.key(cache.pk(row))] = row
+                cache.put(row, generation)
+        return db.FetchResult(mo for mo in found.values() if mo is not None)
+
     @classmethod
     @util.argschecker(row=dict, nullable=False)
     async def add(
@@ -591,6 +869,209 @@ class ApiProxy:
             await Insert(get_table(m), ValuesMatch(addrows), many=True).do()
         ).affected
 
+    @classmethod
+    async def bulk_insert(
+        cls,
+        m: Type[Model],
+        rows: Union[Iterable[Any], AsyncIterable[Any]],
+        chunk_rows: int,
+        max_bytes: int,
+        concurrency: int,
+    ) -> util.adict:
+
+        table = get_table(m)
+        semaphore = asyncio.Semaphore(concurrency)
+        chunks = []  # type: List[util.adict]
+        tasks = []  # type: List[asyncio.Future]
+
+        async def insert(chunk: util.adict, addrows: List[Dict[str, Any]]):
+            try:
+                started = time.perf_counter()
+                result = await Insert(
+                    table, ValuesMatch(addrows), many=True
+                ).do()
+                chunk.seconds = time.perf_counter() - started
+                chunk.affected = result.affected
+            finally:
+                semaphore.release()
+
+        started = time.perf_counter()
+        try:
+            async for addrows, nbytes in cls._insert_chunks(
+                    m, rows, chunk_rows, max_bytes):
+                await semaphore.acquire()
+                if any(t.done() and (t.cancelled() or t.exception())
+                       for t in tasks):
+                    semaphore.release()
+                    break
+                chunk = util.adict(rows=len(addrows), bytes=nbytes)
+                chunks.append(chunk)
+                tasks.append(asyncio.ensure_future(insert(chunk, addrows)))
+        finally:
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        return util.adict(
+            rows=sum(c.rows for c in chunks),
+            affected=sum(c.affected for c in chunks),
+            seconds=time.perf_counter() - started,
+            chunks=chunks,
+        )
+
+    @classmethod
+    async def _insert_chunks(
+        cls,
+        m: Type[Model],
+        rows: Union[Iterable[Any], AsyncIterable[Any]],
+        chunk_rows: int,
+        max_bytes: int,
+    ) -> AsyncIterator[Tuple[List[Dict[str, Any]], int]]:
+        """Yields the normalized rows in chunks of the same columns,
+        at most "chunk_rows" rows and about "max_bytes" bytes.
+        """
+
+        if not hasattr(rows, '__aiter__'):
+            rows = _aiter(rows)  # type: ignore
+
+        chunk, columns, nbytes = [], None, 0  # type: List[Dict[str, Any]], Any, int
+        async for row in rows:  # type: ignore
+            if isinstance(row, m):
+                row = row.__self__
+            elif not isinstance(row, dict):
+                raise ValueError(f"invalid data {row!r} to add")
+            addrow = cls._gen_insert_row(m, dict(row))
+            rowbytes = sum(map(_literal_bytes, addrow.values()))
+            if chunk and (
+                    len(chunk) >= chunk_rows
+                    or nbytes + rowbytes > max_bytes
+                    or tuple(addrow) != columns):
+                yield chunk, nbytes
+                chunk, nbytes = [], 0
+            chunk.append(addrow)
+            columns = tuple(addrow)
+            nbytes += rowbytes
+        if chunk:
+            yield chunk, nbytes
+
+    @classmethod
+    async def load_file(
+        cls,
+        m: Type[Model],
+        source: Union[str, os.PathLike, Iterable[Any], AsyncIterable[Any]],
+        columns: Optional[List[Union[str, types.FieldBase]]],
+        fmt: str,
+    ) -> int:
+
+        pool = db.Executer.pool
+        if pool is not None and not pool.connmeta.local_infile:
+            raise err.NotAllowedError(
+                "load_file needs the binding with `local_infile=True`"
+            )
+
+        fields = None if columns is None else cls._fields_of(m, columns)
+        fd, path = tempfile.mkstemp(prefix='helo-', suffix='.tsv')
+        loop = asyncio.get_event_loop()
+        try:
+            with os.fdopen(fd, 'wb') as infile:
+                if hasattr(source, '__aiter__'):
+                    fields = await cls._write_infile_async(
+                        m, infile, source, fields, loop)  # type: ignore
+                else:
+                    fields = await loop.run_in_executor(
+                        None, cls._write_infile, m, infile, source, fields, fmt)
+            if not fields:
+                return 0
+            return (await LoadData(get_table(m), path, fields).do()).affected
+        finally:
+            os.unlink(path)
+
+    @classmethod
+    def _fields_of(
+        cls, m: Type[Model], columns: Iterable[Union[str, types.FieldBase]]
+    ) -> List[types.FieldBase]:
+
+        table, mattrs = get_table(m), get_attrs(m)
+        fields = []
+        for c in columns:
+            if isinstance(c, types.FieldBase):
+                c = c.name
+            f = table.fields_dict.get(mattrs.get(c, c))
+            if f is None:
+                raise ValueError(f"{m!r} has no column {c}")
+            fields.append(f)
+        return fields
+
+    @classmethod
+    def _infile_rows(
+        cls, m: Type[Model], rows: Iterable[Any],
+        fields: Optional[List[types.FieldBase]],
+    ) -> Iterable[Tuple[List[types.FieldBase], bytes]]:
+        """Yields the fields and the infile line of each row"""
+
+        mattrs = get_attrs(m)
+        for row in rows:
+            if isinstance(row, ModelBase):
+                row = row.__self__
+            if isinstance(row, dict):
+                if fields is None:
+                    fields = cls._fields_of(m, row)
+                values = []
+                for f in fields:
+                    attr = mattrs[f.name]
+                    values.append(row[attr] if attr in row else row.get(f.name))
+            elif isinstance(row, types.SEQUENCE):
+                if fields is None:
+                    raise ValueError("columns are required for tuple rows")
+                if len(row) != len(fields):
+                    raise ValueError(f"invalid data {row!r} for columns")
+                values = row  # type: ignore
+            else:
+                raise ValueError(f"invalid data {row!r} to load")
+            yield fields, _infile_line(fields, values)
+
+    @classmethod
+    def _write_infile(
+        cls, m: Type[Model], infile: Any, source: Any,
+        fields: Optional[List[types.FieldBase]], fmt: str,
+    ) -> Optional[List[types.FieldBase]]:
+
+        # The fields are the ones of the first row unless given
+        columns = fields
+        if not isinstance(source, (str, os.PathLike)):
+            for columns, line in cls._infile_rows(m, source, columns):
+                infile.write(line)
+            return columns
+
+        with open(source, newline='', encoding='utf8') as fp:
+            reader = csv.reader(fp, delimiter=_LOAD_FORMATS[fmt])
+            if columns is None:
+                columns = cls._fields_of(m, next(reader, []))
+            rows = ([v if v != '' else None for v in r] for r in reader if r)
+            for columns, line in cls._infile_rows(m, rows, columns):
+                infile.write(line)
+        return columns
+
+    @classmethod
+    async def _write_infile_async(
+        cls, m: Type[Model], infile: Any, source: AsyncIterable[Any],
+        fields: Optional[List[types.FieldBase]],
+        loop: asyncio.AbstractEventLoop,
+    ) -> Optional[List[types.FieldBase]]:
+
+        columns = fields
+        lines = []  # type: List[bytes]
+        async for row in source:
+            for columns, line in cls._infile_rows(m, (row,), columns):
+                lines.append(line)
+            if len(lines) >= 10000:
+                await loop.run_in_executor(None, infile.write, b''.join(lines))
+                lines.clear()
+        if lines:
+            await loop.run_in_executor(None, infile.write, b''.join(lines))
+        return columns
+
     @classmethod
     @util.argschecker(values=dict, nullable=False)
     async def set(
@@ -673,23 +1154,102 @@ class ApiProxy:
         normalize_rows = cls._normalize_insert_rows(m, rows, columns, for_replace=True)
         return Replace(get_table(m), ValuesMatch(normalize_rows), many=True)
 
+    @classmethod
+    async def upsert(
+        cls,
+        m: Type[Model],
+        rows: List[Union[Dict[str, Any], Tuple[Any, ...]]],
+        update: Union[None, List[Any], Dict[str, Any]] = None,
+        columns: Optional[List[types.FieldBase]] = None,
+        many: bool = False
+    ) -> util.adict:
+
+        table = get_table(m)
+        if update is None:
+            # Updates the given columns except the primary key
+            update = [
+                attr for attr in (
+                    [cls._attr_of(m, c) for c in columns]
+                    if columns else rows[0]
+                ) if attr != table.primary.attr
+            ]
+        normalize_rows = cls._normalize_insert_rows(
+            m, [r.copy() if isinstance(r, dict) else r for r in rows],
+            columns, for_replace=True
+        )
+        if not isinstance(update, dict):
+            update = {
+                cls._attr_of(m, u): types.F.VALUES(
+                    table.fields_dict[cls._attr_of(m, u)])
+                for u in update
+            }
+        if not update:
+            raise ValueError("no columns to update for upsert")
+
+        assignments = AssignmentList(
+            cls._normalize_update_values(m, update)
+        )
+        if many and _builder.parse(assignments).params:
+            raise ValueError(
+                "update of mupsert can not take params, use F.VALUES"
+            )
+        result = await Insert(
+            table,
+            ValuesMatch(normalize_rows if many else normalize_rows[0]),
+            many=many
+        ).on_duplicate(assignments).do()
+
+        # Each inserted row affects 1 and each updated row affects 2
+        updated = max(result.affected - len(normalize_rows), 0)
+        return util.adict(
+            inserted=result.affected - 2 * updated, updated=updated
+        )
+
+    @classmethod
+    def _attr_of(
+        cls, m: Type[Model], column: Union[str, types.FieldBase]
+    ) -> str:
+        if isinstance(column, types.FieldBase):
+            attr = get_attrs(m).get(column.name)
+        else:
+            attr = column if column in get_table(m).fields_dict else None
+        if attr is None:
+            raise ValueError(f"'{m!r}' has no attribute {column}")
+        return attr
+
     @classmethod
     async def save(cls, mo: Model) -> types.ID:
         """ Save model object to db """
 
-        has_id = False
-        pk_attr = get_table(mo).primary.attr
-        if pk_attr in mo.__self__:
-            has_id = True
-
-        row = cls._gen_insert_row(mo, mo.__self__, for_replace=has_id)
-        result = await Replace(get_table(mo), ValuesMatch(row)).do()
-        mo.__setmodel__(
-            name=pk_attr,
-            value=result.last_id,
-            __load__=True
-        )
-        return result.last_id
+        table = get_table(mo)
+        pk_attr = table.primary.attr
+        origin = getattr(mo, '__origin__', None)
+        if origin is not None and origin.get(pk_attr) is not None:
+            changed = {
+                attr: value for attr, value in mo.__dict__.items()
+                if attr not in origin or origin[attr] != value
+            }
+            if changed:
+                await Update(
+                    table,
+                    AssignmentList(
+                        cls._normalize_update_values(mo, changed))
+                ).where(
+                    table.primary.field == origin[pk_attr]
+                ).do()
+            _id = mo.__dict__.get(pk_attr)
+        else:
+            has_id = pk_attr in mo.__dict__
+            row = cls._gen_insert_row(mo, mo.__self__, for_replace=has_id)
+            if has_id:
+                result = await Replace(table, ValuesMatch(row)).do()
+            else:
+                result = await Insert(table, ValuesMatch(row)).do()
+            _id = result.last_id
+            mo.__setmodel__(name=pk_attr, value=_id, __load__=True)
+
+        object.__setattr__(mo, '__origin__', _snapshot(mo.__dict__))
+        return _id
 
     @classmethod
     async def remove(cls, mo: Model) -> int:
@@ -704,6 +1264,7 @@ class ApiProxy:
         ).where(
             table.primary.field == primary_value
         ).do()
+        object.__setattr__(mo, '__origin__', None)
         return ret.affected
 
     @classmethod
@@ -831,6 +1392,10 @@ class ValuesMatch(_builder.Node):
         ).values(self._values)
         return ctx
 
+    def __key__(self, ctx: _builder.Context) -> Hashable:
+        ctx.values(self._values)
+        return (ValuesMatch, tuple(c.sql for c in self._columns))
+
 
 class Join(_builder.Node):
 
@@ -865,6 +1430,13 @@ class Join(_builder.Node):
                 ctx.literal(' ON ').sql(self._on)
         return ctx
 
+    def __key__(self, ctx: _builder.Context) -> Hashable:
+        with ctx(params=True):
+            return (
+                Join, self.join_type, ctx.key(self.lt), ctx.key(self.rt),
+                None if self._on is None else ctx.key(self._on)
+            )
+
 
 class AssignmentList(_builder.Node):
 
@@ -887,7 +1459,7 @@ class AssignmentList(_builder.Node):
                             value.column)
                     )
                 ))
-            elif isinstance(value, types.Expression):
+            elif isinstance(value, _builder.Node):
                 query = _builder.parse(value)
                 values.append(_builder.SQL(
                     self._VSM.format(
@@ -895,7 +1467,7 @@ class AssignmentList(_builder.Node):
                         val=query.sql[0:-1]
                     )
                 ))
-                params.append(query.params)
+                params.extend(query.params)
             else:
                 values.append(_builder.SQL(
                     self._VSM.format(col=col, val='%s')
@@ -910,6 +1482,23 @@ class AssignmentList(_builder.Node):
 
         return ctx
 
+    def __key__(self, ctx: _builder.Context) -> Hashable:
+        keys, params = [], []
+        for col, value in self._data_dict.items():
+            if isinstance(value, types.FieldBase):
+                keys.append((col, value.table.table_name, value.column))
+            elif isinstance(value, _builder.Node):
+                sub = _builder.Context()
+                keys.append((col, sub.key(value)))
+                params.extend(sub._values)  # pylint: disable=protected-access
+            else:
+                keys.append((col,))
+                params.append(value)
+
+        if params:
+            ctx.values(params)
+        return (AssignmentList, tuple(keys))
+
 
 class BaseQuery(_builder.Node):
 
@@ -926,10 +1515,21 @@ class BaseQuery(_builder.Node):
     def __str__(self) -> str:
         return str(self.query)
 
+    def __copy__(self) -> BaseQuery:
+        """A shallow copy of which the props are copied as well,
+        running it does not change the ones of this query"""
+
+        query = self.__class__.__new__(self.__class__)
+        for klass in self.__class__.__mro__:
+            for name in getattr(klass, '__slots__', ()):
+                if hasattr(self, name):
+                    setattr(query, name, getattr(self, name))
+        query._props = util.adict(self._props)
+        return query
+
     def __query__(self) -> _builder.Query:
-        ctx = _builder.Context.from_node(self)
-        self._aliases = ctx.aliases
-        return ctx.query_of()
+        query, self._aliases = _builder.TEMPLATES.query_of(self)
+        return query
 
     @property
     def query(self) -> _builder.Query:
@@ -948,11 +1548,34 @@ class BaseQuery(_builder.Node):
 
 class WriteQuery(BaseQuery):
 
-    __slots__ = ()
+    __slots__ = ('_table',)
     __fread__ = False
 
-    async def do(self) -> db.ExecResult:
-        return await self.__do__()
+    def __init__(self, table: types.Table) -> None:
+        super().__init__()
+        self._table = table
+
+    async def do(self, timeout: Optional[float] = None) -> db.ExecResult:
+        """If "timeout" is given, the seconds the statement may take,
+        see ``db.Executer.do``
+        """
+        try:
+            return await self.__do__(timeout=timeout)
+        finally:
+            # The other connections see the writes of a transaction
+            # once it ends, until then what they read and cache is
+            # as current as before
+            tx = db.current_transaction()
+            if tx is None:
+                self.__invalidate__()
+            else:
+                tx.on_end(self.__invalidate__)
+
+    def __invalidate__(self) -> None:
+        """Discards what the caches hold for the written table"""
+
+        RowCache.invalidate(self._table)
+        QUERIES.invalidate(self._table.name)
 
     def __sql__(self, ctx: _builder.Context) -> _builder.Context:
         raise NotImplementedError
@@ -963,7 +1586,8 @@ class Select(BaseQuery):
     __slots__ = (
         '_models', '_columns', '_froms', '_where',
         '_group_by', '_having', '_order_by', '_limit',
-        '_offset', '_rowtype', '_gotlist', '_gotidx',
+        '_offset', '_rowtype', '_gotlist', '_gotidx', '_gotafter',
+        '_cachettl', '_cachetables',
     )
     _SINGLE = 1
     _BATCH = 200
@@ -985,6 +1609,9 @@ class Select(BaseQuery):
         self._offset = None    # type: Optional[int]
         self._gotlist = []     # type: List[Model]
         self._gotidx = 0
+        self._gotafter = None  # type: Optional[str]
+        self._cachettl = None  # type: Optional[float]
+        self._cachetables = None  # type: Optional[Tuple[str, ...]]
         self._rowtype = ROWTYPE.MODEL
 
     def join(
@@ -1039,27 +1666,83 @@ class Select(BaseQuery):
         self._offset = offset
         return self
 
+    def singleflight(self, enabled: bool = True) -> Select:
+        """Run the query once for the identical ones issued while it is
+        in flight, overrides the ``singleflight`` option of the binding.
+        """
+        self._props.singleflight = enabled
+        return self
+
+    def cached(
+        self,
+        ttl: float = 60,
+        tables: Optional[Iterable[Union[str, Type[Model]]]] = None,
+    ) -> Select:
+        """Cache the results of the query in process for "ttl" seconds,
+        keyed by its SQL and params, the results are discarded once
+        helo writes to any table the query reads. See ``querycache``.
+
+        The tables read by raw ``SQL`` are unknown, a query with such
+        nodes is cached only if "tables" declares the models or the
+        names of the tables they read (which may be none).
+
+        >>> await User.select(User.age, F.COUNT(User.id)).group_by(
+        ...     User.age).cached(ttl=30).all()
+        >>> await User.select().where(SQL(
+        ...     "`role` IN (SELECT `id` FROM `role_`)")).cached(
+        ...     tables=[Role]).all()
+        """
+        if ttl <= 0:
+            raise ValueError(f"invalid cache ttl: {ttl}")
+        self._cachettl = ttl
+        if tables is not None:
+            self._cachetables = tuple(
+                t if isinstance(t, str) else get_table(t).name
+                for t in tables
+            )
+        return self
+
     #
     # Single
     #
     async def get(
-        self, wrap: bool = True
+        self,
+        wrap: bool = True,
+        use_primary: bool = False,
+        timeout: Optional[float] = None,
     ) -> Union[None, util.adict, Model]:
         """If "wrap" is False, the returned row type is not
         wrapped as the ``Model`` object, and the original
-        ``helo.util.adict`` is used
+        ``helo.util.adict`` is used.
+        If "use_primary" is True, read from the primary
+        even if replicas are bound.
+        If "timeout" is given, the seconds the query may take,
+        see ``db.Executer.do``.
         """
-        return await self.__do__(rows=self._SINGLE, wrap=wrap)
+        return await self.__do__(
+            rows=self._SINGLE, wrap=wrap, use_primary=use_primary,
+            timeout=timeout,
+        )
 
     async def first(
-        self, wrap: bool = True
+        self,
+        wrap: bool = True,
+        use_primary: bool = False,
+        timeout: Optional[float] = None,
     ) -> Union[None, util.adict, Model]:
         """If "wrap" is False, the returned row type is not
         wrapped as the ``Model`` object, and the original
-        ``helo.util.adict`` is used
+        ``helo.util.adict`` is used.
+        If "use_primary" is True, read from the primary
+        even if replicas are bound.
+        If "timeout" is given, the seconds the query may take,
+        see ``db.Executer.do``.
         """
         self.limit(self._SINGLE)
-        return await self.__do__(rows=self._SINGLE, wrap=wrap)
+        return await self.__do__(
+            rows=self._SINGLE, wrap=wrap, use_primary=use_primary,
+            timeout=timeout,
+        )
 
     #
     # Many
@@ -1068,26 +1751,40 @@ class Select(BaseQuery):
         self,
         rows: int,
         start: int = 0,
-        wrap: bool = True
+        wrap: bool = True,
+        use_primary: bool = False,
+        timeout: Optional[float] = None,
     ) -> db.FetchResult:
         """If "wrap" is False, the returned row type is not
         wrapped as the ``Model`` object, and the original
-        ``helo.util.adict`` is used
+        ``helo.util.adict`` is used.
+        If "use_primary" is True, read from the primary
+        even if replicas are bound.
+        If "timeout" is given, the seconds the query may take,
+        see ``db.Executer.do``.
         """
         self.limit(rows).offset(start)
         if rows <= 0:
             raise ValueError(f"invalid select rows: {rows}")
-        return await self.__do__(wrap=wrap)
+        return await self.__do__(
+            wrap=wrap, use_primary=use_primary, timeout=timeout
+        )
 
     async def paginate(
         self,
         page: int,
         size: int = 20,
-        wrap: bool = True
+        wrap: bool = True,
+        use_primary: bool = False,
+        timeout: Optional[float] = None,
     ) -> db.FetchResult:
         """If "wrap" is False, the returned row type is not
         wrapped as the ``Model`` object, and the original
-        ``helo.util.adict`` is used
+        ``helo.util.adict`` is used.
+        If "use_primary" is True, read from the primary
+        even if replicas are bound.
+        If "timeout" is given, the seconds the query may take,
+        see ``db.Executer.do``.
         """
         if page < 0 or size <= 0:
             raise ValueError("invalid page or size")
@@ -1095,14 +1792,196 @@ class Select(BaseQuery):
             page -= 1
         self._limit = size
         self._offset = page * size
-        return await self.__do__(wrap=wrap)
+        return await self.__do__(
+            wrap=wrap, use_primary=use_primary, timeout=timeout
+        )
 
-    async def all(self, wrap: bool = True) -> db.FetchResult:
+    async def all(
+        self,
+        wrap: bool = True,
+        use_primary: bool = False,
+        rowtype: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> db.FetchResult:
         """If "wrap" is False, the returned row type is not
         wrapped as the ``Model`` object, and the original
-        ``helo.util.adict`` is used
+        ``helo.util.adict`` is used.
+        If "use_primary" is True, read from the primary
+        even if replicas are bound.
+        If "rowtype" is 'compact' (needs "wrap" False), the rows are
+        ``helo.db.Row`` which keep the values in a tuple.
+        If "timeout" is given, the seconds the query may take,
+        see ``db.Executer.do``.
+        """
+        if rowtype is not None:
+            if rowtype != ROWTYPE.COMPACT or wrap:
+                raise ValueError(
+                    f"invalid rowtype {rowtype!r}, only "
+                    f"'{ROWTYPE.COMPACT}' with wrap=False is supported"
+                )
+            self._props.compact = True
+        return await self.__do__(
+            wrap=wrap, use_primary=use_primary, timeout=timeout
+        )
+
+    async def seek(
+        self,
+        after: Union[None, str, util.adict, Model] = None,
+        size: int = 20,
+        wrap: bool = True,
+        use_primary: bool = False
+    ) -> SeekResult:
+        """Keyset pagination, ordered by the primary key or by the
+        ``order_by`` columns (the primary key is appended to them
+        as the tie breaker), which must share one direction.
+
+        "after" is the ``cursor`` token of the previous page, its
+        last row or the tuple of the key values of that row, the
+        returned ``SeekResult.cursor`` is the token of the next page,
+        it is None when no rows remain. The keys of that row must not
+        be NULL.
+
+        >>> page = await User.select().seek(size=100)
+        >>> page = await User.select().seek(after=page.cursor, size=100)
+        """
+        if size <= 0:
+            raise ValueError(f"invalid seek size: {size}")
+        query, keys = self.__seek__(after, size)
+        rows = await query.__do__(wrap=wrap, use_primary=use_primary)
+        cursor = None
+        if rows and rows.count >= size:
+            cursor = self.__seektoken__(rows[-1], keys)
+        return SeekResult(rows, cursor)
+
+    async def stream(
+        self,
+        batch_size: int = 1000,
+        wrap: bool = True,
+        use_primary: bool = False
+    ) -> AsyncIterator[Union[util.adict, Model]]:
+        """Iterate over the rows of a single query run on an unbuffered
+        server-side cursor, holding at most "batch_size" rows in memory
+
+        >>> async for user in User.select().stream(batch_size=500):
+        ...     print(user.nickname)
+
+        The connection is released when the iteration ends, to
+        release it early after a ``break`` call ``aclose()``.
         """
-        return await self.__do__(wrap=wrap)
+        batches = db.stream(
+            self.query,
+            batch_size=batch_size,
+            adicts=self._props.get('adicts', True),
+            use_primary=use_primary,
+        )
+        try:
+            async for batch in batches:
+                for row in Loader(
+                    batch, self._models[0], self._aliases, wrap=wrap
+                ).do():
+                    yield row
+        finally:
+            await batches.aclose()
+
+    async def export(
+        self,
+        path: Union[str, os.PathLike],
+        format: str = 'csv',  # pylint: disable=redefined-builtin
+        batch_size: int = 1000,
+        compress: Optional[bool] = None,
+        use_primary: bool = False,
+    ) -> util.adict:
+        """Write the rows to a csv (with a header line, even without
+        rows) or jsonl file, streamed from an unbuffered cursor in
+        batches of "batch_size", the values are serialized by the
+        ``to_str`` of their fields.
+        The file is gzipped if "compress" is true, which defaults to
+        whether the path ends with '.gz'.
+
+        Returns the number of rows, the bytes serialized and
+        the size of the file.
+
+        >>> await User.select().export('users.jsonl.gz', format='jsonl')
+        {'rows': 100000, 'bytes': 9876543, 'size': 1234567}
+        """
+        if format not in _EXPORT_FORMATS:
+            raise ValueError(f"invalid export format: {format!r}")
+        if compress is None:
+            compress = os.fspath(path).endswith('.gz')
+
+        loop = asyncio.get_event_loop()
+        rows, nbytes, plan = 0, 0, None
+        raw = await loop.run_in_executor(
+            None, open, path, 'wb', _EXPORT_BUFFER)
+        fp = gzip.GzipFile(fileobj=raw, mode='wb') if compress else raw
+
+        def close() -> None:
+            try:
+                fp.close()
+            finally:
+                raw.close()
+
+        try:
+            batches = db.stream(
+                self.query, batch_size=batch_size, use_primary=use_primary,
+            )
+            try:
+                async for batch in batches:
+                    if plan is None:
+                        plan = self.__exportplan__(batch.columns or batch[0])
+                    data = _export_batch(batch, plan, format, header=not rows)
+                    await loop.run_in_executor(None, fp.write, data)
+                    rows += batch.count
+                    nbytes += len(data)
+            finally:
+                await batches.aclose()
+        finally:
+            await loop.run_in_executor(None, close)
+
+        return util.adict(rows=rows, bytes=nbytes, size=os.path.getsize(path))
+
+    async def columns_result(
+        self, numpy: bool = False, use_primary: bool = False
+    ) -> util.adict:
+        """Returns the rows as a mapping of each column name to the list
+        of its values, the integer and float fields are in compact
+        ``array.array`` (a list if the column has NULL), or in NumPy
+        arrays if "numpy" is true, without creating a dict per row.
+
+        >>> cols = await User.select(User.id, User.age).columns_result()
+        >>> cols.id
+        array('i', [1, 2, 3])
+        """
+        if numpy:
+            try:
+                import numpy as np  # pylint: disable=import-outside-toplevel
+            except ImportError:
+                raise ImportError("numpy is required for numpy=True")
+
+        self._props.adicts = False
+        rows = await self.__do__(use_primary=use_primary)
+        names = rows.columns or () if isinstance(rows, db.FetchResult) else ()
+        result = util.adict()
+        for (name, f), values in zip(
+                self.__exportplan__(names),
+                zip(*rows) if rows else ((),) * len(names)):
+            column = _column_of(f, values)
+            if numpy:
+                column = np.asarray(column) if isinstance(
+                    column, array.array) else np.array(column)
+            result[name] = column
+        return result
+
+    def __exportplan__(
+        self, row: Iterable[str]
+    ) -> List[Tuple[str, Optional[types.FieldBase]]]:
+        mattrs = get_attrs(self._models[0])
+        mfields = get_table(self._models[0]).fields_dict
+        plan = []
+        for name in row:
+            attr = mattrs.get(self._aliases.get(name, name))
+            plan.append((name, mfields.get(attr) if attr else None))
+        return plan
 
     #
     # Scalar
@@ -1125,20 +2004,183 @@ class Select(BaseQuery):
         wrap = props.pop('wrap', False) is True
         if wrap is True or len(self._models) != self._SINGLE:
             self._rowtype = ROWTYPE.ADICT
+        if self._cachettl is None:
+            data = await super().__do__(**props)
+        else:
+            data = await self.__cached__(**props)
         return Loader(
-            await super().__do__(**props),
-            self._models[0], self._aliases, wrap=wrap
+            data, self._models[0], self._aliases, wrap=wrap
         ).do()
 
+    async def __cached__(self, **props) -> Any:
+        if db.current_transaction() is not None:
+            return await super().__do__(**props)
+        try:
+            tables, raw = _tables_of(_builder.Context().key(self))
+        except NotImplementedError:
+            return await super().__do__(**props)
+        if self._cachetables is not None:
+            tables = tuple(sorted(set(tables).union(self._cachetables)))
+        elif raw:
+            raise err.NotAllowedError(
+                "the tables read by the raw SQL of a cached query are "
+                "unknown, declare them by `cached(tables=...)`"
+            )
+
+        query = self.query
+        if props:
+            self._props.update(props)
+        key = (query.sql, query.params, tuple(sorted(
+            (k, v) for k, v in self._props.items() if k != 'timeout'
+        )))
+        data = QUERIES.get(key, _MISSING)
+        if data is _MISSING:
+            generation = QUERIES.generation(tables)
+            data = await super().__do__()
+            QUERIES.put(key, data, tables, self._cachettl, generation)
+        # Loader converts the rows in place, keep the cached intact
+        if isinstance(data, db.FetchResult):
+            return data.clone()
+        if isinstance(data, dict):
+            return util.adict(data)
+        return data
+
+    def __seekkeys__(self) -> Tuple[List[types.FieldBase], bool]:
+        table = get_table(self._models[0])
+        if table.primary.field is None:
+            raise err.ProgrammingError(
+                f"seek requires a primary key for {table.name}")
+
+        keys, orders = [], set()
+        for column in self._order_by or ():
+            order = 'ASC'
+            # The orderings of ``asc()``/``desc()`` have no public type
+            # pylint: disable=protected-access
+            if isinstance(column, types._Ordering):
+                column, order = column.node, column.key
+            if not (isinstance(column, types.FieldBase)
+                    and column.table is table):
+                raise err.ProgrammingError(
+                    f"invalid seek order by column {column!r}")
+            keys.append(column)
+            orders.add(order)
+        if len(orders) > 1:
+            raise err.ProgrammingError(
+                "seek order by columns must share one direction")
+        if not any(k is table.primary.field for k in keys):
+            keys.append(table.primary.field)
+        return keys, 'DESC' in orders
+
+    def __seek__(
+        self, after: Any, size: int
+    ) -> Tuple[Select, List[types.FieldBase]]:
+        keys, desc = self.__seekkeys__()
+        query = copy(self)
+        query.order_by(*(k.desc() if desc else k for k in keys))
+        query.limit(size).offset(None)
+        if after is None:
+            return query, keys
+
+        values = self.__seekvalues__(after, keys)
+        # A row comparison with NULL is never true, the page would
+        # quietly be the last one
+        if any(v is None for v in values):
+            raise ValueError(f"seek position {after!r} has NULL keys")
+        seek = types.Expression(
+            _builder.EnclosedNodeList(keys),  # type: ignore
+            types.OPERATOR.LT if desc else types.OPERATOR.GT,
+            _builder.EnclosedNodeList([
+                _builder.Value(k.db_value(v)) for k, v in zip(keys, values)
+            ])
+        )
+        if self._where is not None:
+            seek = types.Expression(self._where, types.OPERATOR.AND, seek)
+        query.where(seek)
+        return query, keys
+
+    def __seekvalues__(
+        self, after: Any, keys: List[types.FieldBase]
+    ) -> List[Any]:
+        if isinstance(after, str):
+            try:
+                values = json.loads(base64.urlsafe_b64decode(after))
+            except ValueError:
+                raise ValueError(f"invalid seek cursor {after!r}")
+            if not isinstance(values, list) or len(values) != len(keys):
+                raise ValueError(f"invalid seek cursor {after!r}")
+            return values
+        if isinstance(after, (list, tuple)):
+            if len(after) != len(keys):
+                raise ValueError(
+                    f"seek position {after!r} does not match the keys")
+            return list(after)
+
+        attrs = get_attrs(self._models[0])
+        if isinstance(after, dict):
+            # The rows of ``wrap=False`` are keyed by the column names
+            return [
+                after[k.name] if k.name in after else after.get(attrs[k.name])
+                for k in keys
+            ]
+        if isinstance(after, Model):
+            return [getattr(after, attrs[k.name]) for k in keys]
+        raise TypeError(f"invalid seek position {after!r}")
+
+    def __seektoken__(
+        self, row: Any, keys: List[types.FieldBase]
+    ) -> str:
+        values = self.__seekvalues__(row, keys)
+        for key, value in zip(keys, values):
+            if value is None:
+                raise err.ProgrammingError(
+                    f"seek column {key.name} of the last row is NULL, "
+                    "seek columns must be selected and not NULL")
+        for i, (key, value) in enumerate(zip(keys, values)):
+            if not (value is None or isinstance(value, (int, float, str))):
+                values[i] = key.to_str(value)
+        return base64.urlsafe_b64encode(
+            json.dumps(values, separators=(',', ':')).encode()
+        ).decode()
+
+    def __seekable__(self) -> bool:
+        """Whether the rows can be iterated by ``seek``, otherwise
+        by offset, every key has to be selected and not NULL to make
+        the token of a page"""
+
+        if (len(self._models) != self._SINGLE or self._group_by
+                or self._limit is not None or self._offset is not None):
+            return False
+        try:
+            keys, _ = self.__seekkeys__()
+        except err.ProgrammingError:
+            return False
+        table = get_table(self._models[0])
+        star = any(
+            isinstance(c, _builder.SQL) and c.sql == '*'
+            for c in self._columns
+        )
+        for key in keys:
+            if key is not table.primary.field and key.null:
+                return False
+            if not (star or any(c is key for c in self._columns)):
+                return False
+        return True
+
     async def __getrow__(self) -> Optional[Model]:
         async def sets():
-            self._gotlist = await (
-                self.limit(self._BATCH).offset(self._gotidx)
-                .all())
+            if self.__seekable__():
+                self._gotlist = await self.seek(
+                    after=self._gotafter, size=self._BATCH)
+                self._gotafter = self._gotlist.cursor
+            else:
+                offset = self._offset + self._BATCH if self._gotlist else 0
+                self._gotlist = await (
+                    self.limit(self._BATCH).offset(offset)
+                    .all())
 
         if not self._gotlist:
             await sets()
-        elif self._gotlist and self._gotidx >= self._BATCH:
+        elif self._gotidx >= self._BATCH:
             await sets()
             self._gotidx = 0
         try:
@@ -1147,6 +2189,7 @@ class Select(BaseQuery):
             return None
 
     def __aiter__(self) -> Select:
+        self._gotlist, self._gotidx, self._gotafter = [], 0, None
         return self
 
     async def __anext__(self) -> Optional[Model]:
@@ -1182,17 +2225,49 @@ class Select(BaseQuery):
                 " ORDER BY "
             ).sql(_builder.CommaNodeList(self._order_by))
 
-        if self._limit is not None:
-            ctx.literal(f" LIMIT {self._limit}")
+        with ctx():
+            if self._limit is not None:
+                ctx.literal(" LIMIT %s").values(self._limit)
 
-        if self._offset is not None:
-            ctx.literal(f" OFFSET {self._offset}")
+            if self._offset is not None:
+                ctx.literal(" OFFSET %s").values(self._offset)
         return ctx
 
+    def __key__(self, ctx: _builder.Context) -> Hashable:
+        ctx.props.select = True
+        return (
+            Select,
+            ctx.keys(self._columns),
+            ctx.keys(self._froms),
+            ctx.key(self._where) if self._where else None,
+            ctx.keys(self._group_by) if self._group_by else None,
+            ctx.key(self._having) if self._having else None,
+            ctx.keys(self._order_by) if self._order_by else None,
+            self.__limitkey__(ctx),
+        )
+
+    def __limitkey__(self, ctx: _builder.Context) -> Hashable:
+        with ctx():
+            if self._limit is not None:
+                ctx.values(self._limit)
+            if self._offset is not None:
+                ctx.values(self._offset)
+        return (self._limit is not None, self._offset is not None)
+
+
+class SeekResult(db.FetchResult):
+    """The rows of a ``Select.seek`` page, "cursor" is the token
+    to fetch the next page, None if there are no more rows.
+    """
+
+    def __init__(self, rows: db.FetchResult, cursor: Optional[str]) -> None:
+        super().__init__(rows)
+        self.cursor = cursor
+
 
 class Insert(WriteQuery):
 
-    __slots__ = ('_table', '_values', '_from')
+    __slots__ = ('_values', '_from', '_update')
 
     def __init__(
         self,
@@ -1200,10 +2275,10 @@ class Insert(WriteQuery):
         values: Union[ValuesMatch, List[types.Column]],
         many: bool = False
     ) -> None:
-        super().__init__()
-        self._table = table
+        super().__init__(table)
         self._values = values
         self._from = None  # type: Optional[Select]
+        self._update = None  # type: Optional[AssignmentList]
         if many:
             self._props.many = True
 
@@ -1214,6 +2289,16 @@ class Insert(WriteQuery):
         self._from = select
         return self
 
+    def on_duplicate(self, update: AssignmentList) -> Insert:
+        self._update = update
+        return self
+
+    def __invalidate__(self) -> None:
+        # A plain insert can not change the rows already cached
+        if self._update is not None:
+            RowCache.invalidate(self._table)
+        QUERIES.invalidate(self._table.name)
+
     def __sql__(self, ctx: _builder.Context) -> _builder.Context:
         ctx.literal(
             "INSERT INTO "
@@ -1228,13 +2313,33 @@ class Insert(WriteQuery):
             ctx.literal(' ').sql(_builder.EnclosedNodeList(self._values))  # type: ignore
         if self._from:
             ctx.literal(' ').sql(self._from)
+        if self._update is not None:
+            ctx.literal(' ON DUPLICATE KEY UPDATE ').sql(self._update)
 
         return ctx
 
+    def __key__(self, ctx: _builder.Context) -> Hashable:
+        key = [Insert, ctx.key(self._table)]  # type: List[Any]
+        if isinstance(self._values, ValuesMatch):
+            key.append(ctx.key(self._values))
+        elif isinstance(self._values, list):
+            for i, f in enumerate(self._values):
+                if isinstance(f, str):
+                    self._values[i] = _builder.SQL(f.join('``'))
+            key.append(ctx.key(
+                _builder.EnclosedNodeList(self._values)  # type: ignore
+            ))
+        else:
+            key.append(None)
+        key.append(ctx.key(self._from) if self._from else None)
+        if self._update is not None:
+            key.append(ctx.key(self._update))
+        return tuple(key)
+
 
 class Replace(WriteQuery):
 
-    __slots__ = ('_table', '_values', '_from')
+    __slots__ = ('_values', '_from')
 
     def __init__(
         self,
@@ -1242,8 +2347,7 @@ class Replace(WriteQuery):
         values: Union[ValuesMatch],
         many: bool = False
     ) -> None:
-        super().__init__()
-        self._table = table
+        super().__init__(table)
         self._values = values
         if many:
             self._props.many = True
@@ -1256,16 +2360,18 @@ class Replace(WriteQuery):
         ctx.sql(self._values)
         return ctx
 
+    def __key__(self, ctx: _builder.Context) -> Hashable:
+        return (Replace, ctx.key(self._table), ctx.key(self._values))
+
 
 class Update(WriteQuery):
 
-    __slots__ = ('_table', '_values', '_from', '_where')
+    __slots__ = ('_values', '_from', '_where')
 
     def __init__(
         self, table: types.Table, values: AssignmentList
     ) -> None:
-        super().__init__()
-        self._table = table
+        super().__init__(table)
         self._values = values
         self._from = None  # type: Optional[types.Table]
         self._where = None
@@ -1278,6 +2384,12 @@ class Update(WriteQuery):
         self._where = util.and_(*filters) or None
         return self
 
+    def __invalidate__(self) -> None:
+        RowCache.invalidate(
+            self._table, _primary_values(self._table, self._where)
+        )
+        QUERIES.invalidate(self._table.name)
+
     def __sql__(self, ctx: _builder.Context) -> _builder.Context:
         ctx.literal(
             "UPDATE "
@@ -1297,17 +2409,25 @@ class Update(WriteQuery):
             ctx.literal(" WHERE ").sql(self._where)
         return ctx
 
+    def __key__(self, ctx: _builder.Context) -> Hashable:
+        key = [Update, ctx.key(self._table)]  # type: List[Any]
+        if self._from is not None:
+            ctx.props.update_from = True
+        key.append(ctx.key(self._values))
+        key.append(None if self._from is None else ctx.key(self._from))
+        key.append(None if self._where is None else ctx.key(self._where))
+        return tuple(key)
+
 
 class Delete(WriteQuery):
 
-    __slots__ = ('_table', '_where', '_limit', '_force')
+    __slots__ = ('_where', '_limit', '_force')
 
     def __init__(self, table: types.Table, force: bool = False) -> None:
-        self._table = table
+        super().__init__(table)
         self._where = None
         self._limit = None  # type: Optional[int]
         self._force = force
-        super().__init__()
 
     def where(self, *filters: types.Column) -> Delete:
         self._where = util.and_(*filters) or None
@@ -1317,6 +2437,12 @@ class Delete(WriteQuery):
         self._limit = row_count
         return self
 
+    def __invalidate__(self) -> None:
+        RowCache.invalidate(
+            self._table, _primary_values(self._table, self._where)
+        )
+        QUERIES.invalidate(self._table.name)
+
     def __sql__(self, ctx: _builder.Context) -> _builder.Context:
         ctx.literal("DELETE FROM ").sql(self._table)
         if self._where:
@@ -1328,10 +2454,58 @@ class Delete(WriteQuery):
                 "delete is too dangerous as no where clause"
             )
         if self._limit is not None:
-            ctx.literal(f" LIMIT {self._limit}")
+            with ctx():
+                ctx.literal(" LIMIT %s").values(self._limit)
 
         return ctx
 
+    def __key__(self, ctx: _builder.Context) -> Hashable:
+        if not (self._where or self._force):
+            raise _builder.Uncacheable(self)
+        return (
+            Delete, ctx.key(self._table),
+            ctx.key(self._where) if self._where else None,
+            self.__limitkey__(ctx),
+        )
+
+    def __limitkey__(self, ctx: _builder.Context) -> Hashable:
+        if self._limit is None:
+            return False
+        with ctx():
+            ctx.values(self._limit)
+        return True
+
+
+class LoadData(WriteQuery):
+
+    __slots__ = ('_path', '_fields')
+
+    def __init__(
+        self, table: types.Table, path: str, fields: List[types.FieldBase]
+    ) -> None:
+        super().__init__(table)
+        self._path = path
+        self._fields = fields
+
+    def __sql__(self, ctx: _builder.Context) -> _builder.Context:
+        with ctx():
+            ctx.literal("LOAD DATA LOCAL INFILE %s").values(self._path)
+        ctx.literal(" INTO TABLE ").sql(self._table).literal(
+            " CHARACTER SET utf8mb4 "
+        ).sql(
+            _builder.EnclosedNodeList(
+                [_builder.SQL(f.column) for f in self._fields])
+        )
+        return ctx
+
+    def __key__(self, ctx: _builder.Context) -> Hashable:
+        with ctx():
+            ctx.values(self._path)
+        return (
+            LoadData, ctx.key(self._table),
+            tuple(f.column for f in self._fields),
+        )
+
 
 class Show(BaseQuery):
 
@@ -1372,15 +2546,19 @@ class Show(BaseQuery):
             ).sql(self._table)
         return ctx
 
+    def __key__(self, ctx: _builder.Context) -> Hashable:
+        if self._key is None:
+            return (Show,)
+        return (Show, self._key, ctx.key(self._table))
+
 
 class Create(WriteQuery):
 
-    __slots__ = ('_table', '_options')
+    __slots__ = ('_options',)
 
     def __init__(self, table: types.Table, **options: Any) -> None:
-        self._table = table
+        super().__init__(table)
         self._options = options
-        super().__init__()
 
     def __sql__(self, ctx: _builder.Context) -> _builder.Context:
         ctx.literal('CREATE ')
@@ -1418,8 +2596,9 @@ class Drop(Create):
 
 class Loader:
 
-    __slots__ = ('_data', '_modelclass', '_wrap',
-                 '_mattrs', '_mfields', '_aliases')
+    __slots__ = ('_data', '_modelclass', '_wrap', '_aliases')
+
+    _PLANS = _cache.LRU(256)
 
     def __init__(
         self,
@@ -1433,55 +2612,403 @@ class Loader:
         self._aliases = aliases
         self._wrap = wrap
 
-        self._mattrs = get_attrs(self._modelclass)
-        self._mfields = get_table(self._modelclass).fields_dict
-
     def do(self) -> Any:
         if not self._data:
             return self._data
 
         if isinstance(self._data, db.FetchResult):
+            if not isinstance(self._data[0], dict):
+                return self._data
+            plan = self._plan(self._data[0])
             if self._wrap is True:
-                for i in range(self._data.count):
-                    mobj = self._convert_to_model(self._data[i])
-                    self._data[i] = mobj or self._data[i]
+                if plan is not None:
+                    for i in range(self._data.count):
+                        mobj = self._convert_to_model(self._data[i], plan)
+                        self._data[i] = mobj or self._data[i]
             else:
                 for i in range(self._data.count):
-                    self._data[i] = self._convert_type(self._data[i])
+                    self._data[i] = self._convert_type(self._data[i], plan)
         elif isinstance(self._data, dict):
+            plan = self._plan(self._data)
             if self._wrap is True:
-                self._data = self._convert_to_model(self._data) or self._data
+                if plan is not None:
+                    self._data = self._convert_to_model(
+                        self._data, plan) or self._data
             else:
-                self._data = self._convert_type(self._data)
+                self._data = self._convert_type(self._data, plan)
         return self._data
 
-    def _convert_type(
+    def _plan(
         self, row: util.adict
+    ) -> Optional[List[Tuple[str, str, Any, Any]]]:
+        """Returns the hydration plan of the rows like "row",
+        a list of (column, attribute, converter, types), it is
+        cached per model, columns and aliases.
+        """
+        key = (
+            self._modelclass, self._wrap,
+            tuple(row), tuple(self._aliases.items()),
+        )
+        plan = self._PLANS.get(key, False)
+        if plan is not False:
+            return plan
+
+        mattrs = get_attrs(self._modelclass)
+        mfields = get_table(self._modelclass).fields_dict
+        plan = []
+        if self._wrap is True:
+            for name in row:
+                attr = mattrs.get(self._aliases.get(name, name))
+                if not attr:
+                    plan = None
+                    break
+                f = mfields[attr]
+                plan.append((name, attr, f.py_value, f.py_exact))
+        else:
+            anames = set(mattrs.values())
+            for name in row:
+                rname = name
+                if name not in anames:
+                    aname = self._aliases.get(name, name)
+                    rname = mattrs.get(aname, aname)
+                f = mfields.get(rname)
+                if f:
+                    plan.append((name, rname, f.py_value, f.py_type))
+                else:
+                    plan.append((name, rname, None, None))
+        self._PLANS.put(key, plan)
+        return plan
+
+    @staticmethod
+    def _convert_type(
+        row: util.adict, plan: List[Tuple[str, str, Any, Any]]
     ) -> util.adict:
+        converted = util.adict()
+        for name, rname, converter, py_type in plan:
+            value = row[name]
+            if converter is not None and not isinstance(value, py_type):
+                value = converter(value)
+            converted[rname] = value
+        return converted
+
+    def _convert_to_model(
+        self, row: util.adict, plan: List[Tuple[str, str, Any, Any]]
+    ) -> Optional[Model]:
+        values = {}
+        try:
+            for name, attr, converter, exact in plan:
+                value = row[name]
+                if value is not None and value.__class__ not in exact:
+                    value = converter(value)
+                values[attr] = value
+        except Exception:  # pylint: disable=broad-except
+            return None
+        model = self._modelclass()
+        model.__dict__.update(values)
+        object.__setattr__(model, '__origin__', _snapshot(values))
+        return model
+
+
+class GetBatcher:
+    """Coalesces the ``Model.get`` by primary key issued within one
+    iteration of the event loop into one ``WHERE pk IN (...)`` query,
+    enabled by the ``batch_get`` option of the model Meta.
+    """
+
+    __slots__ = ('maxsize', '_loop', '_pending')
+
+    MAXSIZE = 100
+
+    def __init__(self, maxsize: int = MAXSIZE) -> None:
+        if not isinstance(maxsize, int) or maxsize <= 0:
+            raise ValueError(f"invalid batch_get size: {maxsize!r}")
+        self.maxsize = maxsize
+        self._loop = None     # type: Optional[asyncio.AbstractEventLoop]
+        self._pending = {}    # type: Dict[Any, Tuple[types.ID, asyncio.Future]]
+
+    async def get(self, m: Type[Model], _id: types.ID) -> Optional[Model]:
+        loop = asyncio.get_event_loop()
+        if self._loop is not loop:
+            self._loop, self._pending = loop, {}
+
+        key = get_table(m).primary.field.db_value(_id)
+        pending = self._pending.get(key)
+        if pending is None:
+            if not self._pending:
+                loop.call_soon(self._dispatch, m)
+            pending = self._pending[key] = (_id, loop.create_future())
+            if len(self._pending) >= self.maxsize:
+                self._dispatch(m)
+
+        # The waiters of one key share the future, shield it from
+        # the cancellation of any one of them
+        mo = await asyncio.shield(pending[1])
+        return _copy_model(mo) if mo is not None else None
+
+    def _dispatch(self, m: Type[Model]) -> None:
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        asyncio.ensure_future(self._load(m, batch))
+
+    @staticmethod
+    async def _load(
+        m: Type[Model], batch: Dict[Any, Tuple[types.ID, asyncio.Future]]
+    ) -> None:
+        primary = get_table(m).primary
+        found = {}
+        try:
+            rows = await ApiProxy.get_many(
+                m, [_id for _id, _ in batch.values()]
+            )
+            for row in rows:
+                if isinstance(row, dict):
+                    pk = row.get(primary.field.name)
+                else:
+                    pk = getattr(row, primary.attr, None)
+                found[primary.field.db_value(pk)] = row
+        except BaseException as e:  # pylint: disable=broad-except
+            for _, future in batch.values():
+                if future.done():
+                    continue
+                if isinstance(e, Exception):
+                    future.set_exception(e)
+                else:
+                    future.cancel()
+            if not isinstance(e, Exception):
+                raise
+            return
+
+        for key, (_, future) in batch.items():
+            if not future.done():
+                future.set_result(found.get(key))
+
+
+class RowCache:
+    """Caches the rows of a model by primary key in process,
+    enabled by the ``cache_size`` option of the model Meta.
+    Any write executed through helo to the table invalidates it.
+    """
+
+    __slots__ = ('_lru', '_primary', 'generation', '__weakref__')
+
+    MAXSIZE = 1024
+    TTL = 60
+
+    # table name -> the caches of the models on the table
+    _TABLES = {}  # type: Dict[str, weakref.WeakSet]
+
+    def __init__(
+        self,
+        table: types.Table,
+        maxsize: int = MAXSIZE,
+        ttl: Optional[float] = TTL
+    ) -> None:
+        if not isinstance(maxsize, int) or maxsize <= 0:
+            raise ValueError(f"invalid cache_size: {maxsize!r}")
+        self._lru = _cache.TTL(maxsize, ttl)
+        self._primary = table.primary
+        # Bumped on every invalidation, the rows read before
+        # it are not put into the cache.
+        self.generation = 0
+        self._TABLES.setdefault(
+            table.table_name, weakref.WeakSet()).add(self)
+
+    def __repr__(self) -> str:
+        return f"<RowCache {self._lru!r}>"
+
+    __str__ = __repr__
+
+    def __contains__(self, _id: types.ID) -> bool:
+        try:
+            return self.key(_id) in self._lru
+        except (TypeError, ValueError):
+            return False
+
+    def key(self, _id: types.ID) -> Hashable:
+        return self._primary.field.db_value(_id)
+
+    def pk(self, row: Any) -> types.ID:
         if isinstance(row, dict):
-            for name in row.copy():
-                if name not in self._mattrs.values():
-                    aname = self._aliases.get(name, name)
-                    rname = self._mattrs.get(aname, aname)
-                    row[rname] = row.pop(name)
-                    name = rname
+            return row.get(self._primary.field.name)
+        return getattr(row, self._primary.attr, None)
+
+    def get(self, _id: types.ID) -> Optional[Model]:
+        mo = self._lru.get(self.key(_id))
+        return None if mo is None else _copy_model(mo)
+
+    def put(self, mo: Any, generation: int) -> bool:
+        if generation != self.generation or not isinstance(mo, ModelBase):
+            return False
+        self._lru.put(self.key(self.pk(mo)), _copy_model(mo))
+        return True
+
+    def discard(self, ids: Optional[List[types.ID]] = None) -> None:
+        self.generation += 1
+        if ids is not None:
+            try:
+                for _id in ids:
+                    self._lru.pop(self.key(_id))
+                return
+            except (TypeError, ValueError):
+                pass
+        self._lru.clear()
 
-                f = self._mfields.get(name)
-                if f and not isinstance(row[name], f.py_type):
-                    row[name] = f.py_value(row[name])
-        else:
-            pass
-        return row
+    def stats(self) -> util.adict:
+        return self._lru.stats()
 
-    def _convert_to_model(self, row: util.adict) -> Optional[Model]:
-        model = self._modelclass()
-        for name, value in row.items():
-            name = self._aliases.get(name, name)
-            name = self._mattrs.get(name)
-            if not name:
-                return None
+    @classmethod
+    def invalidate(
+        cls, table: types.Table, ids: Optional[List[types.ID]] = None
+    ) -> None:
+        for cache in cls._TABLES.get(table.table_name, ()):
+            cache.discard(ids)
+
+
+def _primary_values(
+    table: types.Table, where: Optional[types.Column]
+) -> Optional[List[types.ID]]:
+    """Returns the primary key values if the where
+    is ``pk = value`` or ``pk IN (values)``.
+    """
+    if not isinstance(where, types.Expression):
+        return None
+    lhs, pk = where.lhs, table.primary.field
+    if not (lhs is pk or (
+            isinstance(lhs, types.FieldBase) and lhs.name == pk.name
+            and getattr(lhs, 'table', None) is not None
+            and lhs.table.table_name == table.table_name)):
+        return None
+    if where.op == types.OPERATOR.EQ:
+        if isinstance(where.rhs, _builder.Node):
+            return None
+        return [where.rhs]
+    if where.op == types.OPERATOR.IN and isinstance(where.rhs, types.SEQUENCE):
+        return list(where.rhs)
+    return None
+
+
+def _tables_of(key: Hashable) -> Tuple[Tuple[str, ...], bool]:
+    """Returns the names of the tables in the structural key of a query,
+    and whether it has raw SQL nodes, which may read other tables"""
+
+    tables, raw, stack = set(), False, [key]
+    while stack:
+        key = stack.pop()
+        if isinstance(key, tuple) and key:
+            if key[0] is types.Table:
+                tables.add(key[2])
+            elif key[0] is _builder.SQL:
+                raw = raw or key[1] not in _PLAIN_SQL
+            else:
+                stack.extend(key)
+    return tuple(sorted(tables)), raw
+
+
+def _column_of(
+    f: Optional[types.FieldBase], values: Tuple[Any, ...]
+) -> Union[array.array, List[Any]]:
+    """Returns the values of a column in the compact array of
+    its numeric field, or a list of them converted by the field.
+    """
+    if f is None:
+        return list(values)
+    # A subclass converting to another type (e.g. ``types.IP``)
+    # goes through its ``py_value``
+    for ftype in type(f).__mro__ if f.py_type in (int, float) else ():
+        code = _ARRAY_TYPECODES.get(ftype)
+        if code is not None:
+            if getattr(f, 'unsigned', False) and code != 'd':
+                code = code.upper()
             try:
-                model.__setmodel__(name, value, __load__=True)
-            except Exception:  # pylint: disable=broad-except
-                return None
-        return model
+                return array.array(code, values)
+            except (TypeError, OverflowError):  # NULL or out of range
+                break
+    py_type = f.py_type
+    return [
+        v if v is None or isinstance(v, py_type) else f.py_value(v)
+        for v in values
+    ]
+
+
+def _export_batch(
+    rows: db.FetchResult,
+    plan: List[Tuple[str, Optional[types.FieldBase]]],
+    fmt: str,
+    header: bool = False,
+) -> bytes:
+    """Returns the rows serialized as csv or jsonl lines"""
+
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        if header:
+            writer.writerow([name for name, _ in plan])
+        writer.writerows(
+            ['' if row[name] is None
+             else f.to_str(row[name]) if f is not None
+             else str(row[name])
+             for name, f in plan]
+            for row in rows
+        )
+        return buffer.getvalue().encode('utf8')
+
+    lines = []
+    for row in rows:
+        values = {}
+        for name, f in plan:
+            value = row[name]
+            if value is not None and not isinstance(value, _JSON_TYPES):
+                value = str(value) if f is None else f.to_str(value)
+            values[name] = value
+        lines.append(json.dumps(values, ensure_ascii=False))
+    lines.append('')
+    return '\n'.join(lines).encode('utf8')
+
+
+def _infile_line(fields: List[types.FieldBase], values: Iterable[Any]) -> bytes:
+    """Returns the row in the default format of ``LOAD DATA``,
+    tab separated and escaped by backslash, ``\\N`` for NULL.
+    """
+    return ('\t'.join(
+        '\\N' if v is None else f.to_str(v).translate(_INFILE_ESCAPES)
+        for f, v in zip(fields, values)
+    ) + '\n').encode('utf8')
+
+
+def _literal_bytes(value: Any) -> int:
+    """About the bytes of the value as a literal of a statement and
+    its separator, the driver escapes it only once it is sent.
+    """
+    if value is None:
+        return 5
+    if isinstance(value, (bytes, bytearray)):
+        return len(value) + 11
+    if isinstance(value, str):
+        return len(value.encode('utf8')) + 3
+    return len(str(value)) + 3
+
+
+async def _aiter(iterable: Iterable[Any]) -> AsyncIterator[Any]:
+    for item in iterable:
+        yield item
+
+
+def _copy_model(mo: Any) -> Any:
+    if not isinstance(mo, ModelBase):
+        return util.adict(mo)
+    new = mo.__class__.__new__(mo.__class__)
+    new.__dict__.update(_snapshot(mo.__dict__))
+    object.__setattr__(new, '__origin__', getattr(mo, '__origin__', None))
+    return new
+
+
+def _snapshot(values: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns a copy of the values of a model object, of which the
+    mutable ones (e.g. the list of a JSON column) are copied deeply so
+    that changing them in place is seen by ``save``"""
+
+    return {
+        k: deepcopy(v) if isinstance(v, _MUTABLE_TYPES) else v
+        for k, v in values.items()
+    }
@@ -9,7 +9,9 @@ import datetime
 import decimal
 import uuid
 import warnings
-from typing import Any, Optional, Union, Callable, List, Tuple, Dict
+from typing import (
+    Any, Optional, Union, Callable, List, Tuple, Dict, Hashable
+)
 
 from . import util, err, _helper, _builder, _const
 
@@ -53,6 +55,9 @@ ON_UPDATE = SQL('CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP')
 ENCODING = util.In(_const.ENCODINGS, 'Encoding')
 ENGINE = _const.MYSQL_ENGINE
 OPERATOR = _const.OPERATOR
+_NESTING_OPERATORS = frozenset((
+    OPERATOR.IN, OPERATOR.NOT_IN, OPERATOR.EXISTS, OPERATOR.NEXISTS
+))
 
 
 class _ColumnBase(_builder.Node):
@@ -244,6 +249,9 @@ class _Ordering(Column):
         ctx.sql(self.node).literal(f" {self.key} ")
         return ctx
 
+    def __key__(self, ctx: _builder.Context) -> Hashable:
+        return (_Ordering, ctx.key(self.node), self.key)
+
 
 class _Alias(Column):
 
@@ -263,6 +271,9 @@ class _Alias(Column):
             ctx.aliases[self.alias] = realname
         return ctx
 
+    def __key__(self, ctx: _builder.Context) -> Hashable:
+        return (_Alias, ctx.key(self.node), self.alias)
+
 
 class Expression(Column):
 
@@ -276,36 +287,45 @@ class Expression(Column):
         self.rhs = rhs
         self.parens = parens
 
-    def __sql__(self, ctx: _builder.Context) -> _builder.Context:
+    def __prepare__(self) -> Tuple[Dict[str, Any], Any]:
         overrides = {'parens': self.parens, 'params': True}
+        rhs = self.rhs
 
         if isinstance(self.lhs, FieldBase):
             overrides['converter'] = self.lhs.db_value
-        elif isinstance(self.rhs, FieldBase):
-            overrides['converter'] = self.rhs.db_value
-
-        if self.op in (OPERATOR.IN,
-                       OPERATOR.NOT_IN,
-                       OPERATOR.EXISTS,
-                       OPERATOR.NEXISTS):
-            if not isinstance(self.rhs, (SEQUENCE, _builder.Node)):
+        elif isinstance(rhs, FieldBase):
+            overrides['converter'] = rhs.db_value
+
+        if self.op in _NESTING_OPERATORS:
+            if not isinstance(rhs, (SEQUENCE, _builder.Node)):
                 raise TypeError(
-                    f"invalid values {self.rhs} for operator '{self.op}'")
-            if isinstance(self.rhs, _builder.Node):
-                self.rhs = _builder.EnclosedNodeList([self.rhs])
+                    f"invalid values {rhs} for operator '{self.op}'")
+            if isinstance(rhs, _builder.Node):
+                rhs = _builder.EnclosedNodeList([rhs])
             else:
-                self.rhs = tuple(self.rhs)
+                rhs = tuple(rhs)
             overrides['nesting'] = True
+        return overrides, rhs
 
+    def __sql__(self, ctx: _builder.Context) -> _builder.Context:
+        overrides, rhs = self.__prepare__()
         with ctx(**overrides):
             ctx.sql(
                 self.lhs
             ).literal(
                 f' {self.op} '
-            ).sql(self.rhs)
+            ).sql(rhs)
 
         return ctx
 
+    def __key__(self, ctx: _builder.Context) -> Hashable:
+        overrides, rhs = self.__prepare__()
+        with ctx(**overrides):
+            return (
+                Expression, self.op, self.parens,
+                ctx.key(self.lhs), ctx.key(rhs)
+            )
+
 
 class StrExpression(Expression):
 
@@ -499,6 +519,18 @@ class FieldBase(Column):
     def py_value(self, value: Any) -> Any:
         return value if value is None else self.adapt(value)
 
+    @property
+    def py_exact(self) -> Tuple[type, ...]:
+        """The types of the values that ``py_value`` returns as is,
+        the loader skips ``py_value`` for them.
+        """
+        cls = self.__class__
+        if (cls.adapt is FieldBase.adapt
+                and cls.py_value is FieldBase.py_value
+                and isinstance(self.py_type, type)):
+            return (self.py_type,)
+        return ()
+
     def db_value(self, value: Any) -> Any:
         return value if value is None else self.adapt(value)
 
@@ -513,6 +545,11 @@ class FieldBase(Column):
             ctx.literal(self.column)
         return ctx
 
+    def __key__(self, ctx: _builder.Context) -> Hashable:
+        if self.table is not None:
+            return (FieldBase, self.table.db, self.table.name, self.name)
+        return (FieldBase, self.name)
+
 
 class Tinyint(FieldBase):
 
@@ -704,6 +741,7 @@ class Decimal(FieldBase):
     __slots__ = ('length', 'unsigned', 'auto_round', 'rounding')
 
     py_type = decimal.Decimal
+    py_exact = (decimal.Decimal,)
     db_type = 'decimal'
     default_md = (10, 5)
 
@@ -823,6 +861,7 @@ class UUID(FieldBase):
     __slots__ = ("primary_key",)
 
     py_type = uuid.UUID
+    py_exact = (uuid.UUID,)
     db_type = "varchar(40)"
 
     def __init__(
@@ -926,6 +965,7 @@ class Date(FieldBase):
     __slots__ = ('formats',)
 
     py_type = (datetime.datetime, datetime.date)  # type: Any
+    py_exact = (datetime.date,)  # type: Any
     db_type = 'date'
 
     FORMATS = (
@@ -969,6 +1009,7 @@ class Time(Date):
     __slots__ = ()
 
     py_type = (datetime.datetime, datetime.time)
+    py_exact = (datetime.time,)
     db_type = 'time'
 
     FORMATS = (  # type: ignore
@@ -998,6 +1039,7 @@ class DateTime(Date):
     __slots__ = ()
 
     py_type = datetime.datetime
+    py_exact = (datetime.datetime,)
     db_type = 'datetime'
 
     FORMATS = (
@@ -1020,6 +1062,7 @@ class Timestamp(FieldBase):
     __slots__ = ('utc',)
 
     py_type = datetime.datetime
+    py_exact = (datetime.datetime,)
     db_type = 'timestamp'
 
     FORMATS = (
@@ -1101,6 +1144,10 @@ class Func(_builder.Node):
             ctx.sql(self._node)
         return ctx
 
+    def __key__(self, ctx: _builder.Context) -> Hashable:
+        with ctx(parens=True):
+            return (Func, self._func, ctx.key(self._node))
+
 
 F = Func("", None)  # type: ignore
 
@@ -1237,3 +1284,6 @@ class Table(_builder.Node):
         else:
             ctx.literal(self.table_name)
         return ctx
+
+    def __key__(self, ctx: _builder.Context) -> Hashable:
+        return (Table, self.db, self.name)
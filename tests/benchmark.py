@@ -0,0 +1,285 @@
+"""
+    Micro benchmarks of helo, not collected by pytest.
+
+    $ python -m tests.benchmark [name ...]
+
+    The benchmarks marked with "needs a database" take the url
+    from the HELO_DATABASE_URL environment variable.
+"""
+import asyncio
+import datetime
+import io
+import logging
+import os
+import re
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+from helo import _builder, _cache, _logging, db, util
+from helo.model import Loader, _column_of, get_table
+
+from .case import Author, People
+
+
+def _report(name, seconds, number):
+    print(f"  {name:<36} {seconds / number * 1e6:10.2f} us")
+
+
+def bench_statement_text():
+    """Pagination queries hitting a cache keyed by the statement text"""
+
+    def pages(size=20, count=1000):
+        for page in range(count):
+            query = Author.select().where(
+                Author.name == 'at7h'
+            ).limit(size).offset(page * size)
+            yield query.query
+
+    def inline(query):
+        # The text of the query as LIMIT/OFFSET were literals
+        limit, offset = query.params[-2:]
+        return re.sub(
+            r'LIMIT %s OFFSET %s;$', f'LIMIT {limit} OFFSET {offset};',
+            query.sql
+        )
+
+    for name, text in (('literal', inline), ('params', lambda q: q.sql)):
+        lru = _cache.LRU(128)
+        for query in pages():
+            if lru.get(text(query)) is None:
+                lru.put(text(query), True)
+        stats = lru.stats()
+        print(
+            f"  {name:<36} {stats.misses:>5} statements, "
+            f"hit ratio {stats.hits / (stats.hits + stats.misses):.2%}"
+        )
+
+
+def bench_render():
+    """Rendering a select with and without the templates cache"""
+
+    def render():
+        return Author.select(
+            Author.id, Author.name
+        ).where(
+            Author.name == 'at7h', Author.id.in_([1, 2, 3])
+        ).order_by(
+            Author.id.desc()
+        ).limit(20).offset(40).query
+
+    number = 20000
+    maxsize = _builder.templates().maxsize
+    try:
+        for size in (0, 512):
+            _builder.templates(size)
+            _report(
+                f"templates maxsize={size}",
+                timeit.timeit(render, number=number), number
+            )
+    finally:
+        _builder.templates(maxsize)
+
+
+def bench_hydrate():
+    """Hydrating 10k rows into models and adicts"""
+
+    now = datetime.datetime.now()
+    rows = [
+        dict(id=i, name=f'name{i}', password='*' * 20,
+             create_at=now, update_at=now)
+        for i in range(10000)
+    ]
+
+    def setmodel():
+        # Setting every cell through ``__setmodel__`` like before plans
+        result = []
+        for row in rows:
+            model = Author()
+            for name, value in row.items():
+                model.__setmodel__(name, value, __load__=True)
+            result.append(model)
+        return result
+
+    def load(wrap):
+        data = db.FetchResult(util.adict(row) for row in rows)
+        return Loader(data, Author, {}, wrap=wrap).do()
+
+    number = 10
+    _report(
+        "setmodel per cell", timeit.timeit(setmodel, number=number), number
+    )
+    _report(
+        "plan (wrap=True)",
+        timeit.timeit(lambda: load(True), number=number), number
+    )
+    _report(
+        "plan (wrap=False)",
+        timeit.timeit(lambda: load(False), number=number), number
+    )
+
+
+def bench_load_file(count=1000000):
+    """Importing 1M rows with madd and load_file (needs a database)"""
+
+    url = db.EnvKey.get()
+    if not url:
+        print("  skipped, no database url")
+        return
+
+    def rows():
+        for i in range(count):
+            yield {'name': f'name{i}', 'gender': i % 2, 'age': i % 100}
+
+    async def timed(name, load):
+        await People.create()
+        try:
+            started = time.perf_counter()
+            await load()
+            seconds = time.perf_counter() - started
+            assert await People.select().count() == count
+        finally:
+            await People.drop()
+        print(f"  {name:<36} {seconds:10.2f} s  {count / seconds:10.0f} rows/s")
+
+    async def run():
+        async with db.Binder(url, local_infile=True):
+            await timed("madd", lambda: People.madd(list(rows())))
+            await timed("load_file", lambda: People.load_file(rows()))
+
+    asyncio.get_event_loop().run_until_complete(run())
+
+
+def _peak(func):
+    tracemalloc.start()
+    try:
+        result = func()
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_columnar(count=100000):
+    """Transposing 100k rows into columns from adicts and tuples"""
+
+    names = ('id', 'name', 'password', 'create_at', 'update_at')
+    now = datetime.datetime.now()
+    rows = [(i, f'name{i}', '*' * 20, now, now) for i in range(count)]
+    fields = [get_table(Author).fields_dict[n] for n in names]
+
+    def adicts():
+        # What ``ADictCursor`` and ``all(wrap=False)`` build and transposing
+        result = [util.adict(zip(names, row)) for row in rows]
+        return {n: [r[n] for r in result] for n in names}
+
+    def columnar():
+        return {
+            n: _column_of(f, values)
+            for n, f, values in zip(names, fields, zip(*rows))
+        }
+
+    number = 3
+    for name, func in (('adicts', adicts), ('columns_result', columnar)):
+        seconds = timeit.timeit(func, number=number)
+        _, peak = _peak(func)
+        print(
+            f"  {name:<36} {seconds / number * 1e3:10.2f} ms"
+            f"  peak {peak / 1024 / 1024:8.2f} MiB"
+        )
+
+
+def bench_compact(count=100000):
+    """Memory of 100k rows as adicts and compact rows"""
+
+    names = ('id', 'name', 'password', 'create_at', 'update_at', 'age')
+    now = datetime.datetime.now()
+    # The values are shared, only the memory of the rows is measured
+    values = [(i, 'at7h', '*' * 20, now, now, 22) for i in range(count)]
+
+    def adicts():
+        return [util.adict(zip(names, row)) for row in values]
+
+    def compact():
+        rowclass = db.Row.of(names)
+        return list(map(rowclass, values))
+
+    for name, func in (('adict', adicts), ('compact', compact)):
+        seconds = timeit.timeit(func, number=3) / 3
+        _, peak = _peak(func)
+        print(
+            f"  {name:<36} {seconds * 1e3:10.2f} ms"
+            f"  {peak / 1024 / 1024:8.2f} MiB"
+            f"  {peak / count:6.0f} bytes/row"
+        )
+
+
+class _SlowStream(io.StringIO):
+    """A stream taking 100us a write, like a stderr piped to a busy reader"""
+
+    def write(self, text):
+        time.sleep(0.0001)
+        return len(text)
+
+
+def bench_query_log(count=20000):
+    """Latency added to the caller by logging 20k queries"""
+
+    query = Author.select().where(Author.name == 'at7h').limit(20).query
+    inline = logging.getLogger('helo.bench')
+    inline.propagate = False
+    inline.setLevel(logging.INFO)
+    handlers = _logging._WRITER.listener.handlers
+
+    def timed(name, log):
+        started = time.perf_counter()
+        for _ in range(count):
+            log()
+        seconds = time.perf_counter() - started
+        _logging.flush()
+        _report(name, seconds, count)
+
+    for kind, stream in (
+        ('file', open(os.path.join(tempfile.mkdtemp(), 'helo.log'), 'a')),
+        ('slow', _SlowStream()),
+    ):
+        streams = [h.setStream(stream) for h in handlers]
+        try:
+            # Like the handler of ``create_logger`` before the queue
+            handler = logging.StreamHandler(stream)
+            handler.setFormatter(_logging.ColoredFormatter())
+            inline.addHandler(handler)
+            timed(f"{kind} inline StreamHandler", lambda: inline.info(query))
+            inline.removeHandler(handler)
+
+            for name, options in (
+                ("queued", {}),
+                ("queued sample=0.1", {'sample': 0.1}),
+                ("queued rate=100", {'rate': 100}),
+                ("queued json", {'format': 'json'}),
+            ):
+                _logging.configure(**options)
+                timed(
+                    f"{kind} {name}",
+                    lambda: _logging.QUERIES.log(query)
+                )
+        finally:
+            _logging.configure()
+            for handler, previous in zip(handlers, streams):
+                handler.setStream(previous)
+            stream.close()
+
+
+def main(names):
+    benches = {
+        n[len('bench_'):]: f for n, f in globals().items()
+        if n.startswith('bench_')
+    }
+    for name in names or benches:
+        print(f"{name}: {benches[name].__doc__}")
+        benches[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -4,11 +4,20 @@
 Tests for db module
 """
 
+import asyncio
 import datetime
+import json
+import logging
+import os
+import tempfile
+import time
+from contextlib import asynccontextmanager
 
 import pytest
 
-from helo import db, err, util, _builder, ENCODING, G
+from helo import (
+    db, err, util, _builder, _logging, _metrics, _slowlog, ENCODING, G
+)
 
 from . import case
 
@@ -453,3 +462,767 @@ async def test_from_url():
             assert connmeta.db == conn.db
             assert connmeta.charset == conn.charset
             assert connmeta.autocommit == conn.get_autocommit()
+
+
+@pytest.mark.asyncio
+async def test_prepared_statements():
+
+    async def init():
+        await db.execute(SETUP_QUERY)
+
+    async def clear():
+        await db.execute(TEARDOWN_QUERY)
+
+    # One connection, so that every statement hits the same cache
+    async with db.Binder(
+        init=init, clear=clear, stmt_cache_size=2, minsize=1, maxsize=1
+    ):
+        assert db.state().statements.maxsize == 2
+
+        await db.execute(
+            _builder.Query(
+                "INSERT INTO `user` (`name`, `age`) VALUES (%s, %s);",
+                params=['at7h', 22]
+            ))
+        for _ in range(3):
+            user = await db.execute(
+                _builder.Query(
+                    "SELECT * FROM `user` WHERE `name` = %s;",
+                    params=['at7h']
+                ),
+                rows=1
+            )
+            assert user.name == 'at7h'
+            assert user.age == 22
+        users = await db.execute(
+            _builder.Query(
+                "SELECT * FROM `user` WHERE `id` IN %s;",
+                params=[(AUTO_INCREMENT,)]
+            ))
+        assert users.count == 1
+
+        result = await db.execute(
+            _builder.Query(
+                "UPDATE `user` SET `age` = %s WHERE `name` = %s;",
+                params=[23, 'at7h']
+            ))
+        assert result.affected == 1
+
+        result = await db.execute(
+            _builder.Query(
+                "INSERT INTO `user` (`name`, `age`) VALUES (%s, %s);",
+                params=['mejer', 24]
+            ))
+        assert result.affected == 1
+        assert result.last_id == AUTO_INCREMENT + 1
+
+        # INSERT, SELECT, UPDATE and INSERT again missed, evicting the
+        # least recently used INSERT and SELECT
+        stats = db.state().statements
+        assert stats.connections == 1
+        assert stats.size == 2
+        assert (stats.hits, stats.misses, stats.evictions) == (2, 4, 2)
+
+        status = await db.execute(_builder.Query(
+            "SHOW SESSION STATUS WHERE `Variable_name` IN "
+            "('Com_prepare_sql', 'Com_execute_sql', 'Com_dealloc_sql');"
+        ))
+        status = {s.Variable_name: int(s.Value) for s in status}
+        assert status == {
+            'Com_prepare_sql': 4, 'Com_execute_sql': 6, 'Com_dealloc_sql': 2,
+        }
+        # The pooled connection keeps none of the params
+        variables = await db.execute(
+            _builder.Query("SELECT @helo_p0 AS `p0`, @helo_p1 AS `p1`;"),
+            rows=1
+        )
+        assert variables.p0 is None and variables.p1 is None
+
+
+def test_prepare_errors():
+    import pymysql
+
+    class Connection:
+        def __init__(self):
+            self.results = 0
+
+        async def next_result(self):
+            self.results += 1
+
+    class Cursor:
+        def __init__(self, code, failing):
+            self.code = code
+            self.failing = failing
+            self.connection = Connection()
+            self.executed = []
+
+        async def execute(self, sql, params=None):
+            self.executed.append(sql)
+            if sql.startswith(self.failing):
+                raise pymysql.err.OperationalError(self.code, "refused")
+
+        async def nextset(self):
+            if self.failing == 'EXECUTE':
+                raise pymysql.err.OperationalError(self.code, "refused")
+
+    async def run(code, failing='PREPARE'):
+        statements = db.StatementCache(2)
+        cursor = Cursor(code, failing)
+        for _ in range(2):
+            try:
+                await statements.execute(cursor, "SELECT %s;", (1,))
+            except pymysql.err.OperationalError:
+                pass
+        return statements, cursor
+
+    # A lock wait is transient, the statement is prepared again
+    statements, cursor = asyncio.run(run(1205))
+    assert (statements.misses, statements.hits) == (2, 0)
+    assert statements.stats().size == 0
+    assert cursor.executed.count("SELECT %s;") == 2
+    # A statement the server cannot prepare is sent as text from now on
+    statements, cursor = asyncio.run(run(1295))
+    assert (statements.misses, statements.hits) == (1, 1)
+    assert statements.stats().size == 1
+    assert cursor.executed.count("SELECT %s;") == 2
+    assert len([s for s in cursor.executed if s.startswith('PREPARE')]) == 1
+    # The variables of the params are reset by the round trip of EXECUTE,
+    # or by one of their own when it fails
+    statements, cursor = asyncio.run(run(None, 'DEALLOCATE'))
+    assert (statements.misses, statements.hits) == (1, 1)
+    assert cursor.executed[-1] == (
+        "SET @helo_p0 = %s; EXECUTE `helo_stmt_1` USING @helo_p0; "
+        "SET @helo_p0 = NULL"
+    )
+    assert cursor.connection.results == 2
+    statements, cursor = asyncio.run(run(1210, 'EXECUTE'))
+    assert cursor.executed[-1] == "SET @helo_p0 = NULL"
+    assert cursor.connection.results == 0
+
+
+@pytest.mark.asyncio
+async def test_replicas():
+
+    async def init():
+        await db.execute(SETUP_QUERY)
+
+    async def clear():
+        await db.execute(TEARDOWN_QUERY)
+
+    url = db.EnvKey.get()
+    async with db.Binder(init=init, clear=clear, replicas=[url, url], maxsize=5):
+        state = db.state()
+        assert state.balance == 'roundrobin'
+        assert len(state.replicas) == 2
+        assert state.replicas[0].maxsize == 5
+
+        read = _builder.Query("SELECT * FROM `user`;")
+        write = _builder.Query("DELETE FROM `user` WHERE `id` = %s;", [1])
+        primary, replicas = db.Executer.pool, db.Executer.replicas
+        assert db.Executer.route(write) is primary
+        assert db.Executer.route(read, use_primary=True) is primary
+        picked = {id(db.Executer.route(read)) for _ in range(4)}
+        assert picked == {id(r) for r in replicas}
+
+        await db.execute(
+            _builder.Query(
+                "INSERT INTO `user` (`name`, `age`) VALUES (%s, %s);",
+                params=['at7h', 22]
+            ))
+        users = await db.execute(read)
+        assert users.count == 1
+        users = await db.execute(read, use_primary=True)
+        assert users.count == 1
+
+    async with db.Binder(replicas=[url], balance='leastbusy'):
+        replica = db.Executer.replicas[0]
+        assert db.Executer.route(_builder.Query("SELECT 1;")) is replica
+
+    try:
+        await db.binding(url, replicas=[url], balance='random')
+        assert False, 'Should raise ValueError'
+    except ValueError:
+        pass
+    assert db.isbound() is False
+
+
+def test_transaction_streams():
+
+    async def run():
+        tx = db.Transaction()
+        tx.ensure_free()
+        tx.streams.add(asyncio.current_task())
+        try:
+            tx.ensure_free()
+            assert False, "Should raise NotAllowedError"
+        except err.NotAllowedError:
+            pass
+        # The other tasks wait for the connection
+        async def other():
+            tx.ensure_free()
+
+        await asyncio.ensure_future(other())
+
+    asyncio.run(run())
+
+
+@pytest.mark.asyncio
+async def test_transaction():
+
+    async def init():
+        await db.execute(SETUP_QUERY)
+
+    async def clear():
+        await db.execute(TEARDOWN_QUERY)
+
+    insert = "INSERT INTO `user` (`name`, `age`) VALUES (%s, %s);"
+    count = _builder.Query("SELECT COUNT(*) AS `c` FROM `user`;")
+
+    async with db.Binder(init=init, clear=clear):
+        async with db.transaction() as tx:
+            assert db.current_transaction() is tx
+            await db.execute(_builder.Query(insert, ['at7h', 22]))
+            await db.execute(_builder.Query(insert, ['gaven', 23]))
+            assert (await db.execute(count, rows=1)).c == 2
+            async with db.Executer.connect() as (_pool, conn):
+                assert conn is tx.connection
+        assert db.current_transaction() is None
+        assert (await db.execute(count, rows=1)).c == 2
+
+        try:
+            async with db.transaction():
+                await db.execute(_builder.Query(insert, ['mejer', 24]))
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        assert (await db.execute(count, rows=1)).c == 2
+
+        async with G().transaction():
+            await db.execute(_builder.Query(insert, ['mejer', 24]))
+            try:
+                async with db.transaction() as sp:
+                    assert sp.savepoint == 'helo_sp_1'
+                    await db.execute(_builder.Query(insert, ['suwei', 35]))
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            async with db.transaction():
+                await db.execute(_builder.Query(insert, ['keyoxu', 28]))
+        users = await db.execute(
+            _builder.Query("SELECT `name` FROM `user` ORDER BY `id`;"))
+        assert [u.name for u in users] == ['at7h', 'gaven', 'mejer', 'keyoxu']
+
+        # Concurrent nested blocks of the child tasks, the second
+        # releases its savepoint before the first rolls back to its own
+        entered, released = asyncio.Event(), asyncio.Event()
+
+        async def first():
+            async with db.transaction() as sp:
+                await db.execute(_builder.Query(insert, ['first', 1]))
+                entered.set()
+                await released.wait()
+                raise RuntimeError(sp.savepoint)
+
+        async def second():
+            await entered.wait()
+            async with db.transaction() as sp:
+                await db.execute(_builder.Query(insert, ['second', 2]))
+            released.set()
+            return sp.savepoint
+
+        async with db.transaction():
+            results = await asyncio.gather(
+                first(), second(), return_exceptions=True
+            )
+            assert isinstance(results[0], RuntimeError)
+            assert {results[0].args[0], results[1]} == {
+                'helo_sp_1', 'helo_sp_2'
+            }
+            assert (await db.execute(count, rows=1)).c == 4
+
+        try:
+            async with db.transaction():
+                await db.execute(_builder.Query(insert, ['at7h', 22]))
+            assert False, "Should raise IntegrityError"
+        except err.IntegrityError:
+            pass
+        assert db.state().size == db.state().freesize
+
+
+@pytest.mark.asyncio
+async def test_singleflight():
+
+    async def init():
+        await db.execute(SETUP_QUERY)
+        await db.execute(_builder.Query(
+            "INSERT INTO `user` (`name`, `age`) VALUES (%s, %s);",
+            params=('at7h', 22)
+        ))
+
+    async def clear():
+        await db.execute(TEARDOWN_QUERY)
+
+    async with db.Binder(init=init, clear=clear, singleflight=True):
+        query = _builder.Query(
+            "SELECT `name`, SLEEP(0.2) AS `s` FROM `user` WHERE `age` = %s;",
+            params=(22,)
+        )
+        start = datetime.datetime.now()
+        results = await asyncio.gather(
+            *[db.execute(query) for _ in range(20)]
+        )
+        # 20 concurrent queries more than the 15 connections of the pool
+        assert datetime.datetime.now() - start < datetime.timedelta(seconds=0.4)
+        assert all(r == [{'name': 'at7h', 's': 0}] for r in results)
+        results[0][0].name = 'mejor'
+        assert results[1][0].name == 'at7h'
+        assert not db.Executer._flights
+
+        user = await db.execute(query, rows=1, singleflight=False)
+        assert user.name == 'at7h'
+
+
+@pytest.mark.asyncio
+async def test_metrics():
+
+    async def init():
+        await db.execute(SETUP_QUERY)
+
+    async def clear():
+        await db.execute(TEARDOWN_QUERY)
+
+    insert = "INSERT INTO `user` (`name`, `age`) VALUES (%s, %s);"
+    select = "SELECT * FROM `user`  WHERE `age` > %s;"
+
+    async with db.Binder(init=init, clear=clear):
+        db.metrics(reset=True)
+        await db.execute(_builder.Query(insert, ['at7h', 22]))
+        await db.execute(_builder.Query(insert, ['gaven', 23]))
+        assert len(await db.execute(_builder.Query(select, [0]))) == 2
+        try:
+            await db.execute(_builder.Query(insert, ['at7h', 22]))
+            assert False, "Should raise IntegrityError"
+        except err.IntegrityError:
+            pass
+
+        metrics = db.metrics()
+        assert metrics.pool == db.state()
+        assert metrics.acquire.count == metrics.hold.count == 4
+        stmt = metrics.statements[_builder.Query(insert).digest]
+        assert stmt.text == "INSERT INTO `user` (`name`, `age`) VALUES (...);"
+        assert stmt.count == 3 and stmt.rows == 2 and stmt.errors == 1
+        stmt = metrics.statements[_builder.fingerprint(select)]
+        assert stmt.text == "SELECT * FROM `user` WHERE `age` > ?;"
+        assert stmt.count == 1 and stmt.rows == 2 and stmt.errors == 0
+        assert stmt.latency.buckets[-1] == (float('inf'), 1)
+        assert metrics.errors == {'IntegrityError': 1}
+        assert 'helo_errors_total{error="IntegrityError"} 1' in db.prometheus()
+        assert G().metrics(reset=True).errors == {'IntegrityError': 1}
+        assert db.metrics().errors == {}
+
+
+def test_render_metrics():
+    metrics = _metrics.Metrics()
+    metrics.statement("SELECT 1;", 0.003, 1)
+    metrics.statement("SELECT 2;", 0.2, 1)
+    metrics.statement('SELECT "x";', 20, error=True)
+    metrics.acquire.observe(0.0001)
+    metrics.error('ProgrammingError')
+    metrics.cancel('closed')
+    snapshot = metrics.snapshot()
+    digest = _builder.fingerprint("SELECT 1;")
+    stmt = snapshot.statements[digest]
+    assert stmt.text == "SELECT ?;"
+    assert stmt.count == 3 and stmt.rows == 2 and stmt.errors == 1
+    assert dict(stmt.latency.buckets)[0.0025] == 0
+    assert dict(stmt.latency.buckets)[0.005] == 1
+    assert dict(stmt.latency.buckets)[10.0] == 2
+    assert stmt.latency.buckets[-1] == (float('inf'), 3)
+
+    text = _metrics.render(snapshot)
+    assert '# TYPE helo_statement_seconds histogram' in text
+    assert f'helo_statement_info{{digest="{digest}",statement="SELECT ?;"}} 1' \
+        in text
+    assert f'helo_statement_seconds_bucket{{digest="{digest}",le="0.005"}} 1' \
+        in text
+    assert f'helo_statement_seconds_bucket{{digest="{digest}",le="+Inf"}} 3' \
+        in text
+    assert f'helo_statement_rows_total{{digest="{digest}"}} 2' in text
+    assert 'helo_pool_acquire_seconds_count 1' in text
+    assert 'helo_errors_total{error="ProgrammingError"} 1' in text
+    assert 'helo_cancelled_connections_total{action="closed"} 1' in text
+    assert 'helo_pool_size' not in text
+    assert _metrics._labels((('d', 'a"b\\c\n'),)) == '{d="a\\"b\\\\c\\n"}'
+
+    metrics.reset()
+    snapshot = metrics.snapshot()
+    assert snapshot.acquire.count == 0 and not snapshot.statements
+    assert not snapshot.errors and not snapshot.cancelled
+
+
+@pytest.mark.asyncio
+async def test_slowlog():
+
+    async def init():
+        await db.execute(SETUP_QUERY)
+
+    async def clear():
+        await db.execute(TEARDOWN_QUERY)
+
+    insert = "INSERT INTO `user` (`name`, `age`) VALUES (%s, %s);"
+    select = "SELECT `name`, SLEEP(%s) AS `s` FROM `user` WHERE `age` = 22;"
+    slowlog = dict(threshold=0.1, explain=True)
+
+    async with db.Binder(init=init, clear=clear, slowlog=slowlog):
+        await db.execute(_builder.Query(insert, ['at7h', 22]))
+        await db.execute(_builder.Query(select, [0]))
+        assert len(db.slowlog()) == 0
+        await db.execute(_builder.Query(select, [0.2]))
+        assert len(db.slowlog()) == 1
+        record = db.slowlog().records()[0]
+        assert record.digest == _builder.Query(select).digest
+        assert record.params == (0.2,)
+        assert record.rows == 1 and record.seconds >= 0.2
+        assert record.error is None
+        await asyncio.sleep(0.1)
+        assert 'query_block' in record.explain
+        assert G().slowlog is db.slowlog()
+
+    async with db.Binder():
+        assert db.slowlog() is None
+
+
+def test_slowlog_explain(monkeypatch):
+
+    class Pool:
+        def __init__(self):
+            self.acquired = 0
+
+        @asynccontextmanager
+        async def acquire(self):
+            self.acquired += 1
+            await asyncio.sleep(10)
+            yield
+
+    async def run():
+        pool = Pool()
+        select = "SELECT SLEEP(%s);"
+        for _ in range(3):
+            db.Executer._observe(pool, select, (1,), None, None, 0.0, 0.0)
+        for i in range(2 * db._EXPLAIN_LIMIT):
+            db.Executer._observe(
+                pool, f"SELECT * FROM `t{i}`;", (), None, None, 0.0, 0.0
+            )
+        # One capture per digest, a bounded number of them at once
+        assert len(db.Executer._explains) == db._EXPLAIN_LIMIT
+        await asyncio.gather(*db.Executer._explains.values())
+        assert not db.Executer._explains
+        return pool
+
+    monkeypatch.setattr(db, '_EXPLAIN_TIMEOUT', 0.05)
+    monkeypatch.setattr(
+        db.Executer, 'slowlog', _slowlog.SlowLog(threshold=0, explain=True)
+    )
+    pool = asyncio.run(run())
+    assert pool.acquired == db._EXPLAIN_LIMIT
+    records = db.Executer.slowlog.records()
+    assert len(records) == 3 + 2 * db._EXPLAIN_LIMIT
+    explained = [r for r in records if r.explain is not None]
+    assert len(explained) == db._EXPLAIN_LIMIT
+    assert all('timeout' in r.explain.error for r in explained)
+
+
+def test_slowlog_records():
+    slowlog = _slowlog.SlowLog(threshold=0.1, maxsize=3)
+    assert slowlog.record("SELECT 1;", (), 0.01) is None
+    for i in range(4):
+        slowlog.record(
+            "SELECT * FROM `t` WHERE `id` = %s;", (i,), 0.1 + i, rows=1
+        )
+    slowlog.record("SELECT * FROM `a` LIMIT 1;", None, 0.2)
+    assert len(slowlog) == 3
+    assert slowlog.stats().dropped == 2
+    records = slowlog.records(
+        digest=_builder.fingerprint("SELECT * FROM `t` WHERE `id` = 1;")
+    )
+    assert [r.params for r in records] == [(3,), (2,)]
+    assert [r.params for r in slowlog.records(seconds=2, limit=1)] == [(3,)]
+    assert slowlog.records(since=records[0].time)
+
+    path = os.path.join(tempfile.mkdtemp(), 'slow.jsonl')
+    assert slowlog.dump(path, clear=True) == 3
+    assert len(slowlog) == 0
+    with open(path, encoding='utf-8') as fp:
+        lines = [json.loads(line) for line in fp]
+    assert [line['params'] for line in lines] == [[2], [3], []]
+    assert lines[-1]['digest'] == _builder.fingerprint(
+        "SELECT * FROM `a` LIMIT 2;"
+    )
+
+    slowlog = _slowlog.SlowLog(threshold=0, redact=True)
+    record = slowlog.record("SELECT 'at7h', %s;", ('secret',), 0)
+    assert record.sql == "SELECT ?, ?;"
+    assert record.params == ('<str>',)
+    for kwargs in ({'threshold': -1}, {'sample': 0}, {'maxsize': 0}):
+        try:
+            _slowlog.SlowLog(**kwargs)
+            assert False, "Should raise ValueError"
+        except ValueError:
+            pass
+
+
+def test_query_log():
+
+    class Handler(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.records = []
+
+        def emit(self, record):
+            self.records.append(record)
+
+    logger = logging.getLogger('helo.test_query_log')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = Handler()
+    logger.addHandler(handler)
+    query = _builder.Query("SELECT * FROM `user` WHERE `id` = %s;", (1,))
+
+    other = _builder.Query("SELECT * FROM `post`;")
+
+    querylog = _logging.QueryLog(logger, rate=2)
+    assert [querylog.log(query) for _ in range(3)] == [True, True, False]
+    assert querylog.log(other) is True
+    querylog._buckets.get(query.digest)[1] -= 1
+    assert querylog.log(query) is True
+    record = handler.records[-1]
+    assert record.getMessage() == f"{query} (suppressed 1)"
+    assert handler.records[0].getMessage() == str(query)
+    assert record.sql == query.sql and record.params == (1,)
+    assert record.digest == query.digest and record.suppressed == 1
+    assert len(handler.records) == 4
+    text = _logging.ColoredFormatter().format(
+        logging.makeLogRecord(record.__dict__)
+    )
+    assert text.endswith(f"{query} (suppressed 1)")
+
+    # A fractional rate lets one record through every 1 / rate seconds
+    querylog = _logging.QueryLog(logger, rate=0.5)
+    assert [querylog.log(query) for _ in range(2)] == [True, False]
+    querylog._buckets.get(query.digest)[1] -= 1
+    assert querylog.log(query) is False
+    querylog._buckets.get(query.digest)[1] -= 1
+    assert querylog.log(query) is True
+    assert handler.records[-1].suppressed == 2
+
+    querylog.reset(sample=0.5)
+    logged = sum(querylog.log(query) for _ in range(1000))
+    assert 300 < logged < 700
+    logger.setLevel(logging.WARNING)
+    querylog.reset()
+    assert querylog.log(query) is False
+
+    line = json.loads(_logging.JSONFormatter().format(record))
+    assert line['message'] == f"{query} (suppressed 1)"
+    assert line['level'] == 'INFO' and line['logger'] == logger.name
+    assert line['params'] == [1] and line['suppressed'] == 1
+
+    for options in ({'sample': 0}, {'rate': 0}, {'format': 'xml'}):
+        try:
+            _logging.configure(**options)
+            assert False, "Should raise ValueError"
+        except ValueError:
+            pass
+
+
+def test_deadline_kill(monkeypatch):
+
+    class Pool:
+        _connmeta = {}
+
+    class Connection:
+        closed = False
+
+        def thread_id(self):
+            return 42
+
+        def close(self):
+            self.closed = True
+
+    async def connect(**_):
+        await asyncio.sleep(10)
+
+    async def run():
+        deadline = db.Deadline(0.01)
+        deadline.watch(Pool(), Connection())
+        try:
+            await asyncio.sleep(1)
+            assert False, "Should be cancelled"
+        except asyncio.CancelledError:
+            deadline.uncancel()
+        assert deadline.expired
+        started = time.perf_counter()
+        await deadline.kill(0.05)
+        return time.perf_counter() - started
+
+    # The side connection of the KILL QUERY hangs, the kill gives up
+    monkeypatch.setattr(db.aiomysql, 'connect', connect)
+    assert asyncio.run(run()) < 0.5
+
+
+@pytest.mark.asyncio
+async def test_timeout():
+
+    async def init():
+        await db.execute(SETUP_QUERY)
+        await db.execute(_builder.Query(
+            "INSERT INTO `user` (`name`, `age`) VALUES (%s, %s);",
+            params=('at7h', 22)
+        ))
+
+    async def clear():
+        await db.execute(TEARDOWN_QUERY)
+
+    sleep = "SELECT `name`, SLEEP(%s) AS `s` FROM `user`;"
+    async with db.Binder(init=init, clear=clear, timeout=0.5):
+        assert db.Executer.timeout == 0.5
+        users = await db.execute(_builder.Query(sleep, [0]), timeout=0.2)
+        assert users[0].name == 'at7h'
+
+        for query, timeout in (
+            (_builder.Query(sleep, [1]), 0.2),
+            (_builder.Query(sleep, [1]), None),
+            (_builder.Query("DO SLEEP(%s);", [1]), 0.2),
+        ):
+            start = datetime.datetime.now()
+            try:
+                await db.execute(query, timeout=timeout)
+                assert False, "Should raise QueryTimeout"
+            except err.QueryTimeout:
+                pass
+            assert datetime.datetime.now() - start < datetime.timedelta(
+                seconds=0.8
+            )
+        # The connections of the killed queries are discarded
+        assert db.state().size == db.state().freesize
+        processes = await db.execute(
+            _builder.Query("SHOW PROCESSLIST;"), timeout=1
+        )
+        assert not [p for p in processes if (p.Info or '').find('SLEEP') > 0]
+        assert db.metrics().errors.get('QueryTimeout', 0) >= 3
+
+        # The transaction is rolled back by the server
+        try:
+            async with db.transaction():
+                await db.execute(_builder.Query(
+                    "UPDATE `user` SET `age` = %s;", [23]
+                ))
+                await db.execute(_builder.Query(sleep, [1]), timeout=0.2)
+            assert False, "Should raise QueryTimeout"
+        except err.QueryTimeout:
+            pass
+        assert db.state().size == db.state().freesize
+        user = await db.execute(_builder.Query(sleep, [0]), rows=1)
+        assert user.name == 'at7h'
+
+        try:
+            await db.execute(_builder.Query(sleep, [0]), timeout=0)
+            assert False, "Should raise ValueError"
+        except ValueError:
+            pass
+
+
+@pytest.mark.asyncio
+async def test_cancel():
+
+    async def init():
+        await db.execute(SETUP_QUERY)
+        await db.execute(_builder.Query(
+            "INSERT INTO `user` (`name`, `age`) VALUES (%s, %s);",
+            params=('at7h', 22)
+        ))
+
+    async def clear():
+        await db.execute(TEARDOWN_QUERY)
+
+    sleep = "SELECT `name`, SLEEP(%s) AS `s` FROM `user`;"
+
+    async def cancel(coro, delay=0.1):
+        task = asyncio.ensure_future(coro)
+        await asyncio.sleep(delay)
+        task.cancel()
+        try:
+            await task
+            assert False, "Should raise CancelledError"
+        except asyncio.CancelledError:
+            pass
+
+    async def update(age, delay=0):
+        async with db.transaction():
+            await db.execute(_builder.Query(
+                "UPDATE `user` SET `age` = %s;", [age]
+            ))
+            await asyncio.sleep(delay)
+            await db.execute(_builder.Query(sleep, [1]))
+
+    async with db.Binder(init=init, clear=clear, maxsize=2):
+        db.metrics(reset=True)
+
+        # Cancelled mid-statement, the connection is not reused
+        await cancel(db.execute(_builder.Query(sleep, [1])))
+        await cancel(db.execute(_builder.Query("DO SLEEP(%s);", [1])))
+        await cancel(update(23))
+        assert db.metrics().cancelled == {'closed': 3}
+        assert db.state().size == db.state().freesize
+        # Cancelled between its statements, the transaction is rolled back
+        await cancel(update(24, delay=1))
+        assert db.metrics().cancelled == {'closed': 3, 'rolledback': 1}
+        assert db.state().size == db.state().freesize
+
+        for _ in range(4):
+            user = await db.execute(
+                _builder.Query("SELECT * FROM `user`;"), rows=1
+            )
+            assert user.name == 'at7h' and user.age == 22
+
+
+def test_query_timeout_error():
+    import pymysql
+
+    try:
+        raise pymysql.err.OperationalError(
+            3024, "Query execution was interrupted, maximum statement "
+                  "execution time exceeded"
+        )
+    except pymysql.err.OperationalError:
+        exc = db._ExcAdapter.err()
+    assert isinstance(exc, err.QueryTimeout)
+    assert isinstance(exc, err.OperationalError)
+    try:
+        raise pymysql.err.OperationalError(2013, "Lost connection")
+    except pymysql.err.OperationalError:
+        exc = db._ExcAdapter.err()
+    assert type(exc) is err.OperationalError
+
+
+def test_row():
+    import pickle
+
+    rowclass = db.Row.of(('id', 'name'))
+    assert db.Row.of(('id', 'name')) is rowclass
+    row = rowclass((1, 'at7h'))
+    assert row.id == row['id'] == row[0] == 1
+    assert row.name == row.get('name') == 'at7h'
+    assert row.get('age', 22) == 22
+    assert 'name' in row and 'age' not in row
+    assert dict(row) == {'id': 1, 'name': 'at7h'}
+    assert repr(row) == "Row(id=1, name='at7h')"
+    assert pickle.loads(pickle.dumps(row)) == row
+    # The columns named as the methods are read by key
+    row = db.Row.of(('id', 'count'))((1, 7))
+    assert row['count'] == row.get('count') == 7 and callable(row.count)
+    try:
+        assert row.age
+        assert False, "Should raise AttributeError"
+    except AttributeError:
+        pass
@@ -9,7 +9,7 @@ import quart
 
 import pytest
 
-from helo import EnvKey, err, util, G, ENCODING
+from helo import EnvKey, err, util, G, ENCODING, db as helo_db
 
 from . import case
 
@@ -68,6 +68,9 @@ async def test_helo():
         assert await db.create_all(case)
         ret = await db.raw('SHOW TABLES;')
         assert ret.count == 7
+        ret = await db.raw('SHOW TABLES;', rowtype='compact')
+        assert ret.count == 7 and isinstance(ret[0], helo_db.Row)
+        assert len(dict(ret[0])) == 1
 
         assert await db.drop_all(case)
         ret = await db.raw('SHOW TABLES;')
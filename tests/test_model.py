@@ -4,14 +4,21 @@
 Tests for model module
 """
 
+import array
 import asyncio
+import csv
 import datetime
+import gzip
+import json
+import os
+import tempfile
+import time
 
 import pytest
 
 from helo import (
     db, types as t, err, util, _builder,
-    Model, JOINTYPE, ENCODING, ENGINE
+    Model, JOINTYPE, ENCODING, ENGINE, F
 )
 
 from .case import People, Employee, User, Role, deltanow
@@ -57,6 +64,14 @@ class TestModel:
         await self.for_replace()
         await self.for_mreplace()
         await self.for_aiter()
+        await self.for_stream()
+        await self.for_seek()
+        await self.for_upsert()
+        await self.for_rowcache()
+        await self.for_cached()
+        await self.for_bulk_insert()
+        await self.for_export()
+        await self.for_columns_result()
 
     async def for_ddl(self):
         try:
@@ -135,6 +150,23 @@ class TestModel:
         assert user.password == 'xxxx'
         assert user.age == 18
         assert user.gender == 0
+        # Only the changed column is updated, an unchanged object
+        # issues no statement
+        db.metrics(reset=True)
+        user.nickname = 'hehe'
+        assert (await user.save()) == 2
+        update = User.update(nickname='hehe').where(User.id == 2).query
+        statements = db.metrics().statements
+        assert list(statements) == [update.digest]
+        assert statements[update.digest].text == (
+            "UPDATE `helo`.`user_` SET `nickname` = ? WHERE (`id` = ?);"
+        )
+        assert statements[update.digest].count == 1
+        assert (await user.save()) == 2
+        assert db.metrics().statements[update.digest].count == 1
+        assert len(db.metrics().statements) == 1
+        user = await User.get(2)
+        assert user.nickname == 'hehe' and user.age == 18
 
         try:
             user = User(
@@ -223,6 +255,25 @@ class TestModel:
         assert await User.get(()) is None
         assert await User.get([]) is None
 
+        class BatchUser(User):
+            class Meta:
+                db = 'helo'
+                name = 'user_'
+                batch_get = 2
+
+        users = await asyncio.gather(
+            BatchUser.get(1), BatchUser.get(4),
+            BatchUser.get(4), BatchUser.get(10000),
+        )
+        assert repr(users) == (
+            "[<BatchUser object at 1>, <BatchUser object at 4>, "
+            "<BatchUser object at 4>, None]"
+        )
+        assert users[1] is not users[2]
+        assert users[1].name == users[2].name == 'keyoxu'
+        async with db.transaction():
+            assert (await BatchUser.get(4)).name == 'keyoxu'
+
     async def for_mget(self):
         # no 3
         user_ids = [1, 2, 3, 4]
@@ -1241,15 +1292,373 @@ class TestModel:
             count += 1
         assert count == allc
 
+        # Sorted by a column not selected or with NULLs (the users
+        # added above have no age), iterated by offset past a batch
+        count = 0
+        async for user in User.select(User.id).order_by(User.age):
+            count += 1
+        assert count == allc
+        count = 0
+        async for user in User.select().order_by(User.age):
+            count += 1
+        assert count == allc
+
+        # Without the row cache, read from the database
+        assert (await User[1]).name == 'at7h'
+        assert user not in User and 1 not in User
+        assert not User.iscached(1)
+
+    async def for_stream(self):
+        allc = await User.select().count()
+        count = 0
+        async for user in User.select().stream(batch_size=7):
+            assert isinstance(user, User)
+            if user.id == 1:
+                assert user.name == 'at7h'
+            count += 1
+        assert count == allc
+
+        async for user in User.select().where(User.id < 0).stream():
+            assert False, "Should yield no rows"
+
+        names = []
+        async for user in User.select(
+            User.id, User.name.as_('username')
+        ).where(User.id < 3).stream(wrap=False):
+            assert isinstance(user, util.adict)
+            names.append(user.name)
+        assert names == ['at7h', 'mejor']
+
+        size = db.state().size
+        rows = User.select().stream(batch_size=2)
+        async for user in rows:
+            break
+        await rows.aclose()
+        assert db.state().size == size - 1
+        assert db.state().freesize == db.state().size
+
+        # The connection of a transaction is held by its stream
+        async with db.transaction():
+            rows = User.select().stream(batch_size=2)
+            async for user in rows:
+                try:
+                    await User.get(1)
+                    assert False, "Should raise NotAllowedError"
+                except err.NotAllowedError:
+                    pass
+                break
+            await rows.aclose()
+            assert (await User.get(1)).name == 'at7h'
+
+        try:
+            async for user in User.select().stream(batch_size=0):
+                pass
+            assert False, "Should raise ValueError"
+        except ValueError:
+            pass
+
+    async def for_seek(self):
+        allc = await User.select().count()
+        ids, after = [], None
+        while True:
+            page = await User.select().seek(after=after, size=30)
+            ids.extend(u.id for u in page)
+            if page.cursor is None:
+                break
+            after = page.cursor
+        assert len(ids) == allc
+        assert ids == sorted(ids)
+
+        page = await User.select().order_by(User.id.desc()).seek(size=2)
+        assert page[0].id > page[1].id
+        nextp = await User.select().order_by(
+            User.id.desc()).seek(after=page[-1], size=2, wrap=False)
+        assert isinstance(nextp[0], util.adict)
+        assert nextp[0].id < page[1].id
+
         try:
-            assert User[1]
-            assert False, "Should raise NotImplementedError"
-        except NotImplementedError:
+            await User.select().order_by(
+                User.id.desc(), User.name).seek()
+            assert False, "Should raise ProgrammingError"
+        except err.ProgrammingError:
             pass
+
+    async def for_upsert(self):
+        ret = await User.upsert(nickname='upsert1', name='u1', age=1)
+        assert ret == {'inserted': 1, 'updated': 0}
+        ret = await User.upsert(
+            nickname='upsert1', name='u2', update=['name'])
+        assert ret == {'inserted': 0, 'updated': 1}
+        user = await User.get(User.nickname == 'upsert1')
+        assert user.name == 'u2' and user.age == 1
+
+        ret = await User.upsert(
+            nickname='upsert1', age=2,
+            update={'age': User.age + F.VALUES(User.age)}
+        )
+        assert ret.updated == 1
+        assert (await User.get(user.id)).age == 3
+
+        ret = await User.mupsert([
+            {'nickname': 'upsert1', 'age': 5},
+            {'nickname': 'upsert2', 'age': 6},
+        ], update=[User.age])
+        assert ret == {'inserted': 1, 'updated': 1}
+        assert (await User.get(user.id)).age == 5
+
         try:
-            assert user in User
-            assert False, "Should raise NotImplementedError"
-        except NotImplementedError:
+            await User.mupsert(
+                [{'nickname': 'upsert1'}], update={'age': User.age + 1})
+            assert False, "Should raise ValueError"
+        except ValueError:
+            pass
+
+    async def for_rowcache(self):
+
+        class CachedUser(User):
+            class Meta:
+                db = 'helo'
+                name = 'user_'
+                cache_size = 10
+
+        user = await CachedUser.get(1)
+        assert (await CachedUser[1]).name == user.name
+        assert 1 in CachedUser
+        assert CachedUser.cachestats().hits == 1
+        users = await CachedUser.mget([4, 1, 10000])
+        assert repr(users) == (
+            "[<CachedUser object at 4>, <CachedUser object at 1>]")
+        assert 4 in CachedUser
+
+        await CachedUser.set(1, nickname='cached')
+        assert 1 not in CachedUser and 4 in CachedUser
+        assert (await CachedUser.get(1)).nickname == 'cached'
+        await User.update(age=30).where(User.age > 100).do()
+        assert 1 not in CachedUser and 4 not in CachedUser
+
+        user = await CachedUser.get(4)
+        user.age = 31
+        await user.save()
+        assert 4 not in CachedUser
+        assert (await CachedUser[4]).age == 31
+        async with db.transaction():
+            await CachedUser.get(1)
+        assert 1 not in CachedUser
+
+        # Cached by a read outside the transaction before its commit
+        written = asyncio.Event()
+
+        async def read():
+            await written.wait()
+            return await CachedUser.get(1)
+
+        reader = asyncio.ensure_future(read())
+        async with db.transaction():
+            await CachedUser.set(1, nickname='committed')
+            written.set()
+            assert (await reader).nickname == 'cached'
+            assert 1 in CachedUser
+        assert 1 not in CachedUser
+        assert (await CachedUser[1]).nickname == 'committed'
+
+    async def for_cached(self):
+        from helo.model import querycache
+
+        def query():
+            return User.select(
+                User.gender, F.COUNT(User.id).as_('num')
+            ).group_by(User.gender).order_by(User.gender).cached(ttl=10)
+
+        hits = querycache().hits
+        rows = await query().all(wrap=False)
+        total = sum(r.num for r in rows)
+        rows[0].num = -1
+        assert (await query().all(wrap=False))[0].num != -1
+        assert querycache().hits == hits + 1
+        await query().all()
+        await Role.add(name='cached')
+        await query().all()
+        assert querycache().hits == hits + 3
+        await User.add(name='cached', gender=1)
+        rows = await query().all(wrap=False)
+        assert querycache().hits == hits + 3
+        assert sum(r.num for r in rows) == total + 1
+        assert querycache().nbytes > 0
+
+        # Read outside a transaction before it commits its write, the
+        # result is not kept past the commit
+        written = asyncio.Event()
+
+        async def read():
+            await written.wait()
+            return await query().all(wrap=False)
+
+        reader = asyncio.ensure_future(read())
+        async with db.transaction():
+            await User.add(name='cached', gender=1)
+            written.set()
+            rows = await reader
+            assert sum(r.num for r in rows) == total + 1
+        rows = await query().all(wrap=False)
+        assert sum(r.num for r in rows) == total + 2
+
+        # The tables of raw SQL are declared, or the query is refused
+        def raw(**options):
+            return User.select(User.id).where(_builder.SQL(
+                "`role` IN (SELECT `id` FROM `role_`)"
+            )).cached(ttl=10, **options)
+
+        try:
+            await raw().all()
+            assert False, "Should raise NotAllowedError"
+        except err.NotAllowedError:
+            pass
+        count = len(await raw(tables=[Role]).all())
+        role = await Role.add(name='cached')
+        await User.add(name='cached', role=role)
+        assert len(await raw(tables=[Role]).all()) == count + 1
+
+    async def for_bulk_insert(self):
+
+        async def rows():
+            for i in range(250):
+                yield {'name': f'bulk{i}', 'nickname': f'bulk{i}'}
+
+        count = await User.select().count()
+        result = await User.bulk_insert(rows(), chunk_rows=100, concurrency=2)
+        assert result.rows == result.affected == 250
+        assert [c.rows for c in result.chunks] == [100, 100, 50]
+        assert all(c.seconds > 0 and c.bytes > 0 for c in result.chunks)
+        assert await User.select().count() == count + 250
+
+        result = await User.bulk_insert(
+            [User(name='bulk', nickname=f'bulkm{i}') for i in range(10)],
+            max_bytes=200,
+        )
+        assert result.rows == 10 and len(result.chunks) > 1
+        try:
+            await User.bulk_insert(
+                ({'nickname': 'bulk0'} for _ in range(3)), chunk_rows=1)
+            assert False, "Should raise IntegrityError"
+        except err.IntegrityError:
+            pass
+        assert db.state().size == db.state().freesize
+        try:
+            await User.bulk_insert([], concurrency=0)
+            assert False, "Should raise ValueError"
+        except ValueError:
+            pass
+
+        try:
+            await User.load_file([('bulk',)], columns=[User.nickname])
+            assert False, "Should raise NotAllowedError"
+        except err.NotAllowedError:
+            pass
+
+    async def for_export(self):
+        query = User.select(
+            User.id, User.nickname, User.lastlogin
+        ).where(User.id < 100)
+        count = await User.select().where(User.id < 100).count()
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'users.csv')
+            result = await query.export(path, batch_size=7)
+            assert result.rows == count
+            assert result.bytes == result.size == os.path.getsize(path)
+            with open(path, newline='') as fp:
+                lines = list(csv.reader(fp))
+            assert lines[0] == ['id', 'nickname', 'loginat']
+            assert len(lines) == count + 1
+
+            path = os.path.join(tmp, 'users.jsonl.gz')
+            result = await query.export(path, format='jsonl')
+            with gzip.open(path, 'rt') as fp:
+                rows = [json.loads(line) for line in fp]
+            assert result.rows == len(rows) == count
+            assert result.size < result.bytes
+            user = await User.get(rows[0]['id'])
+            assert rows[0]['nickname'] == user.nickname
+            assert rows[0]['loginat'] == User.lastlogin.to_str(user.lastlogin)
+
+            # Without rows, the header is written all the same
+            path = os.path.join(tmp, 'none.csv')
+            result = await query.where(User.id < 0).export(path)
+            assert result.rows == 0
+            with open(path, newline='') as fp:
+                assert list(csv.reader(fp)) == [['id', 'nickname', 'loginat']]
+        try:
+            await query.export('users.xml', format='xml')
+            assert False, "Should raise ValueError"
+        except ValueError:
+            pass
+
+    async def for_columns_result(self):
+        users = await User.select().where(User.id < 100).order_by(User.id).all()
+        cols = await User.select(
+            User.id, User.name, User.age, User.lastlogin
+        ).where(User.id < 100).order_by(User.id).columns_result()
+        assert list(cols) == ['id', 'name', 'age', 'loginat']
+        assert isinstance(cols.id, array.array)
+        assert list(cols.id) == [u.id for u in users]
+        assert cols.name == [u.name for u in users]
+        assert cols.loginat[0] == users[0].lastlogin
+
+        cols = await User.select(User.id).where(User.id < 0).columns_result()
+        assert list(cols.id) == []
+
+        rows = await User.select(User.id, User.name).where(
+            User.id < 100).order_by(User.id).all(wrap=False, rowtype='compact')
+        assert isinstance(rows[0], db.Row)
+        assert [(r.id, r['name']) for r in rows] == [
+            (u.id, u.name) for u in users]
+        assert dict(rows[0]) == {'id': users[0].id, 'name': users[0].name}
+        try:
+            await User.select().all(rowtype='compact')
+            assert False, "Should raise ValueError"
+        except ValueError:
+            pass
+
+
+@pytest.mark.asyncio
+async def test_load_file(tmp_path):
+
+    async def init():
+        await People.create()
+
+    async def clear():
+        await People.drop()
+
+    async with db.Binder(init=init, clear=clear, local_infile=True):
+        path = tmp_path / 'people.csv'
+        path.write_text('name,gender,age\nat7h,1,22\n"mejor, jr",0,\n')
+        assert await People.load_file(str(path)) == 2
+        path = tmp_path / 'people.tsv'
+        path.write_text('keyoxu\t1\t28\n')
+        assert await People.load_file(
+            path, columns=['name', People.gender, People.age], format='tsv'
+        ) == 1
+
+        async def rows():
+            for i in range(100):
+                yield {'name': f'n\t{i}\\', 'gender': i % 2, 'age': i}
+
+        assert await People.load_file(rows()) == 100
+        assert await People.load_file(
+            (('suwei', 0, 30), ('gaven', 1, None)),
+            columns=[People.name, People.gender, People.age]
+        ) == 2
+        assert await People.load_file([]) == 0
+
+        people = await People.select().order_by(People.id).all()
+        assert people.count == 105
+        assert [p.name for p in people[:3]] == ['at7h', 'mejor, jr', 'keyoxu']
+        assert people[1].age is None and people[2].age == 28
+        assert people[3].name == 'n\t0\\' and people[-1].age is None
+
+        try:
+            await People.load_file([], format='xml')
+            assert False, "Should raise ValueError"
+        except ValueError:
             pass
 
 
@@ -1379,9 +1788,27 @@ def test_model():
     except TypeError:
         pass
 
+    try:
+        class TM5(Model):
+            class Meta:
+                batch_get = -1
+
+            tp = t.Auto()
+        assert False, "Should raise ValueError"
+    except ValueError:
+        pass
+
     class TM4(Model):
         pk = t.Auto()
     assert get_table(TM4).name == 'tm4'
+    assert TM4.__batcher__ is None
+
+    class TM6(Model):
+        pk = t.Auto()
+
+        class Meta:
+            batch_get = True
+    assert TM6.__batcher__.maxsize == 100
 
     assert repr(User) == "Model<User>"
     assert str(User) == "User"
@@ -1461,3 +1888,188 @@ def test_model_instance():
     }
     user.lastlogin = '2020-01-01 00:00:00'
     assert user.lastlogin == create_at
+
+
+def test_loader():
+    from helo.model import Loader
+
+    login = datetime.datetime(2020, 1, 1, 0, 0, 0)
+    rows = db.FetchResult([
+        util.adict(id=1, pwd='xxx', username='at7h', loginat=login),
+        util.adict(id=2, pwd=1234, username='mejor', loginat=None),
+    ])
+    users = Loader(rows, User, {'username': 'name'}).do()
+    assert all(isinstance(u, User) for u in users)
+    assert users[0].__self__ == {
+        'id': 1, 'password': 'xxx', 'name': 'at7h', 'lastlogin': login
+    }
+    assert users[1].password == '1234' and users[1].lastlogin is None
+
+    rows = db.FetchResult([
+        util.adict(id=1, gender='f'), util.adict(id=2, gender=1)
+    ])
+    users = Loader(rows, User, {}).do()
+    assert isinstance(users[0], util.adict) and isinstance(users[1], User)
+
+    rows = db.FetchResult([util.adict(id=1, pct=3)])
+    assert Loader(rows, User, {}).do() == [{'id': 1, 'pct': 3}]
+
+    row = util.adict(id='1', pwd='xxx', username='at7h', pct=3)
+    row = Loader(row, User, {'username': 'name'}, wrap=False).do()
+    assert isinstance(row, util.adict)
+    assert row == {'id': 1, 'password': 'xxx', 'name': 'at7h', 'pct': 3}
+
+    class Shift(Model):
+        id = t.Auto()
+        start = t.Time()
+
+    # MySQL returns TIME columns as timedelta
+    rows = db.FetchResult([
+        util.adict(id=1, start=datetime.timedelta(hours=8, minutes=30)),
+        util.adict(id=2, start=datetime.datetime(2020, 1, 1, 9, 15)),
+        util.adict(id=3, start=datetime.time(10, 0)),
+    ])
+    shifts = Loader(rows, Shift, {}).do()
+    assert [s.start for s in shifts] == [
+        datetime.time(8, 30), datetime.time(9, 15), datetime.time(10, 0)
+    ]
+
+    class Tags(t.Text):
+        py_type = list
+
+        def py_value(self, value):
+            return json.loads(value)
+
+        def db_value(self, value):
+            return json.dumps(value)
+
+    class Doc(Model):
+        id = t.Auto()
+        tags = Tags()
+
+    # Changed in place, the value differs from the one loaded
+    doc = _load(Doc, id=1, tags='["a"]')
+    doc.tags.append('b')
+    assert doc.__origin__['tags'] == ['a'] and doc.tags == ['a', 'b']
+
+
+def test_rowcache():
+    from helo.model import RowCache, get_table
+
+    class CachedUser(User):
+        class Meta:
+            db = 'helo'
+            name = 'user_'
+            cache_size = 2
+
+    cache = CachedUser.__rowcache__
+    assert isinstance(cache, RowCache)
+    assert CachedUser.cachestats().maxsize == 2
+    assert CachedUser.cachestats().ttl == RowCache.TTL
+    assert User.cachestats() is None
+
+    user = _load(CachedUser, id=1, name='at7h')
+    assert cache.put(user, cache.generation) is True
+    assert 1 in CachedUser and '1' in CachedUser
+    assert 2 not in CachedUser and 'x' not in CachedUser
+    assert CachedUser.iscached(1) and not CachedUser.iscached(2)
+    assert user in CachedUser and not User.iscached(1)
+    cached = cache.get(1)
+    assert cached is not user and cached.name == 'at7h'
+    cached.name = 'mejor'
+    assert cache.get(1).name == 'at7h'
+
+    generation = cache.generation
+    RowCache.invalidate(get_table(User), [2])
+    assert 1 in CachedUser
+    assert cache.put(user, generation) is False
+    RowCache.invalidate(get_table(User), [1])
+    assert 1 not in CachedUser
+
+    for i in range(1, 4):
+        cache.put(_load(CachedUser, id=i), cache.generation)
+    assert 1 not in CachedUser and 3 in CachedUser
+    assert CachedUser.cachestats().evictions == 1
+    CachedUser.update(name='at7h').where(CachedUser.age > 1).__invalidate__()
+    assert CachedUser.cachestats().size == 0
+
+    try:
+        class TM(User):
+            class Meta:
+                cache_size = 2
+                cache_ttl = 0
+        assert False, "Should raise ValueError"
+    except ValueError:
+        pass
+
+
+def _load(model, **row):
+    from helo.model import Loader
+
+    return Loader(util.adict(row), model, {}).do()
+
+
+def test_querycache():
+    from helo import _cache
+    from helo.model import _tables_of
+
+    query = User.select().join(
+        Role, on=User.role == Role.id
+    ).where(User.id.in_(People.select(People.id)))
+    assert _tables_of(_builder.Context().key(query)) == (
+        ('people', 'role_', 'user_'), False)
+    query = User.select().where(User.role.in_(
+        Role.select(Role.id).where(_builder.SQL("`id` > 1"))))
+    assert _tables_of(_builder.Context().key(query)) == (
+        ('role_', 'user_'), True)
+    query = User.select().where(User.id.in_(User.select(F.COUNT(
+        _builder.SQL('1'))))).cached(tables=[Role, 'people'])
+    assert _tables_of(_builder.Context().key(query)) == (('user_',), False)
+    assert query._cachetables == ('role_', 'people')
+
+    cache = _cache.QueryCache(maxbytes=2048)
+    rows = [util.adict(id=1, name='at7h')]
+    assert cache.put('a', rows, ('user_',), 10, cache.generation(['user_']))
+    assert cache.get('a') == rows and cache.get('b') is None
+    assert cache.stats().hits == 1 and cache.stats().misses == 1
+    assert cache.nbytes == _cache.sizeof('a') + _cache.sizeof(rows)
+
+    generation = cache.generation(['user_', 'role_'])
+    cache.invalidate('user_')
+    assert cache.get('a') is None and cache.nbytes == 0
+    assert not cache.put('a', rows, ('user_', 'role_'), 10, generation)
+    assert cache.stats().invalidations == 1
+
+    assert not cache.put('big', 'x' * 4096, (), 10, ())
+    for key in 'abcde':
+        cache.put(key, 'x' * 500, ('role_',), 10, cache.generation(['role_']))
+    assert cache.nbytes <= 2048 and cache.stats().evictions > 0
+    assert cache.get('a') is None and cache.get('e') is not None
+    cache.put('f', 1, (), 0.0001, ())
+    time.sleep(0.001)
+    assert cache.get('f') is None and cache.stats().expirations == 1
+
+
+def test_column_of():
+    from helo.model import _column_of
+
+    column = _column_of(People.age, (1, 2, 255))
+    assert column.typecode == 'B' and list(column) == [1, 2, 255]
+    assert _column_of(People.id, (1, 2)).typecode == 'i'
+    assert _column_of(People.age, (1, None)) == [1, None]
+    assert _column_of(t.Double(), (1.5, 2)).typecode == 'd'
+    assert _column_of(t.Bigint(), (2 ** 40,)).typecode == 'q'
+    assert _column_of(t.VarChar(), ('a', 1)) == ['a', '1']
+    assert _column_of(None, (1, 'a')) == [1, 'a']
+    # Bigint subclasses of other python types are converted
+    assert _column_of(t.IP(), (3232235521, None)) == ['192.168.0.1', None]
+
+    class Flag(t.Tinyint):
+        __slots__ = ()
+        py_type = bool  # type: ignore
+
+        def py_value(self, value):
+            return None if value is None else bool(value)
+
+    assert _column_of(Flag(), (1, 0)) == [True, False]
+
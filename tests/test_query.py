@@ -1,14 +1,18 @@
 import datetime
 
-from helo import _builder, JOINTYPE, F, SQL
+from helo import _builder, err, util, JOINTYPE, F, SQL
+from helo.model import Create, get_table
 
-from .case import Author, Post, Column, Employee
+from .case import Author, Post, Column, Employee, User
 
 
 class TestImportantQueries:
 
     def as_query(self, node):
-        return node.__query__()
+        query = node.__query__()
+        assert query == _builder.Context.from_node(node).query_of()
+        assert node.__query__() == query
+        return query
 
     def test_select(self):
         query = Author.select(
@@ -26,8 +30,8 @@ class TestImportantQueries:
             'FROM `author` AS `t1` '
             'INNER JOIN `post` AS `t2` ON (`t1`.`id` = `t2`.`author`) '
             'WHERE ((`t1`.`name` = %s) AND (`t1`.`id` > %s)) '
-            'ORDER BY `t1`.`id` DESC  LIMIT 100 OFFSET 1;',
-            params=['at7h', 3]
+            'ORDER BY `t1`.`id` DESC  LIMIT %s OFFSET %s;',
+            params=['at7h', 3, 100, 1]
         )
 
         query = Author.select(
@@ -58,8 +62,8 @@ class TestImportantQueries:
         ).limit(1)
         assert self.as_query(query) == _builder.Query(
             'SELECT COUNT(1) FROM `post` AS `t1` WHERE ((`t1`.`created` > %s)'
-            ' AND (`t1`.`is_deleted` = %s)) LIMIT 1;',
-            params=[datetime.datetime(2019, 10, 10, 0, 0), 0]
+            ' AND (`t1`.`is_deleted` = %s)) LIMIT %s;',
+            params=[datetime.datetime(2019, 10, 10, 0, 0), 0, 1]
         )
 
         query = Author.select().where(
@@ -75,10 +79,116 @@ class TestImportantQueries:
             'SELECT * FROM `author` AS `t1` WHERE (`t1`.`id` '
             'IN (SELECT `t2`.`author` FROM `post` AS `t2` WHERE '
             '(`t2`.`id` BETWEEN %s AND %s))) ORDER BY '
-            '`t1`.`id` DESC  LIMIT 100;',
-            params=[10, 100]
+            '`t1`.`id` DESC  LIMIT %s;',
+            params=[10, 100, 100]
         )
 
+    def test_seek(self):
+        query, _ = Author.select().__seek__(None, 20)
+        assert self.as_query(query) == _builder.Query(
+            'SELECT * FROM `author` AS `t1` ORDER BY `t1`.`id` LIMIT %s;',
+            params=[20]
+        )
+
+        created = datetime.datetime(2019, 10, 10)
+        query, keys = Author.select().where(
+            Author.name == 'at7h'
+        ).order_by(
+            Author.create_at.desc()
+        ).__seek__([created, 3], 10)
+        assert keys[0] is Author.create_at and keys[1] is Author.id
+        assert self.as_query(query) == _builder.Query(
+            'SELECT * FROM `author` AS `t1` WHERE ((`t1`.`name` = %s) AND '
+            '((`t1`.`create_at`, `t1`.`id`) < (%s, %s))) ORDER BY '
+            '`t1`.`create_at` DESC , `t1`.`id` DESC  LIMIT %s;',
+            params=['at7h', created, 3, 10]
+        )
+
+        query = Author.select()
+        token = query.__seektoken__(
+            util.adict(id=3, create_at=created), keys)
+        assert query.__seekvalues__(token, keys) == ['2019-10-10 00:00:00', 3]
+        query, _ = query.order_by(
+            Author.create_at.desc()).__seek__(token, 10)
+        assert self.as_query(query).params == (created, 3, 10)
+
+        # Rows of ``wrap=False`` are keyed by the column names
+        query = User.select().order_by(User.lastlogin)
+        _, keys = query.__seek__(None, 10)
+        row = util.adict(id=3, loginat=created)
+        assert query.__seekvalues__(row, keys) == [created, 3]
+        query, _ = query.__seek__(row, 10)
+        assert self.as_query(query).params == (created, 3, 10)
+
+        query = User.select().order_by(User.lastlogin)
+        for position in ([None, 3], util.adict(id=3, loginat=None)):
+            try:
+                query.__seek__(position, 10)
+                assert False, "Should raise ValueError"
+            except ValueError:
+                pass
+        try:
+            query.__seektoken__(util.adict(id=3), keys)
+            assert False, "Should raise ProgrammingError"
+        except err.ProgrammingError:
+            pass
+
+        # Iterated by seek only when the keys make the page tokens
+        assert Author.select().__seekable__()
+        assert Author.select(Author.id, Author.name).__seekable__()
+        assert not Author.select(Author.name).__seekable__()
+        assert not Author.select(Author.id).order_by(
+            Author.name).__seekable__()
+        assert not Author.select().order_by(Author.name).__seekable__()
+        assert not Author.select().limit(10).__seekable__()
+
+        # The props of the query of a page are its own
+        query = Author.select()
+        page, _ = query.__seek__(None, 10)
+        page._props.wrap = False
+        assert 'wrap' not in query._props
+
+    def test_templates(self):
+        def query(name, id_):
+            return Author.select(Author.id).where(
+                Author.name == name, Author.id.in_([1, id_])
+            )
+
+        _builder.templates(0)
+        assert _builder.templates().maxsize == 0
+        assert self.as_query(query('at7h', 2)).params == ('at7h', (1, 2))
+
+        stats = _builder.templates(16)
+        assert stats.size == 0 and stats.maxsize == 16
+        self.as_query(query('at7h', 2))
+        hits = _builder.templates().hits
+        assert self.as_query(query('mejor', 3)) == _builder.Query(
+            'SELECT `t1`.`id` FROM `author` AS `t1` WHERE '
+            '((`t1`.`name` = %s) AND (`t1`.`id` IN %s));',
+            params=['mejor', (1, 3)]
+        )
+        assert _builder.templates().hits == hits + 2
+
+        query = Author.select(Author.name.as_('username'))
+        assert self.as_query(query) == query.__query__()
+        assert query._aliases == {'username': 'name'}
+
+        for i in range(20):
+            self.as_query(Author.select(SQL(str(i))))
+        stats = _builder.templates(512)
+        assert stats.size == 16 and stats.evictions > 0
+
+        # Nodes without a structural key are rendered every time
+        create = Create(get_table(Author))
+        try:
+            _builder.Context().key(create)
+            assert False, "Should raise Uncacheable"
+        except _builder.Uncacheable:
+            pass
+        size = _builder.templates().size
+        assert self.as_query(create) == create.__query__()
+        assert _builder.templates().size == size
+
     def test_insert(self):
         query = Column.insert(name='c1')
         assert self.as_query(query) == _builder.Query(
@@ -129,6 +239,33 @@ class TestImportantQueries:
             params=[10]
         )
 
+    def test_upsert(self):
+        from helo.model import AssignmentList
+
+        query = Author.insert(name='at7h', password='7777').on_duplicate(
+            AssignmentList({
+                'password': F.VALUES(Author.password),
+                'name': SQL('CONCAT(`name`, %s)', ['@']),
+            })
+        )
+        assert self.as_query(query) == _builder.Query(
+            'INSERT INTO `author` (`name`, `password`) VALUES (%s, %s) '
+            'ON DUPLICATE KEY UPDATE `password` = VALUES(`password`), '
+            '`name` = CONCAT(`name`, %s);',
+            params=['at7h', '7777', '@']
+        )
+
+        query = Post.minsert(
+            [('p1', 1), ('p2', 2)], columns=[Post.name, Post.author]
+        ).on_duplicate(AssignmentList({
+            'author': (Post.author + F.VALUES(Post.author))
+        }))
+        assert self.as_query(query).sql == (
+            'INSERT INTO `post` (`name`, `author`, `column`, `is_deleted`, '
+            '`created`) VALUES (%s, %s, %s, %s, %s) ON DUPLICATE KEY '
+            'UPDATE `author` = (`author` + VALUES(`author`));'
+        )
+
     def test_replace(self):
         q1 = Author.replace(name='at7h', password='7777')
         q2 = Author.replace({'name': 'at7h', 'password': '7777'})
@@ -207,3 +344,50 @@ class TestImportantQueries:
             'WHERE (`t1`.`name` LIKE %s)));',
             params=['at']
         )
+
+        query = Post.delete().where(Post.id > 10).limit(5)
+        assert self.as_query(query) == _builder.Query(
+            'DELETE FROM `post` WHERE (`id` > %s) LIMIT %s;',
+            params=[10, 5]
+        )
+
+
+def test_digest():
+    assert _builder.normalize(
+        "SELECT * FROM `t1`\n WHERE `id` IN (1, 2, 3) AND `name` = 'a''b' "
+        "AND `age` > -2.5 LIMIT 10 OFFSET %s;"
+    ) == (
+        "SELECT * FROM `t1` WHERE `id` IN (...) AND `name` = ? "
+        "AND `age` > ? LIMIT ? OFFSET ?;"
+    )
+    assert _builder.normalize(
+        "SELECT /*+ MAX_EXECUTION_TIME(100) */ `a#b` -- the '\n"
+        "FROM `t` /* a 'comment' */ WHERE `x` = '#1' AND `y` = 0x1F;"
+    ) == (
+        "SELECT /*+ MAX_EXECUTION_TIME(...) */ `a#b` "
+        "FROM `t` WHERE `x` = ? AND `y` = ?;"
+    )
+    assert _builder.normalize(
+        "INSERT INTO `t` (`a`, `b`) VALUES (%s, %s), (%s, %s);"
+    ) == "INSERT INTO `t` (`a`, `b`) VALUES (...);"
+
+    pages = [
+        Author.select().where(
+            Author.id.in_(list(range(n)))
+        ).limit(20).offset(n * 20).query
+        for n in (1, 3)
+    ]
+    assert pages[0].params != pages[1].params
+    assert pages[0].digest == pages[1].digest
+    assert len(pages[0].digest) == 16
+    assert pages[0].normalized == (
+        "SELECT * FROM `author` AS `t1` "
+        "WHERE (`t1`.`id` IN (...)) LIMIT ? OFFSET ?;"
+    )
+    assert pages[0].digest != Author.select().limit(20).query.digest
+    # Raw statements with literals aggregate with the built ones
+    assert _builder.Query(
+        "SELECT * FROM `author`  AS `t1` "
+        "WHERE (`t1`.`id` in (7, 8)) LIMIT 20 OFFSET 40;"
+    ).digest == pages[0].digest
+    assert _builder.fingerprint(pages[0].sql) == pages[0].digest